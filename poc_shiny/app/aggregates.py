@@ -0,0 +1,154 @@
+import logging
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from poc_shiny.app.cancellation import CancellationToken, get_or_compute_cancellable
+from poc_shiny.app.get_local_data import (
+    DATA_COLUMNS,
+    add_names,
+    create_table,
+    get_data_plot_map_cached,
+    get_df_plot,
+    scan_data_lazy,
+)
+from poc_shiny.app.menu_index import get_menu_index
+from poc_shiny.app.repartition import resolve_path
+from poc_shiny.app.result_cache import ResultCache
+from poc_shiny.app.storage import StorageBackend, get_backend
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+# Folder of the aggregate store, relative to the root of the data folder
+AGGREGATES_PREFIX = os.getenv("AGGREGATES_PREFIX", "aggregates")
+AGGREGATE_KINDS = ["plot", "table"]
+
+# Rows needed for the plot and the table, the geometry is only read for the map
+AGGREGATE_COLUMNS = [column for column in DATA_COLUMNS if column != "geometry"]
+
+# Aggregates are a few KB per country, keep them for every country a worker has served
+aggregates_cache = ResultCache(
+    max_bytes=int(os.getenv("AGGREGATES_CACHE_MAX_BYTES", 64 * 1024**2)),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", 3600)),
+)
+
+
+def get_aggregate_path(kind: str, type_area: str, model: str, indicator: str, adm0: str) -> str:
+    """
+    Return the path of one aggregate, relative to the root of the aggregate store.
+
+    Plain folder names (not `key=value`), so the Hive partitioning of the readers adds no column.
+    """
+    return f"{type_area}/{model}/{indicator}/{adm0}/{kind}.parquet"
+
+
+def list_selections(type_area: str = None) -> list:
+    """
+    Return every (type, model, indicator, adm0) of menu.json, optionally for one type only.
+    """
+    menu_index = get_menu_index()
+    types = [type_area] if type_area else list(menu_index.get_children())
+    return [
+        (t, model, indicator, adm0)
+        for t in types
+        for model in menu_index.get_children(t)
+        for indicator in menu_index.get_children(t, model)
+        for adm0 in menu_index.get_children(t, model, indicator)
+    ]
+
+
+def compute_aggregates(
+    model: str, indicator: str, adm0: str, type_area: str = "admin", backend: StorageBackend = None
+) -> dict:
+    """
+    Compute the plot and table frames of one selection from the raw rows, without reading the geometry.
+    """
+    lf = scan_data_lazy(model, indicator, adm0, columns=AGGREGATE_COLUMNS, backend=backend)
+    lf = add_names(lf, model, indicator, adm0, type_area)
+    df_plot, df_table = pl.collect_all([get_df_plot(lf), create_table(lf, model)])
+    return {"plot": df_plot.to_pandas(), "table": df_table.to_pandas()}
+
+
+def materialize_aggregates(
+    destination: str, type_area: str = None, backend: StorageBackend = None, max_workers: int = 8
+) -> dict:
+    """
+    Write the plot and table aggregates of every selection of menu.json under `destination`
+    (a local path or a gs:// URI, normally `{data folder}/aggregates`).
+
+    Selections whose partitions cannot be read are logged and skipped.
+    """
+    backend = backend or get_backend()
+    destination_fs, destination_path = resolve_path(destination)
+
+    def materialize(selection):
+        t, model, indicator, adm0 = selection
+        frames = compute_aggregates(model, indicator, adm0, type_area=t, backend=backend)
+        for kind, df in frames.items():
+            path = posixpath.join(destination_path, get_aggregate_path(kind, t, model, indicator, adm0))
+            destination_fs.create_dir(posixpath.dirname(path), recursive=True)
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, filesystem=destination_fs)
+        return sum(len(df) for df in frames.values())
+
+    selections = list_selections(type_area)
+    summary = {"selections": len(selections), "written": 0, "failed": 0, "rows": 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {selection: executor.submit(materialize, selection) for selection in selections}
+        for selection, future in futures.items():
+            try:
+                summary["rows"] += future.result()
+                summary["written"] += 1
+            except Exception:
+                logger.exception("Could not aggregate %s", "/".join(selection))
+                summary["failed"] += 1
+
+    logger.info("Materialized aggregates under %s: %s", destination, summary)
+    return summary
+
+
+def read_aggregates(model: str, indicator: str, adm0: str, type_area: str = "admin", backend: StorageBackend = None):
+    """
+    Read the plot and table frames of one selection from the aggregate store; None when it is not materialized.
+    """
+    backend = backend or get_backend()
+    frames = {}
+    for kind in AGGREGATE_KINDS:
+        path = f"{AGGREGATES_PREFIX}/{get_aggregate_path(kind, type_area, model, indicator, adm0)}"
+        try:
+            frames[kind] = backend.read_table(path).to_pandas()
+        except FileNotFoundError:
+            return None
+    return frames["plot"], frames["table"]
+
+
+def get_plot_table_cached(
+    model: str, indicator: str, adm0: str, type_area: str = "admin", cancel_token: CancellationToken = None
+):
+    """
+    Return the (df_plot, df_table) of one selection, from the aggregate store when it is materialized,
+    else computed from the raw rows through get_data_plot_map_cached.
+
+    The returned frames are shared between sessions and must not be modified in place.
+    """
+
+    def compute():
+        aggregates = read_aggregates(model, indicator, adm0, type_area)
+        if aggregates is not None:
+            return aggregates
+        logger.info(
+            "No aggregates for %s/%s/%s/%s, computing them from the raw rows", type_area, model, indicator, adm0
+        )
+        df_plot, _, df_table = get_data_plot_map_cached(
+            model=model, indicator=indicator, adm0=adm0, type_area=type_area, cancel_token=cancel_token
+        )
+        return df_plot, df_table
+
+    return get_or_compute_cancellable(aggregates_cache, (type_area, model, indicator, adm0), compute, cancel_token)
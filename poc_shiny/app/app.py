@@ -1,68 +1,109 @@
-import os
+import asyncio
 import json
-from shiny import App, Inputs, Outputs, Session, reactive, ui,render,req
-from shinywidgets import output_widget, render_widget
-from lonboard import Map, PolygonLayer 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from string import Template
+
+import pandas as pd
 import plotly.express as px
 from dotenv import load_dotenv
-from poc_shiny.app.gcs_get_json import get_json_from_bucket
-from poc_shiny.app.load_all_data import load_country_specific_data
-from poc_shiny.app.get_local_data import get_data_plot_map
-import pandas as pd
-
+from lonboard import Map
+from shiny import App, reactive, render, req, ui
+from shinywidgets import output_widget, render_widget
+from starlette.routing import Mount
+
+from poc_shiny.app.aggregates import get_plot_table_cached
+from poc_shiny.app.cancellation import CancellationToken
+from poc_shiny.app.export import EXPORT_FORMATS, iter_export, iter_row_batches, iter_table_csv
+from poc_shiny.app.get_local_data import MAP_LOD, get_data_plot_map_cached
+from poc_shiny.app.legend import get_legend_color
+from poc_shiny.app.menu_index import get_menu_index
+from poc_shiny.app.payload import RenderPayload, build_payload
+from poc_shiny.app.render_cache import get_figure_json, get_polygon_layer
+from poc_shiny.app.table_view import TABLE_PAGE_ROWS, filter_table, format_table, get_page, sort_table
+from poc_shiny.app.tile_generator import MAX_ZOOM
+from poc_shiny.app.tiles import get_initial_view_state, get_pyramid_max_zoom, tiles_app
 
 load_dotenv()
 bucket_name = os.getenv("GCS_BUCKET_NAME")
 GCS_BUCKET_FOLDER = os.getenv("GCS_BUCKET_FOLDER")
 
-current_path = os.path.dirname(os.path.abspath(__file__))
-fpath_menu = os.path.join(current_path, "menu.json")
-with open(fpath_menu, "r", encoding="utf-8-sig") as f:
-    menu = json.load(f)
-
-
-
-
-def get_legend_color(model,hex_color: bool = True):
-
-    if model != "aware" :
-        color_dict = {
-            "Low (<10%)": "#add8e6",
-            "Low - Medium (10-20%)": "#ffff99",
-            "Medium - High (20-40%)": "#ffd7ba",
-            "High (40-80%)": "#ff6347",
-            "Extremely High (>80%)": "#ff0000",
-            "Arid and Low Water Use": "#a9a9a9",
-            "No Data": "#808080"
-        }
-
-    else:
-        color_dict = {
-            "0": "#00ff00",
-            "10": "#55ff00",
-            "20": "#aaff00",
-            "30": "#ffff00",
-            "40": "#ffaa00",
-            "50": "#ff5500",
-            "60": "#ff0000",
-            "70": "#cc0000",
-            "80": "#990000",
-            "90": "#660000",
-            "100": "#330000",
-            "No Data": "#808080"
-        }
-    
-    if hex_color:
-        return color_dict
-    else:
-        # Convert hex color codes to RGB integer tuples
-        try:
-            return {
-                k: [int(v[i:i+2], 16) for i in (1, 3, 5)]
-                for k, v in color_dict.items()
-            }
-        except ValueError as e:
-            raise ValueError(f"Invalid hex color format in color_dict: {color_dict}") from e
+menu_index = get_menu_index()
+
+# Worker threads running the data loads, so a slow load does not block the event loop of the other sessions
+load_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LOAD_WORKERS", 4)), thread_name_prefix="load")
+# Worker threads of the downloads, apart from the loads: downloads queue on their own pool instead of
+# holding the load workers while they stream a whole dataset
+export_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EXPORT_WORKERS", 2)), thread_name_prefix="export")
+
+# Choices of the download: the table as shown, or the raw rows of the selection in a columnar format
+DOWNLOAD_KINDS = {
+    "table": "Table (CSV)",
+    "csv": "Raw rows (CSV)",
+    "parquet": "Raw rows (Parquet)",
+    "arrow": "Raw rows (Arrow IPC)",
+}
+
+
+
+
+# deck.gl map of the selected country over vector tiles: the browser only fetches the tiles in view.
+# Up to the last zoom of the tiles/ pyramid, its features are colored from the per-unit values of the
+# selection, joined on adastra_uuid; past it, tiles are generated with their values (see tile_generator.py)
+TILE_MAP_SCRIPT = Template("""
+(function() {
+  const container = document.getElementById("tile_map_container");
+  const colors = $colors;
+  const pyramidMaxZoom = $pyramid_max_zoom;
+  const values = pyramidMaxZoom >= 0 ? fetch($values_url).then((response) => response.json()) : Promise.resolve({});
+  values.then((values) => {
+    if (container._deck) container._deck.finalize();
+    const style = {pickable: true, lineWidthMinPixels: 0.5, getLineColor: [37, 36, 34]};
+    const layers = [new deck.MVTLayer({
+      id: "generated",
+      data: $tile_url,
+      minZoom: pyramidMaxZoom + 1,
+      maxZoom: $max_zoom,
+      getFillColor: (f) => colors[f.properties.category] || [128, 128, 128],
+      ...style,
+    })];
+    if (pyramidMaxZoom >= 0) {
+      layers.unshift(new deck.MVTLayer({
+        id: "pyramid",
+        data: "tiles/tiles.json",
+        maxZoom: pyramidMaxZoom,
+        // Units outside the selection stay transparent
+        getFillColor: (f) => {
+          const value = values[f.properties.adastra_uuid];
+          return value ? (colors[value[0]] || [128, 128, 128]) : [0, 0, 0, 0];
+        },
+        ...style,
+      }));
+    }
+    container._deck = new deck.Deck({
+      parent: container,
+      initialViewState: $view_state,
+      controller: true,
+      layers: layers,
+      // One layer per zoom level: the pyramid up to its last zoom, the generated tiles past it
+      layerFilter: ({layer, viewport}) => (layer.id === "pyramid") === (viewport.zoom < pyramidMaxZoom + 0.5),
+      getTooltip: ({object}) => {
+        const value = object && values[object.properties.adastra_uuid];
+        return object && {html: object.properties.label || (value && value[1])};
+      },
+    });
+  });
+})();
+""")
+
+# Plot of the selection drawn by plotly.js from its cached figure JSON (see render_cache.py)
+PLOT_SCRIPT = Template("""
+(function() {
+  const figure = $figure;
+  Plotly.newPlot("plot_container", figure.data, figure.layout, {responsive: true});
+})();
+""")
 
 
 
@@ -78,12 +119,7 @@ def get_data_type():
 
 def get_list_models(selected_analysis_type : str):
     if selected_analysis_type :
-        for i in menu:
-            if i.get("id") == selected_analysis_type:
-                dict_ = {}
-                for j in i.get("children"):
-                    dict_[j.get("id")] = j.get("name")
-        return dict_
+        return menu_index.get_children(selected_analysis_type)
     else : 
         return {}
 
@@ -92,14 +128,7 @@ def get_list_models(selected_analysis_type : str):
 
 def get_indicators(selected_analysis_type, selected_model):
     if selected_analysis_type and selected_model:
-        for i in menu:
-            if i.get("id") == selected_analysis_type:
-                for j in i.get("children"):
-                    if j.get("id") == selected_model:
-                        dict_ = {}
-                        for x in j.get("children"):
-                            dict_[x.get("id")] = x.get("name")
-        return dict_
+        return menu_index.get_children(selected_analysis_type, selected_model)
     else :
         return {}
                         
@@ -109,22 +138,37 @@ def get_indicators(selected_analysis_type, selected_model):
 
 
 def get_countries(selected_analysis_type, selected_model, selected_indicator):
-    dict_ = {}
     if selected_analysis_type and selected_model and selected_indicator:
-        for i in menu:
-            if i.get("id") == selected_analysis_type:
-                for j in i.get("children"):
-                    if j.get("id") == selected_model:
-                        for x in j.get("children"):
-                            if x.get("id") == selected_indicator:
-                                for y in x.get("children"):
-                                    dict_[y.get("id")] = y.get("name")
-        return dict_
+        return menu_index.get_children(selected_analysis_type, selected_model, selected_indicator)
     else :
         return {}
 
 
 
+def load_selection(selection: dict, with_map: bool, cancel_token: CancellationToken) -> RenderPayload:
+    """
+    Load the plot and table data of a selection, and its map data when `with_map`. Runs in a worker thread.
+
+    Returns:
+    RenderPayload: The render-ready data shared by the outputs of the session.
+    """
+    cancel_token.set_progress(0.1, "Reading the plot and table data")
+    df_plot, df_table = get_plot_table_cached(**selection, cancel_token=cancel_token)
+
+    table_map = None
+    if with_map:
+        cancel_token.set_progress(0.4, "Reading the map data")
+        _, table_map, _ = get_data_plot_map_cached(**selection, adm1="*", cancel_token=cancel_token)
+
+    cancel_token.set_progress(0.9, "Preparing the plot, table and map")
+    payload = build_payload(**selection, df_plot=df_plot, df_table=df_table, table_map=table_map, lod=MAP_LOD)
+    # Built here, off the event loop, the plot output then reads it from the cache
+    get_figure_json(payload)
+    cancel_token.set_progress(1.0, "Done")
+    return payload
+
+
+
 
 app_ui = ui.page_sidebar(
     ui.sidebar((
@@ -138,13 +182,19 @@ app_ui = ui.page_sidebar(
         ui.markdown("Select the country : "),
         ui.input_selectize("selected_country", None, choices=[]),
         ui.input_action_button("action_button", "Load Data"),
+        ui.output_ui("load_status"),
         ui.output_ui("download_button_ui"),
     )),
 
 
+    ui.head_content(
+        ui.tags.script(src="https://unpkg.com/deck.gl@9.0.38/dist.min.js"),
+        ui.tags.script(src="https://cdn.plot.ly/plotly-2.35.0.min.js"),
+    ),
+
     ui.card(
         ui.card_header("Catergories of water stress per administrative unit 1"),
-        output_widget("plot")
+        ui.output_ui("plot")
   
     ),
 
@@ -154,7 +204,11 @@ app_ui = ui.page_sidebar(
 
         ui.card(
             ui.card_header("Map of administrative units"),
-            output_widget("map"),
+            ui.input_radio_buttons(
+                "map_renderer", None, {"lonboard": "Polygons", "tiles": "Vector tiles"}, inline=True
+            ),
+            ui.panel_conditional("input.map_renderer === 'lonboard'", output_widget("map")),
+            ui.panel_conditional("input.map_renderer === 'tiles'", ui.output_ui("tile_map")),
             ui.card_footer(
                 ui.markdown(
                     "**Note:** This highest % value define the color of the administrative unit."
@@ -166,7 +220,15 @@ app_ui = ui.page_sidebar(
 
         ui.card(
             ui.card_header("Data Table"),
+            ui.layout_columns(
+                ui.input_text("table_search", None, placeholder="Search a country, region or municipality"),
+                ui.input_select("table_sort", None, choices={"": "Default order"}),
+                ui.input_checkbox("table_descending", "Descending"),
+                ui.input_numeric("table_page", None, value=1, min=1),
+                col_widths=[5, 3, 2, 2],
+            ),
             ui.output_data_frame("table"),
+            ui.output_ui("table_rows"),
             ui.card_footer(
                 ui.markdown(
                     "**Note:** Areas have been computed in the Mollweide projection. "
@@ -244,54 +306,151 @@ def server(input, output, session):
 
 
 
-    df_loaded_reactive = reactive.Value()
     button_pressed = reactive.Value(False)
-    
+    load_token = reactive.Value(None)
 
 
-    @reactive.Calc
-    def load_data():
-        selected_model = input.selected_model() 
-        selected_indicator = input.selected_indicator() 
-        selected_country = input.selected_country() 
-        selected_type = input.selected_analysis_type() 
-        
-        # Fetch and return data
-        df, gdf, df_plot = get_data_plot_map(
-            model=selected_model,
-            indicator=selected_indicator,
-            adm0=selected_country,
-            adm1="*",
-            type_area=selected_type
-        )
+
+    @reactive.extended_task
+    async def load_task(selection, with_map, cancel_token):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(load_executor, partial(load_selection, selection, with_map, cancel_token))
+
+
+
+    @reactive.Effect
+    @reactive.event(input.action_button)
+    def start_load():
+        # A new click supersedes the running load, whose thread stops at its next step
+        if load_token.get() is not None:
+            load_token.get().cancel()
+        load_task.cancel()
+
+        cancel_token = CancellationToken()
+        load_token.set(cancel_token)
         button_pressed.set(True)
-        df_loaded_reactive.set(df)
-        return df, gdf, df_plot
+        selection = {
+            "model": input.selected_model(),
+            "indicator": input.selected_indicator(),
+            "adm0": input.selected_country(),
+            "type_area": input.selected_analysis_type(),
+        }
+        load_task.invoke(selection, input.map_renderer() == "lonboard", cancel_token)
+
+
+
+    @output
+    @render.ui
+    def load_status():
+        status = load_task.status()
+        if status == "running":
+            reactive.invalidate_later(0.5)
+            value, message = load_token.get().progress()
+            return ui.div(
+                ui.div(
+                    ui.div(class_="progress-bar", style=f"width: {value:.0%}"), class_="progress", style="height: 6px;"
+                ),
+                ui.tags.small(message),
+            )
+        if status == "error":
+            return ui.tags.small(f"Could not load the data: {load_task.error.get()}", class_="text-danger")
+        return None
 
 
 
     @output
     @render.ui
     def download_button_ui():
-        if button_pressed.get():
-            return ui.download_button("download", "Download CSV")
+        if load_task.status() == "success":
+            return ui.TagList(
+                ui.input_select("download_kind", None, DOWNLOAD_KINDS),
+                ui.panel_conditional(
+                    "input.download_kind !== 'table'", ui.input_checkbox("download_all_countries", "All countries")
+                ),
+                ui.download_button("download", "Download"),
+            )
         return None  
 
 
 
 
-    @render.download(filename=f"data.csv")
-    def download():
-        yield load_data()[2].to_csv()
+    def download_filename():
+        if input.download_kind() == "table":
+            return "data.csv"
+        payload = load_task.result()
+        adm0 = "all" if input.download_all_countries() else payload.adm0
+        extension, _ = EXPORT_FORMATS[input.download_kind()]
+        return f"{payload.model}_{payload.indicator}_{adm0}.{extension}"
+
+
+
+    def download_media_type():
+        if input.download_kind() == "table":
+            return "text/csv"
+        return EXPORT_FORMATS[input.download_kind()][1]
+
+
+
+    @render.download(filename=download_filename, media_type=download_media_type)
+    async def download():
+        payload = load_task.result()
+        if input.download_kind() == "table":
+            chunks = iter_table_csv(payload.table, format_rows=partial(format_table, model=payload.model))
+        else:
+            # Streamed from the dataset scan, all countries of the indicator or the loaded one
+            adm0 = "*" if input.download_all_countries() else payload.adm0
+            batches = iter_row_batches(payload.model, payload.indicator, adm0, payload.type_area)
+            chunks = iter_export(batches, input.download_kind())
+
+        # Each chunk is read and written in a worker thread, one chunk in memory at a time
+        loop = asyncio.get_running_loop()
+        while (chunk := await loop.run_in_executor(export_executor, next, chunks, None)) is not None:
+            yield chunk
+
+
+
+    @reactive.Effect
+    def update_table_sort():
+        # Columns of the loaded table, its shares depend on the model
+        columns = load_task.result().table.columns
+        with reactive.isolate():
+            selected = input.table_sort() if input.table_sort() in columns else ""
+        ui.update_select(
+            "table_sort", choices={"": "Default order", **{column: column for column in columns}}, selected=selected
+        )
+
+
+
+    @reactive.Effect
+    @reactive.event(load_task.status, input.table_search, input.table_sort, input.table_descending)
+    def reset_table_page():
+        ui.update_numeric("table_page", value=1)
+
+
+
+    @reactive.calc
+    def table_view():
+        # Filtered and sorted on the server, the browser only gets the rows of the page
+        df = filter_table(load_task.result().table, input.table_search())
+        return sort_table(df, input.table_sort(), input.table_descending())
 
 
 
     @output
     @render.data_frame
-    @reactive.event(input.action_button)
     def table():
-        _,_,df = load_data()
-        return render.DataGrid(df)
+        page, _ = get_page(table_view(), input.table_page())
+        return render.DataGrid(format_table(page, load_task.result().model))
+
+
+
+    @output
+    @render.ui
+    def table_rows():
+        df = table_view()
+        page, number = get_page(df, input.table_page())
+        first = (number - 1) * TABLE_PAGE_ROWS
+        return ui.tags.small(f"Rows {first + 1 if len(page) else 0}-{first + len(page)} of {len(df)}")
 
 
 
@@ -327,72 +486,48 @@ def server(input, output, session):
 
 
     @output
-    @render_widget  
-    @reactive.event(input.action_button)
+    @render.ui
     def plot():
-        df, _, _ = load_data()
-
-        # Normalize area and create percentage text
-        df['normalized_area'] = df.groupby('adm1_name')['area_54009_indicator_unit'].transform(
-            lambda x: round(x / x.sum() * 100)
+        payload = load_task.result()
+        # The figure is built once per selection, repeat views only send its cached JSON
+        return ui.TagList(
+            ui.div(id="plot_container"),
+            ui.tags.script(PLOT_SCRIPT.substitute(figure=get_figure_json(payload))),
         )
-        df['normalized_area_text'] = df['normalized_area'].astype(str) + '%'
-
-        color_map_hex = get_legend_color(input.selected_model(),hex_color = True)
-
-        category_order = list(color_map_hex.keys())
-
-
-        fig = px.bar(
-            df,
-            x='adm1_name',
-            y='normalized_area',
-            color='indicator_value_name',
-            labels={'normalized_area': 'Percentage (%)', 'adm1_name': 'Administrative Region'},
-            text='normalized_area_text',
-            color_discrete_map=color_map_hex,
-            category_orders={'indicator_value_name': category_order}
+    
+    @output
+    @render.ui
+    @reactive.event(input.action_button)
+    def tile_map():
+        req(input.map_renderer() == "tiles")
+        type_area = input.selected_analysis_type()
+        model = input.selected_model()
+        selection = f"tiles/{type_area}/{model}/{input.selected_indicator()}/{input.selected_country()}"
+        script = TILE_MAP_SCRIPT.substitute(
+            colors=json.dumps(get_legend_color(model, hex_color=False)),
+            view_state=json.dumps(get_initial_view_state()),
+            # The pyramid only has the admin units
+            pyramid_max_zoom=get_pyramid_max_zoom() if type_area == "admin" else -1,
+            values_url=json.dumps(f"{selection}/values.json"),
+            tile_url=json.dumps(f"{selection}/{{z}}/{{x}}/{{y}}.mvt"),
+            max_zoom=MAX_ZOOM,
         )
-
-        fig.update_layout(
-            yaxis_title='Percentage (%)',
-            xaxis_title='Administrative Region',
-            barmode='stack',
-            legend_title_text='Categories',
+        return ui.TagList(
+            ui.div(id="tile_map_container", style="position: relative; height: 500px;"),
+            ui.tags.script(script),
         )
 
-        return fig
-    
     @output
     @render_widget  
-    @reactive.event(input.action_button)
     def map():
-        _, gdf,_ = load_data()
-        if gdf is None:
-            return None  # Return nothing if data is not loaded
-            
- 
-        color_map = get_legend_color(input.selected_model(),hex_color = False)
-        
-        list_layers = []
-        for i in color_map.keys():
-            gdf_current_layer = gdf.loc[gdf['indicator_value_name'] == i, :].copy()
-            if gdf_current_layer.empty:
-                continue
-            # Drop unnecessary columns
-            gdf_current_layer.reset_index(drop=True, inplace=True)
-            gdf_current_layer.rename(columns={'indicator_value_name': 'Category'}, inplace=True)
-            gdf_current_layer.rename(columns={'label': 'List of category'}, inplace=True)
-            if 'adastra_uuid' in gdf_current_layer.columns:
-                gdf_current_layer.drop(columns=['adastra_uuid'], inplace=True)
-            color = color_map.get(i, [128, 128, 128])
-            layer = PolygonLayer.from_geopandas(
-                gdf_current_layer,
-                get_line_width=1000,
-                get_fill_color=color,
-                get_line_color=[37, 36, 34]  # dark border color
-            )
-            list_layers.append(layer)
+        req(input.map_renderer() == "lonboard")
+        payload = load_task.result()
+        # Loaded while the vector tiles were shown, load again to get the polygons
+        req(payload.map is not None)
+
+        # Built from the cached buffers of the selection when it was already viewed
+        layer = get_polygon_layer(payload)
+        list_layers = [layer]
         map_widget = Map(list_layers)
         return map_widget
 
@@ -401,5 +536,8 @@ def server(input, output, session):
 
 app = App(app_ui, server)
 
+# Tile pyramid, per-unit values and generated tiles, served next to the Shiny app
+app.starlette_app.router.routes.insert(0, Mount("/tiles", app=tiles_app))
+
 
 
@@ -0,0 +1,60 @@
+import threading
+
+
+class LoadCancelled(Exception):
+    """
+    Raised inside a load whose CancellationToken was cancelled.
+    """
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation and progress of one load running in a worker thread.
+
+    The thread calls `check()` between its steps (partition batches, transforms) and stops
+    with LoadCancelled once `cancel()` was called; the session reads `progress()` to show
+    how far the load is.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._progress = (0.0, "")
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise LoadCancelled()
+
+    def set_progress(self, value: float, message: str):
+        self.check()
+        with self._lock:
+            self._progress = (value, message)
+
+    def progress(self) -> tuple:
+        """
+        Return the (fraction done, message) of the load.
+        """
+        with self._lock:
+            return self._progress
+
+
+def get_or_compute_cancellable(cache, key, compute, cancel_token: CancellationToken = None):
+    """
+    Same as cache.get_or_compute, for computations that can be cancelled.
+
+    A caller waiting on a computation shared with another caller whose load was cancelled
+    runs the computation again instead of failing with LoadCancelled.
+    """
+    while True:
+        try:
+            return cache.get_or_compute(key, compute)
+        except LoadCancelled:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise
@@ -0,0 +1,206 @@
+import json
+import logging
+
+import click
+from dotenv import load_dotenv
+
+from poc_shiny.app import aggregates, repartition, schema, simplify, tile_archive
+
+load_dotenv()
+
+
+@click.group()
+@click.option("--verbose", is_flag=True, help="Log progress.")
+def cli(verbose):
+    """
+    Offline maintenance tools for the poc_shiny data.
+
+    Paths are local paths or gs://bucket/... URIs.
+    """
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING)
+
+
+@cli.command("repartition")
+@click.argument("source")
+@click.argument("destination")
+@click.option(
+    "--kind",
+    type=click.Choice(["indicators", "geometry"]),
+    required=True,
+    help="indicators for df_{type}_indicators.parquet, geometry for {type}.parquet.",
+)
+@click.option("--sort-by", multiple=True, help="Sort keys (default: the filter keys of the kind).")
+@click.option("--partition-by", multiple=True, help="Write a Hive-partitioned directory on these keys.")
+@click.option("--row-group-mb", type=float, default=8, show_default=True, help="Uncompressed row group size.")
+@click.option("--compression", default="zstd", show_default=True)
+def repartition_command(source, destination, kind, sort_by, partition_by, row_group_mb, compression):
+    """
+    Rewrite SOURCE to DESTINATION sorted and row-grouped by the filter keys.
+    """
+    if not sort_by:
+        sort_by = repartition.INDICATORS_SORT_KEYS if kind == "indicators" else repartition.GEOMETRY_SORT_KEYS
+    summary = repartition.rewrite_dataset(
+        source,
+        destination,
+        sort_by=list(sort_by),
+        row_group_bytes=int(row_group_mb * 1024**2),
+        partition_by=list(partition_by) or None,
+        compression=compression,
+    )
+    click.echo(json.dumps(summary))
+
+
+@cli.command("compact")
+@click.argument("source")
+@click.argument("destination")
+@click.option("--sort-by", multiple=True, default=["adastra_uuid"], show_default=True)
+@click.option("--max-rows-per-file", type=int, default=10_000_000, show_default=True)
+@click.option("--row-group-mb", type=float, default=8, show_default=True, help="Uncompressed row group size.")
+@click.option("--compression", default="zstd", show_default=True)
+def compact_command(source, destination, sort_by, max_rows_per_file, row_group_mb, compression):
+    """
+    Merge the per-adm1 files of each country of SOURCE into model=/indicator=/adm0=/type= files in DESTINATION.
+
+    Only the partition tree is compacted, the other files of SOURCE are not copied.
+    """
+    summary = repartition.compact_partitions(
+        source,
+        destination,
+        sort_by=list(sort_by),
+        max_rows_per_file=max_rows_per_file,
+        row_group_bytes=int(row_group_mb * 1024**2),
+        compression=compression,
+    )
+    click.echo(json.dumps(summary))
+
+
+@cli.command("simplify")
+@click.argument("source")
+@click.argument("destination")
+@click.option(
+    "--level",
+    "levels",
+    multiple=True,
+    help="Level of detail as LOD=TOLERANCE (degrees), e.g. --level 1=0.0005 (default: simplify.LOD_TOLERANCES).",
+)
+@click.option("--geometry-column", default="geom", show_default=True)
+@click.option("--compression", default="zstd", show_default=True)
+def simplify_command(source, destination, levels, geometry_column, compression):
+    """
+    Write the simplified geometry levels of SOURCE ({type}.parquet) to DESTINATION ({type}_simplified.parquet).
+    """
+    try:
+        levels = {int(lod): float(tolerance) for lod, tolerance in (level.split("=") for level in levels)}
+    except ValueError as e:
+        raise click.BadParameter("levels must be given as LOD=TOLERANCE", param_hint="--level") from e
+    if 0 in levels:
+        raise click.BadParameter("level 0 is the full-resolution source", param_hint="--level")
+    summary = simplify.build_simplified_levels(
+        source,
+        destination,
+        levels=levels or simplify.LOD_TOLERANCES,
+        geometry_column=geometry_column,
+        compression=compression,
+    )
+    click.echo(json.dumps(summary))
+
+
+@cli.command("aggregates")
+@click.argument("destination")
+@click.option("--type", "type_area", default=None, help="Only this type of area (default: every type of menu.json).")
+@click.option("--workers", type=int, default=8, show_default=True)
+def aggregates_command(destination, type_area, workers):
+    """
+    Write the plot and table aggregates of every (type, model, indicator, adm0) of menu.json to DESTINATION.
+
+    DESTINATION is normally the `aggregates` folder next to the partitioned data (AGGREGATES_PREFIX).
+    """
+    summary = aggregates.materialize_aggregates(destination, type_area=type_area, max_workers=workers)
+    click.echo(json.dumps(summary))
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+@cli.command("memory-report")
+@click.argument("model")
+@click.argument("indicator")
+@click.argument("adm0")
+@click.option("--type", "type_area", default="admin", show_default=True)
+@click.option("--lod", type=int, default=0, show_default=True, help="Geometry level of the map.")
+def memory_report_command(model, indicator, adm0, type_area, lod):
+    """
+    Load the plot, map and table data of one country and print the bytes held by each frame and column.
+    """
+    from poc_shiny.app.get_local_data import get_data_plot_map
+
+    df_plot, df_map, df_table = get_data_plot_map(model, indicator, adm0, type_area=type_area, lod=lod)
+    click.echo(json.dumps(schema.memory_report({"plot": df_plot, "map": df_map, "table": df_table})))
+
+
+@cli.command("benchmark-country")
+@click.argument("model")
+@click.argument("indicator")
+@click.argument("country")
+@click.option("--type", "data_type", default="admin", show_default=True)
+@click.option("--repeat", type=int, default=3, show_default=True)
+def benchmark_country_command(model, indicator, country, data_type, repeat):
+    """
+    Compare the plot and map aggregation of load_country_specific_data with its pandas reference on COUNTRY.
+    """
+    from poc_shiny.app.load_all_data import benchmark_country_aggregation
+
+    summary = benchmark_country_aggregation(model, indicator, country, data_type=data_type, repeat=repeat)
+    click.echo(json.dumps(summary))
+    if not (summary["plot_matches"] and summary["values_match"]):
+        raise SystemExit(1)
+
+
+@cli.command("export")
+@click.argument("model")
+@click.argument("indicator")
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option("--adm0", default="*", show_default=True, help="Country code, * for every country.")
+@click.option("--type", "type_area", default="admin", show_default=True)
+@click.option(
+    "--format", "export_format", type=click.Choice(["csv", "parquet", "arrow"]), default="parquet", show_default=True
+)
+def export_command(model, indicator, output, adm0, type_area, export_format):
+    """
+    Write the raw rows of INDICATOR to OUTPUT, streamed from the dataset scan batch by batch.
+    """
+    from poc_shiny.app.export import iter_export, iter_row_batches
+
+    size = 0
+    with open(output, "wb") as f:
+        for chunk in iter_export(iter_row_batches(model, indicator, adm0, type_area), export_format):
+            size += f.write(chunk)
+    click.echo(json.dumps({"output": output, "bytes": size}))
+
+
+@cli.command("pack-tiles")
+@click.argument("tiles_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False))
+def pack_tiles_command(tiles_dir, output):
+    """
+    Pack the {z}/{x}/{y}.mvt pyramid and metadata.json of TILES_DIR into the MBTiles archive OUTPUT.
+    """
+    click.echo(json.dumps(tile_archive.pack_mbtiles(tiles_dir, output)))
+
+
+@cli.command("benchmark-tiles")
+@click.argument("tiles_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+@click.option("--repeat", type=int, default=3, show_default=True)
+def benchmark_tiles_command(tiles_dir, archive, repeat):
+    """
+    Compare reading every tile from the loose files of TILES_DIR and from the MBTiles ARCHIVE.
+    """
+    from poc_shiny.app.tiles import DirectoryTileSource
+
+    sources = {"directory": DirectoryTileSource(tiles_dir), "mbtiles": tile_archive.MBTilesTileSource(archive)}
+    tiles = tile_archive.list_directory_tiles(tiles_dir)
+    click.echo(json.dumps(tile_archive.benchmark_tile_sources(sources, tiles, repeat=repeat)))
+
+
+if __name__ == "__main__":
+    cli()
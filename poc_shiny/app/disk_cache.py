@@ -0,0 +1,216 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def get_object_version(info: dict) -> str:
+    """
+    Build a version token from fsspec metadata: the GCS generation, else the ETag, else size and mtime.
+    """
+    for key in ("generation", "etag", "ETag", "md5Hash"):
+        if info.get(key):
+            return str(info[key])
+    return f"{info.get('size')}-{info.get('mtime', info.get('updated'))}"
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:32]
+
+
+class DiskCache:
+    """
+    Local copy of remote objects keyed by object path and version, bounded in size with LRU eviction.
+
+    `fetch` works with any fsspec filesystem (gcsfs in production, a local directory in tests):
+    each call checks the object metadata, which costs one small request, and downloads the object
+    only when it is missing or its generation/ETag changed. `fetch_directory` does the same for
+    each Parquet file of a directory, and `fetch` hands the directories over to it.
+
+    Only the reads of get_table_from_bucket (country-level files and aggregates) go through the
+    cache; the partition scans of get_local_data stream from gcsfs.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, revalidate_after: float = 0):
+        self.cache_dir = Path(cache_dir).resolve()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # local file name -> size, least recently used first
+        self._checked = {}  # object path -> (local file name, time of the last metadata check)
+        self._directories = set()  # paths that turned out to be directories
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "revalidations": 0, "evictions": 0, "bytes_downloaded": 0}
+        self._load_existing()
+
+    def _load_existing(self):
+        # Rebuild the LRU order from the files left by a previous process
+        files = [f for f in self.cache_dir.iterdir() if f.is_file() and not f.name.endswith(".tmp")]
+        for f in sorted(files, key=lambda f: f.stat().st_mtime):
+            size = f.stat().st_size
+            self._files[f.name] = size
+            self._size += size
+
+    def _local_name(self, path: str, version: str) -> str:
+        return f"{_hash(path)}-{_hash(version)}{Path(path).suffix}"
+
+    def _touch(self, name: str):
+        self._files.move_to_end(name)
+        try:
+            os.utime(self.cache_dir / name)
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, name: str):
+        self._size -= self._files.pop(name, 0)
+        try:
+            (self.cache_dir / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep: str):
+        while self._size > self.max_bytes and len(self._files) > 1:
+            oldest = next(iter(self._files))
+            if oldest == keep:
+                self._files.move_to_end(oldest)
+                oldest = next(iter(self._files))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def fetch(self, fs, path: str) -> str:
+        """
+        Return the local path of an up-to-date copy of `path` on `fs`.
+
+        `path` may be a directory (written by `cli repartition --partition-by`): it is told apart by
+        the metadata request that revalidates a file, remembered, and read with fetch_directory.
+        """
+        with self._lock:
+            directory = path in self._directories
+        if directory:
+            return self.fetch_directory(fs, path)
+
+        with self._lock:
+            checked = self._checked.get(path)
+            if checked and time.monotonic() - checked[1] < self.revalidate_after and checked[0] in self._files:
+                self._touch(checked[0])
+                self._stats["hits"] += 1
+                return str(self.cache_dir / checked[0])
+
+        # Cheap metadata request instead of a download
+        info = fs.info(path)
+        if info["type"] == "directory":
+            with self._lock:
+                self._directories.add(path)
+            return self.fetch_directory(fs, path)
+        version = get_object_version(info)
+        name = self._local_name(path, version)
+
+        with self._lock:
+            self._stats["revalidations"] += 1
+            if name in self._files:
+                self._checked[path] = (name, time.monotonic())
+                self._touch(name)
+                self._stats["hits"] += 1
+                return str(self.cache_dir / name)
+
+        # Download to a temporary file and move it in place atomically
+        tmp_path = self.cache_dir / f"{name}.{uuid.uuid4().hex}.tmp"
+        try:
+            fs.get_file(path, str(tmp_path))
+            os.replace(tmp_path, self.cache_dir / name)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        size = (self.cache_dir / name).stat().st_size
+
+        with self._lock:
+            # Drop the stale versions of the same object
+            prefix = f"{_hash(path)}-"
+            for stale in [f for f in self._files if f.startswith(prefix) and f != name]:
+                self._remove(stale)
+            if name not in self._files:
+                self._files[name] = size
+                self._size += size
+            self._checked[path] = (name, time.monotonic())
+            self._stats["misses"] += 1
+            self._stats["bytes_downloaded"] += size
+            self._evict(keep=name)
+
+        return str(self.cache_dir / name)
+
+    def fetch_directory(self, fs, path: str):
+        """
+        Return the local path of an up-to-date copy of the Parquet files under the directory `path` on `fs`,
+        or None when they do not fit in the cache together.
+
+        Each file is cached under its own version. The directory tree is rebuilt under `trees/`
+        with symbolic links to the cached files, so the Hive partition keys of the paths are kept.
+        """
+        root = fs._strip_protocol(path).rstrip("/")
+        files = sorted(f for f in fs.find(root) if f.endswith(".parquet"))
+        local_files = {f: self.fetch(fs, f) for f in files}
+        if not all(os.path.exists(local) for local in local_files.values()):
+            # The first files were evicted to make room for the last ones
+            return None
+
+        name = f"{_hash(root)}-{_hash(''.join(local_files.values()))}"
+        trees = self.cache_dir / "trees"
+        tree = trees / name
+        if not tree.exists():
+            tmp_tree = trees / f"{name}.{uuid.uuid4().hex}.tmp"
+            for f, local in local_files.items():
+                link = tmp_tree / posixpath.relpath(f, root)
+                link.parent.mkdir(parents=True, exist_ok=True)
+                link.symlink_to(local)
+            try:
+                os.replace(tmp_tree, tree)
+            except OSError:
+                # Built at the same time by another thread
+                shutil.rmtree(tmp_tree, ignore_errors=True)
+            # Drop the trees of the previous versions of the directory
+            for stale in trees.glob(f"{_hash(root)}-*"):
+                if stale.name != name and not stale.name.endswith(".tmp"):
+                    shutil.rmtree(stale, ignore_errors=True)
+        return str(tree)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["files"] = len(self._files)
+            stats["size_bytes"] = self._size
+            stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    """
+    Return the process-wide disk cache, or None when PARQUET_CACHE_DIR is not set.
+    """
+    global _disk_cache
+
+    cache_dir = os.getenv("PARQUET_CACHE_DIR")
+    if not cache_dir:
+        return None
+
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            _disk_cache = DiskCache(
+                cache_dir=cache_dir,
+                max_bytes=int(os.getenv("PARQUET_CACHE_MAX_BYTES", 10 * 1024**3)),
+                revalidate_after=float(os.getenv("PARQUET_CACHE_REVALIDATE_AFTER", 60)),
+            )
+        return _disk_cache
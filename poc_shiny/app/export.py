@@ -0,0 +1,155 @@
+import os
+from collections.abc import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from poc_shiny.app.get_local_data import get_scanner
+from poc_shiny.app.storage import StorageBackend
+
+load_dotenv()
+
+# Rows written at a time: a chunk of the download, and a row group of the Parquet export
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 65536))
+
+# Columns of the raw row exports, the geometry is left out
+EXPORT_COLUMNS = [
+    "adm0",
+    "adm1",
+    "adastra_uuid",
+    "label_admin_name",
+    "area_54009_unit",
+    "area_54009_indicator_unit",
+    "area_‰",
+    "indicator_value",
+]
+
+# {format: (file extension, media type)} of the raw row exports
+EXPORT_FORMATS = {
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrows", "application/vnd.apache.arrow.stream"),
+}
+
+
+class ChunkSink:
+    """
+    Write-only file keeping the bytes written since the last `take()`, so a writer can be
+    streamed chunk by chunk. `tell()` counts every byte written, as the Parquet writer expects.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def take(self) -> bytes:
+        chunk = b"".join(self._chunks)
+        self._chunks.clear()
+        return chunk
+
+
+def iter_table_csv(df: pd.DataFrame, batch_rows: int = EXPORT_BATCH_ROWS, format_rows=None) -> Iterator[str]:
+    """
+    Write a frame as CSV, `batch_rows` rows at a time. The chunks join to `df.to_csv()`.
+
+    `format_rows`, when given, is applied to each chunk of rows before it is written.
+    """
+    for start in range(0, max(len(df), 1), batch_rows):
+        rows = df.iloc[start : start + batch_rows]
+        if format_rows is not None:
+            rows = format_rows(rows)
+        yield rows.to_csv(header=start == 0)
+
+
+def iter_row_batches(
+    model: str,
+    indicator: str,
+    adm0: str = "*",
+    type_area: str = "admin",
+    backend: StorageBackend = None,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Read the raw rows of an indicator, of one country or of every country (adm0="*"), as record
+    batches of about `batch_rows` rows streamed from the dataset scan.
+
+    The small batches of the adm1 partitions are grouped, so each batch makes a reasonable chunk.
+    An empty selection gives one empty batch, so the export still has its header and schema.
+    """
+    scanner = get_scanner(model, indicator, adm0, type_area=type_area, columns=EXPORT_COLUMNS, backend=backend)
+
+    def combine(batches):
+        return pa.Table.from_batches(batches, schema=scanner.projected_schema).combine_chunks().to_batches()[0]
+
+    def regroup(batches):
+        pending, rows, empty = [], 0, True
+        for batch in batches:
+            pending.append(batch)
+            rows += batch.num_rows
+            if rows >= batch_rows:
+                yield combine(pending)
+                pending, rows, empty = [], 0, False
+        if rows:
+            yield combine(pending)
+        elif empty:
+            yield pa.RecordBatch.from_pylist([], schema=scanner.projected_schema)
+
+    for batch in regroup(scanner.to_batches()):
+        if "adm0" not in batch.schema.names:
+            # The scan of one country is rooted below its adm0= directory
+            batch = pa.RecordBatch.from_arrays(
+                [pa.repeat(pa.scalar(adm0, type=pa.string()), batch.num_rows), *batch.columns],
+                names=["adm0", *batch.schema.names],
+            )
+        yield batch
+
+
+def iter_export(batches: Iterator[pa.RecordBatch], export_format: str) -> Iterator[bytes]:
+    """
+    Write record batches as CSV, Parquet (one row group per batch) or an Arrow IPC stream,
+    yielding the bytes as each batch is written. Only one batch is held in memory.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, expected one of {list(EXPORT_FORMATS)}.")
+
+    sink = ChunkSink()
+    writer = None
+    for batch in batches:
+        if writer is None:
+            if export_format == "csv":
+                writer = pcsv.CSVWriter(sink, batch.schema)
+            elif export_format == "parquet":
+                writer = pq.ParquetWriter(sink, batch.schema, compression="zstd")
+            else:
+                writer = pa.ipc.new_stream(sink, batch.schema)
+        if export_format == "parquet":
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+        yield sink.take()
+
+    if writer is not None:
+        writer.close()
+    yield sink.take()
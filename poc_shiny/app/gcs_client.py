@@ -0,0 +1,128 @@
+import os
+import threading
+from datetime import UTC, datetime, timedelta
+
+import gcsfs
+from dotenv import load_dotenv
+from google.auth.transport.requests import Request
+from google.cloud import storage
+from google.oauth2.credentials import Credentials
+
+load_dotenv()
+
+
+# Renew the access token when it expires within this margin
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Guards the pooled objects and the counters; never held during a network call
+_lock = threading.Lock()
+_credentials = None
+# Serializes the token refreshes of _credentials, without blocking the readers of a valid token
+_refresh_lock = None
+_client = None
+_fs = None
+_stats = {
+    "token_refresh": 0,
+    "client_created": 0,
+    "client_reused": 0,
+    "fs_created": 0,
+    "fs_reused": 0,
+}
+
+
+def _token_is_valid(credentials) -> bool:
+    if credentials.token is None or credentials.expiry is None:
+        return False
+    # google-auth stores the expiry as a naive UTC datetime
+    expiry = credentials.expiry.replace(tzinfo=UTC)
+    return expiry - TOKEN_REFRESH_MARGIN > datetime.now(UTC)
+
+
+def get_credentials() -> Credentials:
+    """
+    Return the process-wide OAuth 2.0 credentials, refreshing the token only when it is missing or close to expiry.
+
+    The refresh runs under the lock of the credentials, so callers of the client and the
+    filesystem are not blocked by it, and concurrent callers wait for a single refresh.
+    """
+    global _credentials, _refresh_lock
+
+    with _lock:
+        if _credentials is None:
+            _credentials = Credentials(
+                token=None,
+                refresh_token=os.getenv("refresh_token"),
+                client_id=os.getenv("client_id"),
+                client_secret=os.getenv("client_secret"),
+                token_uri="https://oauth2.googleapis.com/token",
+                quota_project_id=os.getenv("quota_project_id"),
+            )
+            _refresh_lock = threading.Lock()
+        credentials, refresh_lock = _credentials, _refresh_lock
+
+    if not _token_is_valid(credentials):
+        with refresh_lock:
+            # Another thread may have refreshed the token while this one waited
+            if not _token_is_valid(credentials):
+                credentials.refresh(Request())
+                with _lock:
+                    _stats["token_refresh"] += 1
+
+    return credentials
+
+
+def get_storage_client() -> storage.Client:
+    """
+    Return the shared Google Cloud Storage client (its HTTP session keeps the connection pool alive).
+    """
+    global _client
+
+    credentials = get_credentials()
+    with _lock:
+        if _client is None:
+            _client = storage.Client(credentials=credentials, project=os.getenv("quota_project_id"))
+            _stats["client_created"] += 1
+        else:
+            _stats["client_reused"] += 1
+        return _client
+
+
+def get_gcsfs() -> gcsfs.GCSFileSystem:
+    """
+    Return the shared gcsfs filesystem, built on the pooled credentials.
+    """
+    global _fs
+
+    credentials = get_credentials()
+    with _lock:
+        if _fs is None:
+            _fs = gcsfs.GCSFileSystem(token=credentials, project=os.getenv("quota_project_id"))
+            _stats["fs_created"] += 1
+        else:
+            _stats["fs_reused"] += 1
+        return _fs
+
+
+def get_stats() -> dict:
+    """
+    Return a snapshot of the refresh and connection counters.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["token_expiry"] = _credentials.expiry.isoformat() if _credentials and _credentials.expiry else None
+    return stats
+
+
+def reset():
+    """
+    Drop the pooled credentials, client and filesystem (e.g. after rotating the refresh token).
+    """
+    global _credentials, _refresh_lock, _client, _fs
+
+    with _lock:
+        _credentials = None
+        _refresh_lock = None
+        _client = None
+        _fs = None
+        for key in _stats:
+            _stats[key] = 0
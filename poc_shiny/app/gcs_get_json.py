@@ -1,34 +1,19 @@
 from dotenv import load_dotenv
-import os
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google.cloud import storage
 import json
+from poc_shiny.app.gcs_client import get_storage_client, get_gcsfs
+from poc_shiny.app.disk_cache import get_disk_cache
 
 load_dotenv()
 
 def get_json_from_bucket(bucket_name: str, bucket_suffix: str):
-    # Load environment variables for OAuth 2.0 credentials
-    client_id = os.getenv("client_id")
-    client_secret = os.getenv("client_secret")
-    refresh_token = os.getenv("refresh_token")
-    quota_project_id = os.getenv("quota_project_id")
-
-    # Set up OAuth 2.0 credentials
-    credentials = Credentials(
-        token=None,
-        refresh_token=refresh_token,
-        client_id=client_id,
-        client_secret=client_secret,
-        token_uri="https://oauth2.googleapis.com/token",
-        quota_project_id=quota_project_id
-    )
-
-    # Refresh token to obtain a valid access token
-    credentials.refresh(Request())
-
-    # Initialize Google Cloud Storage client with the OAuth 2.0 credentials
-    client = storage.Client(credentials=credentials, project=quota_project_id)
+    disk_cache = get_disk_cache()
+    if disk_cache is not None:
+        local_path = disk_cache.fetch(get_gcsfs(), f"gs://{bucket_name}/{bucket_suffix}")
+        with open(local_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    # Reuse the process-wide client and credentials
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(bucket_suffix)
 
@@ -1,70 +1,205 @@
-from dotenv import load_dotenv
-import os
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google.cloud import storage
-import pyarrow.parquet as pq
-import pyarrow.dataset as ds
-import gcsfs
-from shapely import wkb
+import logging
+import threading
+from collections import deque
+
 import geopandas as gpd
+import pyarrow.dataset as ds
+from dotenv import load_dotenv
+from pyarrow import fs as pafs
+
+from poc_shiny.app.disk_cache import get_disk_cache
+from poc_shiny.app.gcs_client import get_gcsfs
+from poc_shiny.app.geometry import decode_wkb, is_wkb_column, tag_wkb_geometry
 
 load_dotenv()
 
-def get_parquet_from_bucket(bucket_name: str, bucket_suffix: str, filter: dict):
-    # Load environment variables for OAuth 2.0 credentials
-    client_id = os.getenv("client_id")
-    client_secret = os.getenv("client_secret")
-    refresh_token = os.getenv("refresh_token")
-    quota_project_id = os.getenv("quota_project_id")
-
-    # Set up OAuth 2.0 credentials
-    credentials = Credentials(
-        token=None,
-        refresh_token=refresh_token,
-        client_id=client_id,
-        client_secret=client_secret,
-        token_uri="https://oauth2.googleapis.com/token",
-        quota_project_id=quota_project_id
+# Comparison operators accepted in filters, as (operator, value) tuples
+FILTER_OPERATORS = {
+    "==": lambda field, value: field == value,
+    "!=": lambda field, value: field != value,
+    "<": lambda field, value: field < value,
+    "<=": lambda field, value: field <= value,
+    ">": lambda field, value: field > value,
+    ">=": lambda field, value: field >= value,
+    "in": lambda field, value: field.isin(list(value)),
+    "not in": lambda field, value: ~field.isin(list(value)),
+}
+
+# Statistics of the most recent reads, see get_scan_stats
+_scan_stats = deque(maxlen=100)
+_scan_stats_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+
+def build_column_expression(column: str, value):
+    """
+    Build the expression for one filter entry.
+
+    value can be a scalar (equality), a list or set (membership),
+    an (operator, value) tuple with an operator of FILTER_OPERATORS,
+    or a ("between", low, high) tuple for an inclusive range.
+    """
+    field = ds.field(column)
+    if isinstance(value, tuple):
+        if value[0] == "between":
+            _, low, high = value
+            return (field >= low) & (field <= high)
+        operator, operand = value
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator '{operator}' for column '{column}'.")
+        return FILTER_OPERATORS[operator](field, operand)
+    if isinstance(value, list | set | frozenset):
+        return field.isin(list(value))
+    return field == value
+
+
+
+def build_filter_expression(filter: dict):
+    # Create the filter expression based on the provided dictionary
+    filter_expression = [build_column_expression(column, value) for column, value in filter.items()]
+
+    # Combine filter expressions if there are any, otherwise set to None
+    combined_filter = None
+    if filter_expression:
+        combined_filter = filter_expression[0]
+        for expr in filter_expression[1:]:
+            combined_filter &= expr
+
+    return combined_filter
+
+
+
+def _compressed_size(metadata, row_group_ids, columns=None) -> int:
+    size = 0
+    for i in row_group_ids:
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            if columns is None or column.path_in_schema.split(".")[0] in columns:
+                size += column.total_compressed_size
+    return size
+
+
+
+def is_directory(path: str, filesystem) -> bool:
+    """
+    Tell whether `path` is a directory on a pyarrow or fsspec filesystem.
+    """
+    if isinstance(filesystem, pafs.FileSystem):
+        return filesystem.get_file_info(path).type == pafs.FileType.Directory
+    return filesystem.isdir(path)
+
+
+
+def read_parquet_table(path: str, filesystem, filter: dict = None, columns: list = None):
+    """
+    Read a Parquet file (or directory) keeping only the rows matching `filter` and the `columns` requested.
+
+    Row groups whose min/max statistics cannot match the filter are skipped. The bytes
+    scanned (compressed size of the projected columns in the row groups kept) and the
+    bytes returned are recorded, see get_scan_stats.
+    """
+    # Load the Parquet file and filter rows using pyarrow. Directories written with
+    # `cli repartition --partition-by` keep their partition keys as columns; a single file
+    # does not, or the key=value folders above it would come back as columns too.
+    partitioning = "hive" if is_directory(path, filesystem) else None
+    dataset = ds.dataset(path, filesystem=filesystem, format="parquet", partitioning=partitioning)
+    combined_filter = build_filter_expression(filter) if filter else None
+
+    stats = {"path": path, "row_groups_total": 0, "row_groups_scanned": 0, "bytes_total": 0, "bytes_scanned": 0}
+    fragments = []
+    for fragment in dataset.get_fragments(filter=combined_filter):
+        fragment.ensure_complete_metadata()
+        metadata = fragment.metadata
+        if combined_filter is not None:
+            # Keep only the row groups whose statistics may match the filter
+            fragment = fragment.subset(filter=combined_filter, schema=dataset.schema)
+        row_group_ids = [row_group.id for row_group in fragment.row_groups]
+
+        stats["row_groups_total"] += metadata.num_row_groups
+        stats["row_groups_scanned"] += len(row_group_ids)
+        stats["bytes_total"] += _compressed_size(metadata, range(metadata.num_row_groups))
+        stats["bytes_scanned"] += _compressed_size(metadata, row_group_ids, columns)
+        fragments.append(fragment)
+
+    # Read the filtered data
+    pruned_dataset = ds.FileSystemDataset(fragments, dataset.schema, dataset.format, filesystem=dataset.filesystem)
+    table = pruned_dataset.to_table(columns=columns, filter=combined_filter)
+
+    stats["rows_returned"] = table.num_rows
+    stats["bytes_returned"] = table.nbytes
+    with _scan_stats_lock:
+        _scan_stats.append(stats)
+    logger.info(
+        "Read %s: %d/%d row groups, %d/%d bytes scanned, %d bytes returned",
+        path, stats["row_groups_scanned"], stats["row_groups_total"],
+        stats["bytes_scanned"], stats["bytes_total"], stats["bytes_returned"],
     )
 
-    # Refresh token to obtain a valid access token
-    credentials.refresh(Request())
+    return table
+
+
 
-    # Construct the GCS file path and initialize gcsfs with OAuth credentials
+def get_scan_stats() -> list:
+    """
+    Return the statistics of the most recent Parquet reads, oldest first.
+
+    When bytes_scanned stays close to bytes_total for a selective filter, the file
+    layout (sort order, row group size) defeats row-group pruning.
+    """
+    with _scan_stats_lock:
+        return list(_scan_stats)
+
+
+
+def get_table_from_bucket(bucket_name: str, bucket_suffix: str, filter: dict, columns: list = None):
+    # Construct the GCS file path and reuse the process-wide gcsfs filesystem
     gcs_path = f"gs://{bucket_name}/{bucket_suffix}"
-    fs = gcsfs.GCSFileSystem(token=credentials)
+    fs = get_gcsfs()
 
-    # Load the Parquet file and filter rows using pyarrow
-    dataset = ds.dataset(gcs_path, filesystem=fs, format="parquet")
+    disk_cache = get_disk_cache()
+    if disk_cache is not None:
+        # Read the local copy through memory mapping (a directory written by
+        # `cli repartition --partition-by` is copied file by file)
+        local_path = disk_cache.fetch(fs, gcs_path)
+        if local_path is not None:
+            return read_parquet_table(local_path, pafs.LocalFileSystem(use_mmap=True), filter, columns)
 
-    if filter : 
+    return read_parquet_table(gcs_path, fs, filter, columns)
 
-        # Create the filter expression based on the provided dictionary
-        filter_expression = [(ds.field(column) == value) for column, value in filter.items()]
-        
-        # Combine filter expressions if there are any, otherwise set to None
-        combined_filter = None
-        if filter_expression:
-            combined_filter = filter_expression[0]
-            for expr in filter_expression[1:]:
-                combined_filter &= expr
 
-        # Read the filtered data
-        table = dataset.to_table(filter=combined_filter)
-    else :
-        table = dataset.to_table()
 
-    # Convert to pandas DataFrame for easier handling
-    data = table.to_pandas()
+def table_to_dataframe(table, decode_geometry: bool = True):
+    if not decode_geometry or not is_wkb_column(table, "geometry"):
+        # Convert to pandas DataFrame for easier handling
+        return table.to_pandas()
 
-    if "geometry" in data.columns:
-        data["geometry"] = data["geometry"].apply(lambda x: wkb.loads(x) if isinstance(x, bytes) else x)
-        data = gpd.GeoDataFrame(data, geometry="geometry", crs="EPSG:4326") 
+    # Decode the whole WKB column at once instead of one Python call per polygon
+    geometry = decode_wkb(table.column("geometry"))
+    data = table.drop_columns(["geometry"]).to_pandas()
+    data.insert(table.column_names.index("geometry"), "geometry", gpd.GeoSeries(geometry, index=data.index))
+    data = gpd.GeoDataFrame(data, geometry="geometry", crs="EPSG:4326")
 
     return data
 
 
+
+def get_parquet_from_bucket(
+    bucket_name: str, bucket_suffix: str, filter: dict, columns: list = None, as_arrow: bool = False
+):
+    """
+    Read a Parquet file of the bucket as a (Geo)DataFrame.
+
+    With as_arrow=True, return the Arrow table with its WKB geometry tagged as GeoArrow
+    instead, for consumers (such as lonboard) that take Arrow geometry directly.
+    """
+    table = get_table_from_bucket(bucket_name, bucket_suffix, filter, columns)
+    if as_arrow:
+        return tag_wkb_geometry(table)
+    return table_to_dataframe(table)
+
+
 # if __name__ == "__main__":
 #     bucket_name = "adastra_projects_gis"
 #     bucket_suffix = "poc_shiny/admin.parquet"
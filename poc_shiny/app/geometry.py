@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+import pyarrow as pa
+import shapely
+
+# Field metadata marking a binary column as GeoArrow WKB, understood by lonboard
+GEOARROW_WKB = b"geoarrow.wkb"
+
+
+def decode_wkb(column) -> np.ndarray:
+    """
+    Decode a WKB column (Arrow or numpy) into a numpy array of shapely geometries in one call.
+
+    Null values stay None.
+    """
+    if isinstance(column, pa.ChunkedArray | pa.Array):
+        column = column.to_numpy(zero_copy_only=False)
+    return shapely.from_wkb(column)
+
+
+def is_wkb_column(table: pa.Table, column: str = "geometry") -> bool:
+    if column not in table.column_names:
+        return False
+    column_type = table.schema.field(column).type
+    return pa.types.is_binary(column_type) or pa.types.is_large_binary(column_type)
+
+
+def tag_wkb_geometry(table: pa.Table, column: str = "geometry", crs: str = "EPSG:4326") -> pa.Table:
+    """
+    Mark the WKB `column` of `table` with the GeoArrow extension metadata, without decoding it.
+
+    Arrow consumers such as lonboard then read the geometry straight from the table.
+    """
+    if not is_wkb_column(table, column):
+        return table
+    index = table.schema.get_field_index(column)
+    field = table.schema.field(index).with_metadata(
+        {
+            b"ARROW:extension:name": GEOARROW_WKB,
+            b"ARROW:extension:metadata": json.dumps({"crs": crs}).encode("utf-8"),
+        }
+    )
+    # Only the schema changes, the column buffers are shared
+    return pa.Table.from_arrays(table.columns, schema=table.schema.set(index, field))
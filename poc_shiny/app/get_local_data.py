@@ -1,166 +1,271 @@
-from pathlib import Path
-import polars as pl
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
 
-import pandas as pd
-import os 
-import json
 import geopandas as gpd
-from shapely import wkb
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
 from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
-from google.cloud import storage
-from google.auth.transport.requests import Request
-from poc_shiny.app.gcs_get_parquet import get_parquet_from_bucket
+from shapely import wkb
 
+from poc_shiny.app.cancellation import CancellationToken, get_or_compute_cancellable
+from poc_shiny.app.gcs_get_parquet import table_to_dataframe
+from poc_shiny.app.geometry import tag_wkb_geometry
+from poc_shiny.app.legend import get_legend_color
+from poc_shiny.app.menu_index import get_menu_index
+from poc_shiny.app.result_cache import ResultCache
+from poc_shiny.app.schema import apply_schema, memory_report
+from poc_shiny.app.simplify import read_simplified_geometry
+from poc_shiny.app.storage import StorageBackend, get_backend
 
-# Define the root directory for the data
-ROOT_DIR = Path("/Users/regislon/Documents/no_backup/water_risk_assessment_mars/processed/parquet/exploded")
-current_path = os.path.dirname(os.path.abspath(__file__))
+# Default number of partitions downloaded at the same time by get_data
+DEFAULT_MAX_IN_FLIGHT = 8
 
-fpath_menu = os.path.join(current_path, "menu.json")
-with open(fpath_menu, "r", encoding="utf-8-sig") as f:
-    menu = json.load(f)
+load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Hive partition keys of the indicator dataset: model=/indicator=/adm0=/adm1=/type=, or model=/indicator=/adm0=/type=
+# once compacted
+PARTITION_KEYS = ["model", "indicator", "adm0", "adm1", "type"]
+PARTITIONING = ds.partitioning(pa.schema([(key, pa.string()) for key in PARTITION_KEYS]), flavor="hive")
+
+# Columns read by create_table, get_df_map and the plot (adm1 comes from the partition key)
+DATA_COLUMNS = [
+    "adastra_uuid",
+    "label_admin_name",
+    "area_54009_unit",
+    "area_54009_indicator_unit",
+    "area_‰",
+    "indicator_value",
+    "geometry",
+    "adm1",
+]
+
+# Geometry level of the map (0: full resolution, see simplify.LOD_TOLERANCES for the others)
+MAP_LOD = int(os.getenv("MAP_LOD", 0))
+# Schema metadata of the map tables: a new id each time the rows are read, so renders cached from an
+# older read are told apart
+LOAD_ID_KEY = b"load_id"
+
+# Process-level cache of get_data_plot_map results, shared by every session
+data_plot_map_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 1024**3)),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", 3600)),
+)
+
+
+
+def get_fpaths(
+    model: str = "*",
+    indicator: str = "*",
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "*",
+    backend: StorageBackend = None,
+):
+    """
+    Retrieve a list of parquet files based on specified filter criteria.
 
-load_dotenv()
+    Parameters:
+    model (str): Model name filter (default: "*").
+    indicator (str): Indicator name filter (default: "*").
+    adm0 (str): Country code filter (default: "*").
+    adm1 (str): Region code filter (default: "*").
+    type_area (str): Type filter (default: "*").
+    backend (StorageBackend): Storage to list (default: the configured backend).
 
+    Returns:
+    list of str: Paths, relative to the data folder, of the files matching the specified criteria.
+    """
+    backend = backend or get_backend()
 
+    # List the longest prefix without wildcard, then match the remaining partition keys
+    pattern = f"model={model}/indicator={indicator}/adm0={adm0}/adm1={adm1}/type={type_area}/*.parquet"
+    prefix = pattern.split("*")[0].rsplit("/", 1)[0]
+    list_files = [f for f in backend.list_files(prefix) if fnmatch(f, pattern)]
+    return list_files
 
-def get_gcs_fpaths(
-    model: str,
-    indicator: str,
-    adm0: str,
-):
-    bucket_name = os.getenv("GCS_BUCKET_NAME")
-    bucket_folder = os.getenv("GCS_BUCKET_FOLDER")
-    prefix = f"{bucket_folder}/model={model}/indicator={indicator}/adm0={adm0}"
 
 
+def get_adm1_from_prefix(prefix: str) -> str:
+    list_elements = prefix.split("/")
+    return list_elements[-3].split("=")[-1]
 
-    client_id = os.getenv("client_id")
-    client_secret = os.getenv("client_secret")
-    refresh_token = os.getenv("refresh_token")
-    quota_project_id = os.getenv("quota_project_id")
 
-    # Set up OAuth 2.0 credentials
-    credentials = Credentials(
-        token=None,
-        refresh_token=refresh_token,
-        client_id=client_id,
-        client_secret=client_secret,
-        token_uri="https://oauth2.googleapis.com/token",
-        quota_project_id=quota_project_id
-    )
 
-    # Refresh token to obtain a valid access token
-    credentials.refresh(Request())
+def fetch_partition(backend: StorageBackend, prefix: str) -> pa.Table:
+    adm1 = get_adm1_from_prefix(prefix)
+    table = backend.read_table(prefix)
+    return table.append_column("adm1", pa.repeat(pa.scalar(adm1, type=pa.string()), table.num_rows))
 
-    # Initialize Google Cloud Storage client with the OAuth 2.0 credentials
-    client = storage.Client(credentials=credentials, project=quota_project_id)
-    bucket = client.bucket(bucket_name)
 
-    # List objects in the specified bucket path
-    blobs = bucket.list_blobs(prefix=prefix)
 
-    blob_names = [blob.name for blob in blobs]
+def get_data(
+    list_prefix  : list,
+    max_in_flight: int = None,
+    backend: StorageBackend = None,
+    ):
+    """
+    Download and decode the adm1 partitions of a country.
 
-    return blob_names
+    Parameters:
+    list_prefix (list): Paths returned by get_fpaths.
+    max_in_flight (int): Maximum number of partitions fetched at the same time
+        (default: GCS_MAX_IN_FLIGHT, or 8). Use 1 to fetch sequentially.
+    backend (StorageBackend): Storage to read from (default: the configured backend).
 
-    
+    Returns:
+    pandas.DataFrame: All partitions concatenated, with an `adm1` column, cast to INDICATOR_SCHEMA.
+    """
+    backend = backend or get_backend()
+    if max_in_flight is None:
+        max_in_flight = int(os.getenv("GCS_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT))
 
+    if max_in_flight <= 1 or len(list_prefix) <= 1:
+        list_tables = [fetch_partition(backend, prefix) for prefix in list_prefix]
+    else:
+        # Download and decode the partitions in parallel, keeping the listing order
+        with ThreadPoolExecutor(max_workers=min(max_in_flight, len(list_prefix))) as executor:
+            list_tables = list(executor.map(lambda prefix: fetch_partition(backend, prefix), list_prefix))
 
+    # Concatenate once at Arrow level, then convert to pandas
+    table = pa.concat_tables(list_tables, promote_options="default")
+    df = apply_schema(table_to_dataframe(table))
+        
+    return df
 
 
 
 
-def get_local_fpaths(model: str = "*", indicator: str = "*", adm0: str = "*", adm1: str = "*", type_area: str = "*"):
+def open_data(
+    model: str,
+    indicator: str,
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "*",
+    backend: StorageBackend = None,
+    ):
     """
-    Retrieve a list of parquet files based on specified filter criteria.
+    Open the partitioned indicator dataset for a selection.
 
-    Parameters:
-    model (str): Model name filter (default: "*").
-    indicator (str): Indicator name filter (default: "*").
-    adm0 (str): Country code filter (default: "*").
-    adm1 (str): Region code filter (default: "*").
-    type_ (str): Type filter (default: "*").
+    Partition keys given as "*" are not filtered. The dataset is rooted at the deepest fully
+    specified directory down to adm0, the other keys are returned to be pushed down as filters.
+    adm1 and type are always filters: in the compacted tree (see `cli compact`) the adm1 files of
+    a country are merged under `adm0=/type=`, with adm1 as a column.
 
     Returns:
-    list of Path: List of file paths matching the specified criteria.
+    tuple: The pyarrow dataset and the {key: value} of the partition keys to filter on.
     """
-    # Use Path.glob to retrieve files matching the pattern
-    list_files = list(ROOT_DIR.glob(f"model={model}/indicator={indicator}/adm0={adm0}/adm1={adm1}/type={type_area}/*.parquet"))
-    return list_files
+    backend = backend or get_backend()
 
+    partition_values = dict(zip(PARTITION_KEYS, [model, indicator, adm0, adm1, type_area]))
+    prefix = []
+    for key in PARTITION_KEYS[: PARTITION_KEYS.index("adm0") + 1]:
+        if partition_values[key] == "*":
+            break
+        prefix.append(f"{key}={partition_values[key]}")
 
+    dataset = backend.open_dataset("/".join(prefix), partitioning=PARTITIONING)
+    return dataset, {key: value for key, value in partition_values.items() if value != "*"}
 
-def get_gcs_data(
+
+
+def get_scanner(
     model: str,
     indicator: str,
-    adm0: str,
-    list_prefix  : list
-    ):
-    bucket_name = os.getenv("GCS_BUCKET_NAME")
-    bucket_folder = os.getenv("GCS_BUCKET_FOLDER")
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "*",
+    columns: list = DATA_COLUMNS,
+    backend: StorageBackend = None,
+    ) -> ds.Scanner:
+    """
+    Build the pyarrow dataset scanner of a selection: only the matching fragments are opened
+    and only `columns` are read (see open_data). The partition keys below the root of the
+    dataset can be requested as columns.
+    """
+    dataset, partition_filter = open_data(model, indicator, adm0, adm1, type_area, backend)
 
-    list_pandas_df = []
+    filter_expression = None
+    for key, value in partition_filter.items():
+        expr = ds.field(key) == value
+        filter_expression = expr if filter_expression is None else filter_expression & expr
 
-    for prefix in list_prefix:
-        
-        list_elements = prefix.split("/")
-        adm1 = list_elements[-3].split("=")[-1]
-        
+    if columns is not None:
+        columns = [column for column in columns if column in dataset.schema.names]
 
+    max_in_flight = int(os.getenv("GCS_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT))
+    return dataset.scanner(columns=columns, filter=filter_expression, fragment_readahead=max_in_flight)
 
-        
-        df = get_parquet_from_bucket(bucket_name = bucket_name, 
-                                                bucket_suffix = prefix,filter=None)
-        
-        df["adm1"] = adm1
-        list_pandas_df.append(df)
-    
-    df = pd.concat(list_pandas_df)
-        
-    return df
 
 
+def scan_data(
+    model: str,
+    indicator: str,
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "*",
+    columns: list = DATA_COLUMNS,
+    backend: StorageBackend = None,
+    cancel_token: CancellationToken = None,
+    ) -> pa.Table:
+    """
+    Read the partitioned indicator dataset as a single pyarrow dataset scan (see get_scanner).
 
-    
+    With `cancel_token`, the scan is read batch by batch and stops (LoadCancelled) once
+    the token is cancelled.
+
+    Returns:
+    pyarrow.Table: The matching rows, with the partition keys available as columns.
+    """
+    scanner = get_scanner(model, indicator, adm0, adm1, type_area, columns, backend)
+    if cancel_token is None:
+        return scanner.to_table()
 
+    batches = []
+    for batch in scanner.to_batches():
+        cancel_token.check()
+        batches.append(batch)
+    return pa.Table.from_batches(batches, schema=scanner.projected_schema)
 
 
-def get_local_data(model: str = "*", indicator: str = "*", adm0: str = "*", adm1: str = "*", type_area: str = "*"):
 
-    list_files = get_local_fpaths(model, indicator, adm0, adm1, type_area)
+def scan_data_lazy(
+    model: str,
+    indicator: str,
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "*",
+    columns: list = DATA_COLUMNS,
+    backend: StorageBackend = None,
+    ) -> pl.LazyFrame:
+    """
+    Same as scan_data, as a lazy Polars scan: nothing is read until the query is collected,
+    and the partition filters and the column selection are pushed down to the pyarrow dataset.
+    The columns are cast to INDICATOR_SCHEMA as they are read.
+    """
+    dataset, partition_filter = open_data(model, indicator, adm0, adm1, type_area, backend)
 
-    list_df = []
+    lf = pl.scan_pyarrow_dataset(dataset)
+    for key, value in partition_filter.items():
+        lf = lf.filter(pl.col(key) == value)
 
-    for file in list_files:
-        # Load the parquet file using Polars
-        df = pl.read_parquet(file)
-        list_df.append(df)
-        
-    df = pl.concat(list_df)
-    return df
-    
+    if columns is not None:
+        lf = lf.select([column for column in columns if column in dataset.schema.names])
+    return apply_schema(lf)
 
 
 
 def get_adm1_dict(type_area, model, indicator, adm0):
-    
-    for i in menu:
-        if i.get("id") == type_area:
-            for j in i.get("children"):
-                if j.get("id") == model:
-                    for x in j.get("children"):
-                        if x.get("id") == indicator:
-                            for y in x.get("children"):
-                                if y.get("id") == adm0:
-                                    dict_adm1 = {z.get("id"):z.get("name") for z in y.get("children")}
-    return dict_adm1
-                        
+    return get_menu_index().get_children(type_area, model, indicator, adm0)
 
 
-def get_indicator_dict(model):
+
+def build_indicator_dict(model):
     _dict = dict() 
 
     if model == "aware" :
@@ -181,77 +286,153 @@ def get_indicator_dict(model):
 
 
 
-def get_df_map(df): 
-    df_pandas = df
-    # df_pandas = df_pandas.sort_values(['adastra_uuid', 'area_‰'], ascending=[True, False])
+def build_indicator_lookup(model) -> pl.Series:
+    """
+    Build the code -> category lookup array of a model, to be applied with one `gather`.
+
+    The values are an Enum whose categories follow the legend order, so indicator_value_name
+    stays categorical (Arrow dictionary / pandas Categorical) down to the plot and the map.
+    Codes without a category map to "No Data".
+    """
+    names = build_indicator_dict(model)
+    legend = list(get_legend_color(model).keys())
+    categories = [name for name in legend if name in names.values()]
+    categories += [name for name in dict.fromkeys(names.values()) if name not in categories]
+    return pl.Series(
+        "indicator_value_name",
+        [names.get(code, "No Data") for code in range(max(names) + 1)],
+        dtype=pl.Enum(categories),
+    )
+
+
 
+# Lookups of the two code lists, built once (AWARE codes 0-101, Aqueduct codes 0-5 and 99)
+INDICATOR_DICTS = {kind: build_indicator_dict(kind) for kind in ["aware", "aqueduct"]}
+INDICATOR_LOOKUPS = {kind: build_indicator_lookup(kind) for kind in ["aware", "aqueduct"]}
 
-    df_pandas_per_unit = df_pandas.copy()
-    df_pandas_per_unit['label'] = ((df_pandas_per_unit['area_‰'] / 10).astype(str) + "% : " +  df_pandas_per_unit['indicator_value_name'])
-    df_pandas_per_unit = df_pandas_per_unit.groupby(['adastra_uuid'])['label'].agg('<br>'.join).reset_index()
 
 
+def get_indicator_dict(model):
+    """
+    Return the {code: category} of a model. The dict is shared and must not be modified.
+    """
+    return INDICATOR_DICTS["aware" if model == "aware" else "aqueduct"]
+
 
 
-    df_pandas_one_per_unit = df_pandas.copy()
-    # print(df_pandas_one_per_unit.shape)
-    df_pandas_one_per_unit = df_pandas_one_per_unit.drop_duplicates(subset='adastra_uuid', keep='first')
-    # df_pandas_one_per_unit = df_pandas_one_per_unit.loc[df_pandas_one_per_unit.groupby('adastra_uuid')['area_‰'].idxmax()]
-    # print(df_pandas_one_per_unit.shape)
+def get_no_data_code(model) -> int:
+    """
+    Return the "No Data" code of a model: 101 for AWARE (where 99 is the "90" class), 99 for Aqueduct.
+    """
+    return next(code for code, name in get_indicator_dict(model).items() if name == "No Data")
 
 
 
-    df_pandas_one_per_unit = df_pandas_one_per_unit[["adastra_uuid","indicator_value_name","geometry","adm1_name","label_admin_name"]]
-    df_pandas_one_per_unit = df_pandas_one_per_unit.rename(columns={"adm1_name": "Administrative unit 1 name"})
-    df_pandas_one_per_unit = df_pandas_one_per_unit.rename(columns={"label_admin_name": "Municipality name"})
-    df_pandas_one_per_unit = df_pandas_one_per_unit.merge(df_pandas_per_unit, on="adastra_uuid", how="left")
-    # df_pandas_one_per_unit['geometry'] = df_pandas_one_per_unit['geometry'].apply(wkb.loads)
-    # gdf = gpd.GeoDataFrame(df_pandas_one_per_unit, geometry='geometry',crs="EPSG:4326")
+def get_indicator_lookup(model) -> pl.Series:
+    return INDICATOR_LOOKUPS["aware" if model == "aware" else "aqueduct"]
+
+
+
+def add_names(lf: pl.LazyFrame, model: str, indicator: str, adm0: str, type_area: str = "admin") -> pl.LazyFrame:
+    """
+    Add the adm1_name, indicator_value_name and adm0 columns to the rows read by scan_data_lazy.
+
+    indicator_value_name is taken from the lookup array of the model (an Enum in legend order),
+    adm1_name is a lexically ordered Categorical; adm1 codes missing from the menu keep their code.
+    """
+    lookup = get_indicator_lookup(model)
+    code = pl.col("indicator_value").cast(pl.Int64, strict=False)
+    no_data = lookup.to_list().index("No Data")
+    dict_adm1 = get_adm1_dict(type_area, model, indicator, adm0)
+    return lf.with_columns(
+        pl.col("adm1")
+        .cast(pl.Utf8)
+        .replace(dict_adm1, default=pl.col("adm1").cast(pl.Utf8))
+        .cast(pl.Categorical("lexical"))
+        .alias("adm1_name"),
+        pl.lit(lookup)
+        .gather(pl.when(code.is_between(0, len(lookup) - 1)).then(code).otherwise(no_data))
+        .alias("indicator_value_name"),
+        pl.lit(adm0, dtype=pl.Categorical("lexical")).alias("adm0"),
+    )
 
 
-    return df_pandas_one_per_unit
-    
 
+def get_df_plot(lf: pl.LazyFrame) -> pl.LazyFrame:
+    # Area of each category per administrative unit 1, summed in float64
+    return (
+        lf.group_by(["adm1_name", "indicator_value_name"])
+        .agg(pl.col("area_54009_indicator_unit").cast(pl.Float64).sum())
+        .sort([pl.col("adm1_name"), pl.col("indicator_value_name").cast(pl.Utf8)])
+    )
 
 
-def create_table(df,model):
 
+def format_per_mille(expr: pl.Expr) -> pl.Expr:
+    """
+    Format an integer per-mille as a percent with one decimal ("36.8"), as pandas prints `x / 10`.
 
-    if model == "aware":
-        df = df.groupby(
-            ["adastra_uuid", "adm1_name", "label_admin_name", "area_54009_unit", "adm0", "indicator_value_name"],
-            as_index=False
-        ).agg({"area_‰": "sum"})
+    Done with integer arithmetic: Polars casts floats to strings with their full binary expansion.
+    """
+    expr = expr.cast(pl.Int64)
+    return (expr // 10).cast(pl.Utf8) + "." + (expr % 10).cast(pl.Utf8)
 
 
 
-    # # Check for duplicates
-    # duplicates = df.duplicated(subset=["adastra_uuid", "adm1_name", "label_admin_name", "area_54009_unit", "adm0", "indicator_value_name"])
-    # if duplicates.any():
-    #     print("Warning: There are duplicate rows in the DataFrame based on the specified columns.")
-    #     print(df[duplicates]["adastra_uuid"])
-    #     adastra_uuid_list = df["adastra_uuid"].unique()
-    #     print("List of adastra_uuid:", adastra_uuid_list)
+def get_df_map(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Build the map query: one row per administrative unit, with its first category and the list of categories.
 
-    _df = df.pivot(
-        values="area_‰",
-        index=["adastra_uuid","adm1_name","label_admin_name","area_54009_unit","adm0"],
-        columns="indicator_value_name"
+    The WKB geometry is carried through untouched, the first row of each unit gives its geometry.
+    """
+    label = format_per_mille(pl.col("area_‰")) + "% : " + pl.col("indicator_value_name").cast(pl.Utf8)
+    return (
+        lf.group_by("adastra_uuid", maintain_order=True)
+        .agg(
+            pl.col("indicator_value_name").first(),
+            pl.col("geometry").first(),
+            pl.col("adm1_name").first().alias("Administrative unit 1 name"),
+            pl.col("label_admin_name").first().alias("Municipality name"),
+            label.str.concat("<br>").alias("label"),
         )
-    
+    )
+
+
+
+def map_to_arrow(df_map: pl.DataFrame) -> pa.Table:
+    """
+    Convert the collected map frame to the Arrow table given to lonboard, with a GeoArrow WKB geometry.
+    """
+    table = df_map.to_arrow()
+    # Polars exports large types, lonboard expects the regular ones
+    schema = pa.schema([field.with_type(get_regular_type(field.type)) for field in table.schema])
+    return tag_wkb_geometry(table.cast(schema))
+
+
+
+def get_load_id(table: pa.Table) -> str:
+    """
+    Return the id of the read that produced a map table of get_data_plot_map.
+    """
+    return (table.schema.metadata or {}).get(LOAD_ID_KEY, b"").decode()
+
 
-    _df.reset_index(inplace=True)
-    _df = _df.drop(columns=["adastra_uuid"])
-    _df = _df.rename(columns={"adm1_name":"Administrative unit 1 name"})
-    _df = _df.rename(columns={"label_admin_name":"Municipality name"})
-    _df = _df.rename(columns={"area_54009_unit":"Area"})
-    _df = _df.rename(columns={"adm0":"Country"})
-    
-    _df = _df.sort_values(by=["Administrative unit 1 name", "Municipality name"])
 
+def get_regular_type(data_type: pa.DataType) -> pa.DataType:
+    if pa.types.is_large_string(data_type):
+        return pa.string()
+    if pa.types.is_large_binary(data_type):
+        return pa.binary()
+    if pa.types.is_dictionary(data_type):
+        # pyarrow cannot convert unsigned dictionary indices to pandas
+        return pa.dictionary(pa.int32(), get_regular_type(data_type.value_type), data_type.ordered)
+    return data_type
 
+
+
+def get_table_column_order(model):
     if model != "aware":    
-        column_order = [
+        return [
             "Country",
             "Administrative unit 1 name",
             "Municipality name",
@@ -266,7 +447,7 @@ def create_table(df,model):
         ]
 
     else:
-        column_order = [
+        return [
             "Country",
             "Administrative unit 1 name",
             "Municipality name",
@@ -284,66 +465,125 @@ def create_table(df,model):
             "90",
             "100"
         ]
-    
-
-
-
-    _df = _df.fillna(0)
-
-    # Reorder the columns based on the defined order
-    for column in column_order:
-        if column not in _df.columns:
-            _df[column] = 0
-
-    _df = _df[column_order]
-
-    # Divide the specified columns by 10 and add a % sign
-    for column in _df.columns:
-        if column not in ["Country", "Administrative unit 1 name", "Municipality name", "Area"]:
-            _df[column] = (_df[column] / 10).astype(str) + '%'
-
 
-    return _df
 
 
+def create_table(lf: pl.LazyFrame, model) -> pl.LazyFrame:
+    """
+    Build the table query: one row per municipality and one per-mille share column per category.
 
+    The pivot is written as one conditional sum per category, which stays lazy and gives every
+    category of the model a column (0 when absent). For AWARE the rows of a category are summed.
+    The shares stay numeric (float32), they are formatted as percents when displayed (see table_view.py).
+    """
+    column_order = get_table_column_order(model)
+    categories = column_order[4:]
+    index = ["adastra_uuid", "adm1_name", "label_admin_name", "area_54009_unit", "adm0"]
+
+    return (
+        lf.group_by(index)
+        .agg(
+            [
+                pl.col("area_‰").filter(pl.col("indicator_value_name") == category).sum().alias(category)
+                for category in categories
+            ]
+        )
+        .sort(["adm1_name", "label_admin_name", "adastra_uuid", "area_54009_unit"])
+        .select(
+            pl.col("adm0").alias("Country"),
+            pl.col("adm1_name").alias("Administrative unit 1 name"),
+            pl.col("label_admin_name").alias("Municipality name"),
+            pl.col("area_54009_unit").alias("Area"),
+            *[pl.col(category).cast(pl.Float32) for category in categories],
+        )
+    )
 
 
-def get_data_plot_map(model: str, indicator : str , adm0: str = "*", adm1: str = "*", type_area: str = "admin"):
-
-
-    # Get the datafame
-    # df = get_local_data(model, indicator, adm0, adm1, type_area)
-    list_df_path = get_gcs_fpaths(model, indicator, adm0)
-    df = get_gcs_data(model, indicator, adm0,list_df_path)
-
-    # Get dict of indicator and adm1
-    dict_indicator = get_indicator_dict(model)
-    dict_adm1 = get_adm1_dict(type_area, model, indicator, adm0)
-    df["adm1_name"] = df["adm1"].map(lambda x: dict_adm1.get(x, x))
-    df["indicator_value_name"] = df["indicator_value"].map(lambda x: dict_indicator.get(x, x))
-    df["adm0"] = adm0
-
 
-    # Create table data
-    df_table = create_table(df,model)
-    
 
-    # Create map data
-    gdf = get_df_map(df)
 
-    # Create plot data
-    df_plot = df.groupby(["adm1_name", "indicator_value_name"], as_index=False).agg({"area_54009_indicator_unit": "sum"})
+def get_data_plot_map(
+    model: str,
+    indicator: str,
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "admin",
+    backend: StorageBackend = None,
+    lod: int = 0,
+    cancel_token: CancellationToken = None,
+):
+    """
+    Build the plot, map and table data of a selection with one lazy Polars query.
 
-    return df_plot, gdf, df_table
+    The three outputs share one scan of the partitions and are collected together, so the
+    rows are read and named once. `lod` picks the map geometry: 0 is the full-resolution
+    geometry of the partitions, higher levels are read from the simplified geometry file
+    of `type_area` (see `cli simplify`).
 
+    With `cancel_token`, LoadCancelled is raised between the steps: the rows are read first,
+    batch by batch when `lod` needs their ids for the geometry (see scan_data), else by the
+    lazy scan collected on its own, then the three outputs are collected.
 
+    Returns:
+    tuple: df_plot (pandas), the map table (Arrow, GeoArrow WKB geometry) and df_table (pandas).
+    """
+    backend = backend or get_backend()
+
+    # Get the datafame from the configured storage backend
+    if lod:
+        columns = [c for c in DATA_COLUMNS if c != "geometry"]
+        table = scan_data(model, indicator, adm0, adm1, columns=columns, backend=backend, cancel_token=cancel_token)
+        geometry = read_simplified_geometry(backend, type_area, lod, table.column("adastra_uuid"))
+        lf = apply_schema(pl.from_arrow(table.append_column("geometry", geometry)).lazy())
+    else:
+        lf = scan_data_lazy(model, indicator, adm0, adm1, backend=backend)
+        if cancel_token is not None:
+            # The pushed-down scan is read on its own, so a load cancelled meanwhile stops before the transforms
+            lf = lf.collect().lazy()
+    lf = add_names(lf, model, indicator, adm0, type_area)
+
+    if cancel_token is not None:
+        cancel_token.check()
+    df_plot, df_map, df_table = pl.collect_all([get_df_plot(lf), get_df_map(lf), create_table(lf, model)])
+    df_plot, df_map, df_table = df_plot.to_pandas(), map_to_arrow(df_map), df_table.to_pandas()
+    df_map = df_map.replace_schema_metadata({LOAD_ID_KEY: uuid.uuid4().hex})
+
+    report = memory_report({"plot": df_plot, "map": df_map, "table": df_table})
+    logger.info(
+        "Loaded %s/%s/%s/%s/%s (lod %s): %s bytes (plot %s, map %s, table %s)",
+        type_area, model, indicator, adm0, adm1, lod, report["total_bytes"],
+        report["plot"]["bytes"], report["map"]["bytes"], report["table"]["bytes"],
+    )
+    return df_plot, df_map, df_table
 
 
 
-if __name__ == "__main__":
-#     # Example usage of get_local_data
-    df,gdf,plot = get_data_plot_map(model="aqueduct_4", indicator="baseline_water_stress", adm0="BRA")
-#     # ff = get_gcs_fpaths(model="aqueduct_4", indicator="seasonal_variability", adm0="BRA")
-#     # gg = get_gcs_data(model="aqueduct_4", indicator="seasonal_variability", adm0="BRA", list_prefix=ff)
+def get_data_plot_map_cached(
+    model: str,
+    indicator: str,
+    adm0: str = "*",
+    adm1: str = "*",
+    type_area: str = "admin",
+    lod: int = MAP_LOD,
+    cancel_token: CancellationToken = None,
+):
+    """
+    Same as get_data_plot_map, served from the process-level cache.
 
+    The returned frames are shared between sessions and must not be modified in place.
+    """
+    key = (type_area, model, indicator, adm0, adm1, lod)
+    return get_or_compute_cancellable(
+        data_plot_map_cache,
+        key,
+        lambda: get_data_plot_map(
+            model=model,
+            indicator=indicator,
+            adm0=adm0,
+            adm1=adm1,
+            type_area=type_area,
+            lod=lod,
+            cancel_token=cancel_token,
+        ),
+        cancel_token,
+    )
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def get_legend_color(model,hex_color: bool = True):
+
+    if model != "aware" :
+        color_dict = {
+            "Low (<10%)": "#add8e6",
+            "Low - Medium (10-20%)": "#ffff99",
+            "Medium - High (20-40%)": "#ffd7ba",
+            "High (40-80%)": "#ff6347",
+            "Extremely High (>80%)": "#ff0000",
+            "Arid and Low Water Use": "#a9a9a9",
+            "No Data": "#808080"
+        }
+
+    else:
+        color_dict = {
+            "0": "#00ff00",
+            "10": "#55ff00",
+            "20": "#aaff00",
+            "30": "#ffff00",
+            "40": "#ffaa00",
+            "50": "#ff5500",
+            "60": "#ff0000",
+            "70": "#cc0000",
+            "80": "#990000",
+            "90": "#660000",
+            "100": "#330000",
+            "No Data": "#808080"
+        }
+
+    if hex_color:
+        return color_dict
+    else:
+        # Convert hex color codes to RGB integer tuples
+        try:
+            return {
+                k: [int(v[i:i+2], 16) for i in (1, 3, 5)]
+                for k, v in color_dict.items()
+            }
+        except ValueError as e:
+            raise ValueError(f"Invalid hex color format in color_dict: {color_dict}") from e
+
+
+
+
+def get_fill_colors(categories, color_map: dict, default_color: list = [128, 128, 128]) -> np.ndarray:
+    """
+    Look up the RGB color of each category in one vectorized take (unknown categories get `default_color`).
+
+    Dictionary-encoded Arrow columns are looked up once per dictionary value, then taken by index.
+    """
+    # Code -1 (unknown category) picks the last row of the palette
+    palette = np.array(list(color_map.values()) + [default_color], dtype=np.uint8)
+
+    if isinstance(categories, pa.Array | pa.ChunkedArray) and pa.types.is_dictionary(categories.type):
+        chunks = categories.chunks if isinstance(categories, pa.ChunkedArray) else [categories]
+        colors = [
+            palette[get_category_codes(chunk.dictionary.to_numpy(zero_copy_only=False), color_map)][
+                chunk.indices.to_numpy(zero_copy_only=False)
+            ]
+            for chunk in chunks
+        ]
+        return np.concatenate(colors) if colors else np.empty((0, 3), dtype=np.uint8)
+
+    if isinstance(categories, pa.Array | pa.ChunkedArray):
+        categories = categories.to_numpy(zero_copy_only=False)
+    return palette[get_category_codes(np.asarray(categories), color_map)]
+
+
+
+def get_category_codes(categories: np.ndarray, color_map: dict) -> np.ndarray:
+    return pd.Categorical(categories, categories=list(color_map.keys())).codes
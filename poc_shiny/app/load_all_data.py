@@ -1,32 +1,27 @@
+import time
 
-from pathlib import Path
-from typing import Optional
-import json
-import polars as pl
+import geopandas as gpd
+import numpy as np
 import pandas as pd
-import os 
+import polars as pl
 from dotenv import load_dotenv
-from poc_shiny.app.gcs_get_parquet import get_parquet_from_bucket
-from poc_shiny.app.gcs_get_json import get_json_from_bucket
 
+from poc_shiny.app.geometry import decode_wkb
+from poc_shiny.app.schema import apply_schema
+from poc_shiny.app.simplify import read_simplified_geometry
+from poc_shiny.app.storage import StorageBackend, get_backend
 
 load_dotenv()
 
 
-def load_country_specific_data(
-    model: str, 
-    indicator: str, 
-    country: str,
-    data_type : str = "admin"
-) -> pd.DataFrame :
-    
-
-    bucket_name = os.getenv("GCS_BUCKET_NAME")
-    bucket_folder = os.getenv("GCS_BUCKET_FOLDER")
+def get_indicator_name(model: str, indicator: str, backend: StorageBackend = None) -> str:
+    """
+    Return the `indicator_name` of (model, indicator) in the country-level files, from indicators.json.
+    """
+    backend = backend or get_backend()
 
     # Load the config file
-    bucket_suffix = f"{bucket_folder}/indicators.json"
-    dict_indicators = get_json_from_bucket(bucket_name, bucket_suffix)
+    dict_indicators = backend.read_json("indicators.json")
 
     # Retrieve the specific indicator value, with checks for missing keys
     model_data = dict_indicators.get(model)
@@ -40,58 +35,212 @@ def load_country_specific_data(
     current_indicator = indicator_data.get('indicator')
     if not current_indicator:
         raise ValueError(f"Indicator name for '{indicator}' in model '{model}' is missing.")
-    
 
+    return current_indicator
+
+
+def format_share(per_mille: pl.Expr, unit_per_mille: pl.Expr) -> pl.Expr:
+    """
+    Format the share `per_mille / unit_per_mille` with 2 decimals as pandas prints them ("0.5", "0.12", "1.0").
+
+    The share is rounded in integers, half to even on exact ties (0.125 is "0.12", 0.335 is "0.34"),
+    and is "nan" for a unit of no weight.
+    """
+    scaled = per_mille.cast(pl.Int64) * 100
+    unit_per_mille = unit_per_mille.cast(pl.Int64)
+    hundredths = scaled // unit_per_mille
+    twice_remainder = 2 * (scaled - hundredths * unit_per_mille)
+    round_up = (twice_remainder > unit_per_mille) | ((twice_remainder == unit_per_mille) & (hundredths % 2 == 1))
+    hundredths = hundredths + round_up.cast(pl.Int64)
+    decimals = (
+        pl.when(hundredths % 10 == 0)
+        .then((hundredths % 100 // 10).cast(pl.Utf8))
+        .otherwise((hundredths % 100).cast(pl.Utf8).str.zfill(2))
+    )
+    share = (hundredths // 100).cast(pl.Utf8) + "." + decimals
+    return pl.when(unit_per_mille > 0).then(share).otherwise(pl.lit("nan"))
+
+
+def aggregate_units(lf: pl.LazyFrame, weight: str) -> tuple:
+    """
+    Reduce the (adastra_uuid, indicator_value, ratio_per_1000, `weight`) rows of one indicator in a single pass.
+
+    The rows are summed once per (unit, value), and both outputs are read from these sums:
+    the total `weight` of each value for the plot, and for each unit its highest value and a
+    "value (share), ..." label. Shares are computed from the integer per-mille of the rows,
+    which are the area shares of the unit, so their rounding does not depend on the float areas.
+
+    Returns:
+    tuple: The lazy plot totals (value, total_area_ha) and unit values (adastra_uuid, label, indicator_value).
+    """
+    per_value = (
+        lf.group_by("adastra_uuid", "indicator_value")
+        .agg(pl.col(weight).sum(), pl.col("ratio_per_1000").cast(pl.Int64).sum().alias("per_mille"))
+        .with_columns(pl.col("per_mille").sum().over("adastra_uuid").alias("unit_per_mille"))
+        .sort(["adastra_uuid", "indicator_value"])
+    )
+
+    df_plot = (
+        per_value.group_by("indicator_value")
+        .agg(pl.col(weight).sum().alias("total_area_ha"))
+        .sort("indicator_value")
+        .rename({"indicator_value": "value"})
+    )
+
+    share = format_share(pl.col("per_mille"), pl.col("unit_per_mille"))
+    label = pl.col("indicator_value").cast(pl.Utf8) + " (" + share + ")"
+    units = (
+        per_value.with_columns(label.alias("label"))
+        .group_by("adastra_uuid", maintain_order=True)
+        .agg(pl.col("label").str.concat(", "), pl.col("indicator_value").max())
+    )
+    return df_plot, units
+
+
+def read_country_tables(
+    model: str,
+    indicator: str,
+    country: str,
+    data_type: str = "admin",
+    backend: StorageBackend = None,
+    lod: int = 0,
+    geometry: bool = True,
+) -> tuple:
+    """
+    Read the indicator rows (adastra_uuid, indicator_value, ratio_per_1000) and the units
+    (adastra_uuid, area_ha, geom) of a country.
+    """
+    backend = backend or get_backend()
+    current_indicator = get_indicator_name(model, indicator, backend)
 
     # Load the indicators data
     filter = {"indicator_name": current_indicator,"country": country}
-    df_indicators = get_parquet_from_bucket(bucket_name = bucket_name, 
-                                            bucket_suffix = f"{bucket_folder}/df_{data_type}_indicators.parquet", 
-                                            filter = filter)
-    
-    
-    # Replace values and cast type
-    df_indicators['indicator_value'] = df_indicators['indicator_value'].replace(['-9999', '-', '-1'], 99).astype('uint8')
+    columns = ["adastra_uuid", "indicator_value", "ratio_per_1000"]
+    table_indicators = backend.read_table(f"df_{data_type}_indicators.parquet", filter = filter, columns = columns)
 
     # Load the geometry data
     filter = {"country": country}
-    gdf = get_parquet_from_bucket(bucket_name = bucket_name, 
-                                            bucket_suffix = f"{bucket_folder}/{data_type}.parquet", 
-                                            filter = filter)
-    
-    
-
-    # Prepare the data for the plot   
-    admin_areas = gdf[['area_ha','adastra_uuid']]
-    df_indicators_with_area = pd.merge(df_indicators, admin_areas, on='adastra_uuid', how='left')
-    df_indicators_with_area["adjusted_area"] = df_indicators_with_area["area_ha"] * df_indicators_with_area["ratio_per_1000"] / 1000
-    grouped_df = df_indicators_with_area.groupby("indicator_value", as_index=False)["adjusted_area"].sum()
-    df_plot = grouped_df.rename(columns={"indicator_value": "value", "adjusted_area": "total_area_ha"})
-
-    
+    if lod or not geometry:
+        table = backend.read_table(f"{data_type}.parquet", filter = filter, columns = ["adastra_uuid", "area_ha"])
+        if geometry:
+            geometry = read_simplified_geometry(backend, data_type, lod, table.column("adastra_uuid"), country=country)
+            table = table.append_column("geom", geometry)
+    else:
+        columns = ["adastra_uuid", "area_ha", "geom"]
+        table = backend.read_table(f"{data_type}.parquet", filter = filter, columns = columns)
 
-    # prepare the data for the map
-    grouped_df = df_indicators_with_area.groupby(["indicator_value","adastra_uuid"], as_index=False)["adjusted_area"].sum()
-    sum_per_uuid = df_indicators_with_area.groupby("adastra_uuid", as_index=False)["adjusted_area"].sum()
-    grouped_df = grouped_df.merge(sum_per_uuid, on='adastra_uuid', how='left')
-    grouped_df["ratio"] = grouped_df["adjusted_area_x"] / grouped_df["adjusted_area_y"]
-    grouped_df["ratio"] = grouped_df["ratio"].round(2)
-    grouped_df["label"] = grouped_df["indicator_value"].astype(str) + " (" + grouped_df["ratio"].astype(str) + ")"
-    grouped_df = grouped_df.groupby("adastra_uuid").agg({
-        "label": lambda x: ", ".join(x),
-        "indicator_value": "max"
-    }).reset_index()
-    grouped_df = grouped_df[['adastra_uuid', 'label', 'indicator_value']]
-    gdf = gdf[['adastra_uuid','geom']]
-    gdf = gdf.merge(grouped_df, on='adastra_uuid', how='left')
-    gdf = gdf.set_crs(4326)
-
-
-    return df_plot,gdf
-
-    
+    return table_indicators, table
 
 
+def join_areas(table_indicators, table) -> pl.LazyFrame:
+    """
+    Cast both tables to the compact schema and add the area of each indicator row (adjusted_area).
 
+    The missing values (-9999, -, -1) get the code 99. Must run under a pl.StringCache, as the
+    join is on the categorical adastra_uuid.
+    """
+    df_indicators = apply_schema(pl.from_arrow(table_indicators).lazy(), no_data_code=99)
+    areas = apply_schema(pl.from_arrow(table.select(["adastra_uuid", "area_ha"])).lazy())
+    return df_indicators.join(areas, on="adastra_uuid", how="left", coalesce=True).with_columns(
+        (pl.col("area_ha") * pl.col("ratio_per_1000") / 1000).alias("adjusted_area")
+    )
 
 
+def load_country_specific_data(
+    model: str,
+    indicator: str,
+    country: str,
+    data_type : str = "admin",
+    backend: StorageBackend = None,
+    lod: int = 0,
+) -> pd.DataFrame :
+    """
+    Load the plot totals and the map of one indicator for a country, from the country-level files.
+
+    `lod` picks the geometry level: 0 is the full resolution of {data_type}.parquet, higher levels
+    are the simplified geometries written by `cli simplify` (see LOD_TOLERANCES).
+
+    Returns:
+    tuple: df_plot (value, total_area_ha) and the GeoDataFrame of the units
+    (adastra_uuid, geom, label, indicator_value).
+    """
+    table_indicators, table = read_country_tables(model, indicator, country, data_type, backend, lod)
+
+    # Plot totals and unit values in one aggregation, joined to the geometry of the units
+    with pl.StringCache():
+        df_plot, unit_values = aggregate_units(join_areas(table_indicators, table), "adjusted_area")
+        units = apply_schema(pl.from_arrow(table.select(["adastra_uuid", "geom"])).lazy())
+        units = units.join(unit_values, on="adastra_uuid", how="left", coalesce=True)
+        df_plot, units = pl.collect_all([df_plot, units])
+
+    gdf = units.drop("geom").to_pandas()
+    gdf.insert(1, "geom", gpd.GeoSeries(decode_wkb(units["geom"].to_arrow()), index=gdf.index))
+    gdf = gpd.GeoDataFrame(gdf, geometry="geom", crs="EPSG:4326")
+
+    return df_plot.to_pandas(), gdf
+
+
+def aggregate_units_pandas(df: pd.DataFrame, weight: str) -> tuple:
+    """
+    Reference of aggregate_units written with pandas groupbys and merges (the previous
+    load_country_specific_data), for `cli benchmark-country`.
+    """
+    df_plot = df.groupby("indicator_value", as_index=False, observed=True)[weight].sum()
+    df_plot = df_plot.rename(columns={"indicator_value": "value", weight: "total_area_ha"})
+
+    grouped_df = df.groupby(["indicator_value", "adastra_uuid"], as_index=False, observed=True)[weight].sum()
+    sum_per_uuid = df.groupby("adastra_uuid", as_index=False, observed=True)[weight].sum()
+    grouped_df = grouped_df.merge(sum_per_uuid, on="adastra_uuid", how="left")
+    ratio = (grouped_df[f"{weight}_x"] / grouped_df[f"{weight}_y"]).round(2)
+    grouped_df["label"] = grouped_df["indicator_value"].astype(str) + " (" + ratio.astype(str) + ")"
+    units = grouped_df.groupby("adastra_uuid", observed=True).agg(
+        {"label": lambda x: ", ".join(x), "indicator_value": "max"}
+    )
+    return df_plot, units.reset_index()
+
+
+def benchmark_country_aggregation(
+    model: str, indicator: str, country: str, data_type: str = "admin", backend: StorageBackend = None, repeat: int = 3
+) -> dict:
+    """
+    Time aggregate_units against the pandas reference on the rows of a country and compare their outputs.
+
+    Plot totals and unit values must match. Labels may only differ on shares halfway between two
+    rounded values (e.g. 0.335), which aggregate_units rounds half to even exactly and pandas rounds
+    from the float ratio.
+    """
+    table_indicators, table = read_country_tables(model, indicator, country, data_type, backend, geometry=False)
+    with pl.StringCache():
+        rows = join_areas(table_indicators, table).collect()
+    rows_pandas = rows.to_pandas()
+
+    runs = {
+        "polars": lambda: [
+            frame.to_pandas() for frame in pl.collect_all(aggregate_units(rows.lazy(), "adjusted_area"))
+        ],
+        "pandas": lambda: aggregate_units_pandas(rows_pandas, "adjusted_area"),
+    }
+    outputs = {}
+    seconds = {}
+    for name, run in runs.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs[name] = run()
+            timings.append(time.perf_counter() - start)
+        seconds[name] = round(min(timings), 4)
+
+    (plot, units), (plot_reference, units_reference) = outputs["polars"], outputs["pandas"]
+    units = units.astype({"adastra_uuid": str}).set_index("adastra_uuid")
+    units_reference = units_reference.astype({"adastra_uuid": str}).set_index("adastra_uuid").loc[units.index]
+    return {
+        "rows": rows.height,
+        "units": len(units),
+        "seconds": seconds,
+        "plot_matches": bool(
+            plot["value"].tolist() == plot_reference["value"].tolist()
+            and np.allclose(plot["total_area_ha"], plot_reference["total_area_ha"])
+        ),
+        "values_match": bool((units["indicator_value"] == units_reference["indicator_value"]).all()),
+        "labels_differing": int((units["label"] != units_reference["label"]).sum()),
+    }
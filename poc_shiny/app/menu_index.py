@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+from types import MappingProxyType
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+fpath_menu = os.path.join(current_path, "menu.json")
+
+
+def dedupe_nodes(nodes: list) -> list:
+    """
+    Keep the last of the sibling nodes that share an id, recursively, at the position of the first.
+
+    This is what the nested scans of menu.json returned: menu.json lists `aqueduct_3` twice under
+    each type, first as a mislabelled "Aqueduct 4" copy of 5 indicators that are not in the bucket,
+    then as the 48 indicators of Aqueduct 3, and only the last one was ever offered.
+    """
+    deduped = {}
+    for node in nodes:
+        deduped[node.get("id")] = {
+            "id": node.get("id"),
+            "name": node.get("name"),
+            "children": dedupe_nodes(node.get("children") or []),
+        }
+    return list(deduped.values())
+
+
+class MenuIndex:
+    """
+    Read-only index of the menu tree.
+
+    Every path from the root, e.g. (type, model, indicator, adm0), maps to its children
+    as an ordered {id: name} dict, and to its own name, so each lookup is one dict access.
+    """
+
+    def __init__(self, menu: list):
+        children = {}
+        labels = {}
+
+        def visit(path: tuple, nodes: list):
+            children[path] = MappingProxyType({node["id"]: node["name"] for node in nodes})
+            for node in nodes:
+                node_path = path + (node["id"],)
+                labels[node_path] = node["name"]
+                visit(node_path, node["children"])
+
+        visit((), dedupe_nodes(menu))
+        self._children = MappingProxyType(children)
+        self._labels = MappingProxyType(labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def get_children(self, *path) -> dict:
+        """
+        Return the {id: name} of the children of `path`, empty when the path is unknown.
+        """
+        return dict(self._children.get(tuple(path), {}))
+
+    def get_label(self, *path, default=None):
+        return self._labels.get(tuple(path), default)
+
+
+def load_menu_index(path: str = fpath_menu) -> MenuIndex:
+    with open(path, encoding="utf-8-sig") as f:
+        return MenuIndex(json.load(f))
+
+
+_menu_index = None
+_menu_index_lock = threading.Lock()
+
+
+def get_menu_index() -> MenuIndex:
+    """
+    Return the process-wide index of menu.json, built on first use.
+    """
+    global _menu_index
+
+    with _menu_index_lock:
+        if _menu_index is None:
+            _menu_index = load_menu_index()
+        return _menu_index
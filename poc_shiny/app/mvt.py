@@ -0,0 +1,144 @@
+import numpy as np
+import shapely
+
+# Mapbox Vector Tile 2.1 encoder (protobuf wire format written by hand, polygons only)
+
+EXTENT = 4096
+
+POLYGON = 3
+MOVE_TO = 1
+LINE_TO = 2
+CLOSE_PATH = 7
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _length_delimited(field: int, payload: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field: int, values) -> bytes:
+    return _length_delimited(field, b"".join(_varint(v) for v in values))
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    return (values << 1) ^ (values >> 63)
+
+
+def _command(command_id: int, count: int) -> int:
+    return (command_id & 0x7) | (count << 3)
+
+
+def _encode_value(value) -> bytes:
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int | np.integer):
+        value = int(value)
+        return _key(4, 0) + _varint(value) if value >= 0 else _key(6, 0) + _varint((value << 1) ^ (value >> 63))
+    if isinstance(value, float | np.floating):
+        return _key(3, 1) + np.float64(value).tobytes()
+    return _length_delimited(1, str(value).encode("utf-8"))
+
+
+def _ring_commands(ring: np.ndarray, cursor: np.ndarray, exterior: bool) -> list:
+    """
+    Encode one ring (already in integer tile coordinates, closing point excluded) and move the cursor.
+    """
+    # Exterior rings have a positive surveyor's area in tile coordinates (clockwise with y down)
+    area = np.sum(ring[:, 0] * np.roll(ring[:, 1], -1) - np.roll(ring[:, 0], -1) * ring[:, 1])
+    if (area > 0) != exterior:
+        ring = ring[::-1]
+
+    deltas = _zigzag(np.diff(np.vstack([cursor, ring]), axis=0))
+    cursor[:] = ring[-1]
+    return [
+        _command(MOVE_TO, 1),
+        *deltas[0].tolist(),
+        _command(LINE_TO, len(ring) - 1),
+        *deltas[1:].ravel().tolist(),
+        _command(CLOSE_PATH, 1),
+    ]
+
+
+def _quantize_ring(coords: np.ndarray):
+    """
+    Round a closed ring to integer tile coordinates and drop the repeated points; None when degenerate.
+    """
+    ring = np.rint(coords[:-1]).astype(np.int64)
+    keep = np.any(ring != np.roll(ring, 1, axis=0), axis=1)
+    ring = ring[keep]
+    return ring if len(ring) >= 3 else None
+
+
+def encode_polygon(geometry) -> list:
+    """
+    Return the MVT geometry commands of a Polygon / MultiPolygon in tile coordinates.
+    """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for polygon in getattr(geometry, "geoms", [geometry]):
+        exterior = _quantize_ring(np.asarray(polygon.exterior.coords))
+        if exterior is None:
+            continue
+        commands += _ring_commands(exterior, cursor, exterior=True)
+        for interior in polygon.interiors:
+            ring = _quantize_ring(np.asarray(interior.coords))
+            if ring is not None:
+                commands += _ring_commands(ring, cursor, exterior=False)
+    return commands
+
+
+def encode_layer(name: str, geometries, properties: dict, extent: int = EXTENT) -> bytes:
+    """
+    Encode one polygon layer.
+
+    `geometries` are shapely geometries in tile coordinates (0..extent, y down) and `properties`
+    maps each attribute name to a sequence aligned with `geometries`. Features whose geometry
+    collapses at this resolution are skipped.
+    """
+    keys = list(properties)
+    values = {}
+    features = []
+    for i, geometry in enumerate(geometries):
+        if geometry is None or geometry.is_empty:
+            continue
+        polygons = shapely.get_parts(geometry)
+        polygons = polygons[shapely.get_type_id(polygons) == 3]
+        if len(polygons) == 0:
+            continue
+        commands = encode_polygon(shapely.multipolygons(polygons) if len(polygons) > 1 else polygons[0])
+        if not commands:
+            continue
+
+        tags = []
+        for key_index, key in enumerate(keys):
+            value = properties[key][i]
+            if value is None:
+                continue
+            tags += [key_index, values.setdefault(value, len(values))]
+        features.append(
+            _packed(2, tags) + _key(3, 0) + _varint(POLYGON) + _packed(4, commands)
+        )
+
+    if not features:
+        return b""
+    layer = (
+        _key(15, 0) + _varint(2)
+        + _length_delimited(1, name.encode("utf-8"))
+        + b"".join(_length_delimited(2, feature) for feature in features)
+        + b"".join(_length_delimited(3, key.encode("utf-8")) for key in keys)
+        + b"".join(_length_delimited(4, _encode_value(value)) for value in values)
+        + _key(5, 0) + _varint(extent)
+    )
+    return _length_delimited(3, layer)
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from poc_shiny.app.get_local_data import get_load_id
+from poc_shiny.app.legend import get_fill_colors, get_legend_color
+
+# Names of the map columns in the tooltip of the polygons
+MAP_COLUMN_NAMES = {"indicator_value_name": "Category", "label": "List of category"}
+
+
+@dataclass(frozen=True)
+class RenderPayload:
+    """
+    Render-ready data of one loaded selection, built once per load and shared by the outputs.
+
+    The frames are shared with the other outputs (and possibly other sessions): renderers
+    read them and must not modify them.
+    """
+
+    model: str
+    indicator: str
+    adm0: str
+    type_area: str
+    plot: pd.DataFrame
+    table: pd.DataFrame
+    map: pa.Table | None = None
+    fill_colors: np.ndarray | None = None
+    # Geometry level and read of the map (see get_data_plot_map), part of the key of its cached layer
+    lod: int = 0
+    load_id: str = ""
+
+
+def get_plot_frame(df_plot: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the share of each category in its administrative unit 1 (rounded percent) and its text.
+    """
+    df = df_plot.copy()
+    area = df["area_54009_indicator_unit"]
+    df["normalized_area"] = (area / area.groupby(df["adm1_name"], observed=True).transform("sum") * 100).round()
+    df["normalized_area_text"] = df["normalized_area"].astype(str) + "%"
+    return df
+
+
+def get_map_table(table: pa.Table) -> pa.Table:
+    """
+    Prepare the map table for the polygon layer: without adastra_uuid, categories as plain
+    strings for the tooltip and the tooltip column names.
+    """
+    if "adastra_uuid" in table.column_names:
+        table = table.drop_columns(["adastra_uuid"])
+    table = table.cast(
+        pa.schema([f.with_type(pa.string()) if pa.types.is_dictionary(f.type) else f for f in table.schema])
+    )
+    return table.rename_columns([MAP_COLUMN_NAMES.get(c, c) for c in table.column_names])
+
+
+def build_payload(
+    model: str,
+    indicator: str,
+    adm0: str,
+    type_area: str,
+    df_plot: pd.DataFrame,
+    df_table: pd.DataFrame,
+    table_map: pa.Table = None,
+    lod: int = 0,
+) -> RenderPayload:
+    """
+    Build the render-ready payload of a selection from its loaded plot, table and map data.
+    """
+    map_table, fill_colors, load_id = None, None, ""
+    if table_map is not None:
+        load_id = get_load_id(table_map)
+        # Colors are looked up on the dictionary-encoded categories, before the cast to strings
+        fill_colors = get_fill_colors(
+            table_map.column("indicator_value_name"), get_legend_color(model, hex_color=False)
+        )
+        map_table = get_map_table(table_map)
+
+    return RenderPayload(
+        model=model,
+        indicator=indicator,
+        adm0=adm0,
+        type_area=type_area,
+        plot=get_plot_frame(df_plot),
+        table=df_table,
+        map=map_table,
+        fill_colors=fill_colors,
+        lod=lod,
+        load_id=load_id,
+    )
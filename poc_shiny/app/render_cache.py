@@ -0,0 +1,78 @@
+import os
+
+import plotly.express as px
+from dotenv import load_dotenv
+from lonboard import PolygonLayer
+
+from poc_shiny.app.legend import get_legend_color
+from poc_shiny.app.payload import RenderPayload
+from poc_shiny.app.result_cache import ResultCache
+
+load_dotenv()
+
+# Serialized figures and map layers of the selections viewed lately, shared by the sessions
+render_cache = ResultCache(
+    max_bytes=int(os.getenv("RENDER_CACHE_MAX_BYTES", 256 * 1024**2)),
+    ttl=float(os.getenv("RESULT_CACHE_TTL", 3600)),
+)
+
+# Style of the polygons of the lonboard map
+MAP_LAYER_STYLE = {"get_line_width": 1000, "get_line_color": [37, 36, 34]}
+
+
+def get_render_key(kind: str, payload: RenderPayload) -> tuple:
+    return (kind, payload.type_area, payload.model, payload.indicator, payload.adm0)
+
+
+def build_figure(payload: RenderPayload):
+    """
+    Build the stacked bar plot of the categories per administrative unit 1.
+    """
+    color_map_hex = get_legend_color(payload.model, hex_color=True)
+    fig = px.bar(
+        payload.plot,
+        x="adm1_name",
+        y="normalized_area",
+        color="indicator_value_name",
+        labels={"normalized_area": "Percentage (%)", "adm1_name": "Administrative Region"},
+        text="normalized_area_text",
+        color_discrete_map=color_map_hex,
+        category_orders={"indicator_value_name": list(color_map_hex.keys())},
+    )
+    fig.update_layout(
+        yaxis_title="Percentage (%)",
+        xaxis_title="Administrative Region",
+        barmode="stack",
+        legend_title_text="Categories",
+    )
+    return fig
+
+
+def get_figure_json(payload: RenderPayload) -> str:
+    """
+    Return the plot of a selection as plotly JSON, built once and cached.
+
+    `</` is escaped so the JSON can be inlined in a <script> tag.
+    """
+    return render_cache.get_or_compute(
+        get_render_key("plot", payload), lambda: build_figure(payload).to_json().replace("</", "<\\/")
+    )
+
+
+def get_polygon_layer(payload: RenderPayload) -> PolygonLayer:
+    """
+    Return the polygon layer of the map of a selection.
+
+    Widgets belong to a session and cannot be cached, so the first view caches the table
+    of its layer, with the geometries already parsed from WKB, and its colors; the next
+    views build their layer from them.
+    """
+    key = (*get_render_key("map", payload), payload.lod, payload.load_id)
+    prebuilt = render_cache.get(key)
+    if prebuilt is not None:
+        return PolygonLayer(table=prebuilt["table"], get_fill_color=prebuilt["get_fill_color"], **MAP_LAYER_STYLE)
+
+    # One layer for all the units, colored per feature from their category
+    layer = PolygonLayer(table=payload.map, get_fill_color=payload.fill_colors, **MAP_LAYER_STYLE)
+    render_cache.put(key, {"table": layer.table, "get_fill_color": layer.get_fill_color})
+    return layer
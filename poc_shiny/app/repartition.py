@@ -0,0 +1,263 @@
+import logging
+import posixpath
+import re
+import tempfile
+from collections import defaultdict
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs as pafs
+
+from poc_shiny.app.gcs_client import get_gcsfs
+
+logger = logging.getLogger(__name__)
+
+
+# Sort keys of the country-level files, in the order load_country_specific_data filters on them
+INDICATORS_SORT_KEYS = ["country", "indicator_name", "adastra_uuid"]
+GEOMETRY_SORT_KEYS = ["country", "adastra_uuid"]
+
+# Leaf directories of the indicator partition tree, merged per country by compact_partitions
+PARTITION_DIRECTORY = re.compile(
+    r"(?P<country>(^|/)model=[^/]+/indicator=[^/]+/adm0=[^/]+)/adm1=(?P<adm1>[^/]+)/(?P<type>type=[^/]+)$"
+)
+
+# Uncompressed size aimed for each row group: small enough for a range request to fetch
+# little more than the rows of one country, large enough to keep the footer small
+DEFAULT_ROW_GROUP_BYTES = 8 * 1024**2
+
+
+def resolve_path(uri: str):
+    """
+    Return the pyarrow filesystem and path of a local path or a gs:// URI.
+    """
+    if uri.startswith("gs://"):
+        return pafs.PyFileSystem(pafs.FSSpecHandler(get_gcsfs())), uri[len("gs://"):].rstrip("/")
+    return pafs.LocalFileSystem(), posixpath.abspath(uri)
+
+
+def get_rows_per_group(nbytes: int, num_rows: int, row_group_bytes: int = DEFAULT_ROW_GROUP_BYTES) -> int:
+    if num_rows == 0:
+        return 1
+    bytes_per_row = max(nbytes / num_rows, 1)
+    return max(int(row_group_bytes / bytes_per_row), 1)
+
+
+def get_write_options(schema: pa.Schema, sort_by: list, compression: str = "zstd") -> dict:
+    """
+    Parquet writer options shared by the rewrite and the compaction.
+
+    pyarrow 17 cannot write bloom filters. Instead, the page index (per-page min/max) is written
+    and the data is sorted by `sort_by`, which ends with adastra_uuid, so a lookup on
+    adastra_uuid reads only the pages that can hold it.
+    """
+    return {
+        "compression": compression,
+        "write_statistics": True,
+        "write_page_index": True,
+        "sorting_columns": pq.SortingColumn.from_ordering(schema, [(key, "ascending") for key in sort_by]),
+    }
+
+
+def sort_table(table: pa.Table, sort_by: list) -> pa.Table:
+    sort_by = [key for key in sort_by if key in table.column_names]
+    if not sort_by:
+        return table
+    return table.sort_by([(key, "ascending") for key in sort_by])
+
+
+def get_uncompressed_size(dataset: ds.Dataset) -> int:
+    """
+    Return the uncompressed size of the row groups of a Parquet dataset, read from the file footers.
+    """
+    return sum(
+        fragment.metadata.row_group(i).total_byte_size
+        for fragment in dataset.get_fragments()
+        for i in range(fragment.metadata.num_row_groups)
+    )
+
+
+def iter_sorted_batches(dataset: ds.Dataset, sort_by: list, tmp_dir: str):
+    """
+    Yield the rows of `dataset` sorted by `sort_by`, with at most the rows of one value of its
+    first key in memory.
+
+    The rows are first streamed to `tmp_dir`, split by the first key, then each split is read,
+    sorted and yielded in the order of the key (nulls last, as Table.sort_by).
+    """
+    if not sort_by:
+        yield from dataset.to_batches()
+        return
+
+    first_key = dataset.schema.field(sort_by[0])
+    partitioning = ds.partitioning(pa.schema([first_key]), flavor="hive")
+    ds.write_dataset(dataset, tmp_dir, format="parquet", partitioning=partitioning)
+    splits = ds.dataset(tmp_dir, format="parquet", partitioning=partitioning)
+
+    values = pa.array(
+        [ds.get_partition_keys(split.partition_expression).get(first_key.name) for split in splits.get_fragments()],
+        type=first_key.type,
+    ).unique()
+    for value in values.take(pc.sort_indices(values, null_placement="at_end")):
+        key = ds.field(first_key.name)
+        table = splits.to_table(filter=key.is_null() if not value.is_valid else key == value)
+        # Back to the columns and types of the source, the key was read from the directory names
+        yield from sort_table(table.select(dataset.schema.names).cast(dataset.schema), sort_by).to_batches()
+
+
+def rewrite_dataset(
+    source: str,
+    destination: str,
+    sort_by: list,
+    row_group_bytes: int = DEFAULT_ROW_GROUP_BYTES,
+    partition_by: list = None,
+    compression: str = "zstd",
+) -> dict:
+    """
+    Rewrite a Parquet file sorted and clustered by `sort_by`, with row groups of about `row_group_bytes`.
+
+    With `partition_by`, the output is a Hive-partitioned directory (`key=value/part-0.parquet`)
+    instead of a single file. The source is streamed (see iter_sorted_batches): only the rows
+    of one value of the first sort key, e.g. one country, are held in memory.
+    """
+    source_fs, source_path = resolve_path(source)
+    destination_fs, destination_path = resolve_path(destination)
+
+    dataset = ds.dataset(source_path, filesystem=source_fs, format="parquet")
+    schema = dataset.schema
+    sort_by = [key for key in sort_by if key in schema.names]
+    num_rows = dataset.count_rows()
+    rows_per_group = get_rows_per_group(get_uncompressed_size(dataset), num_rows, row_group_bytes)
+    options = get_write_options(schema, sort_by, compression)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        batches = iter_sorted_batches(dataset, sort_by, tmp_dir)
+        if partition_by:
+            file_options = ds.ParquetFileFormat().make_write_options(
+                compression=options["compression"],
+                write_statistics=options["write_statistics"],
+                write_page_index=options["write_page_index"],
+            )
+            ds.write_dataset(
+                batches,
+                destination_path,
+                schema=schema,
+                filesystem=destination_fs,
+                format="parquet",
+                file_options=file_options,
+                partitioning=partition_by,
+                partitioning_flavor="hive",
+                basename_template="part-{i}.parquet",
+                min_rows_per_group=min(rows_per_group, num_rows) or 1,
+                max_rows_per_group=rows_per_group,
+                existing_data_behavior="delete_matching",
+            )
+        else:
+            destination_fs.create_dir(posixpath.dirname(destination_path), recursive=True)
+            with pq.ParquetWriter(destination_path, schema, filesystem=destination_fs, **options) as writer:
+                # Batches are gathered into full row groups, a write call never shares its row groups
+                pending, pending_rows = [], 0
+                for batch in batches:
+                    pending.append(batch)
+                    pending_rows += batch.num_rows
+                    if pending_rows >= rows_per_group:
+                        table = pa.Table.from_batches(pending, schema=schema)
+                        full_rows = pending_rows - pending_rows % rows_per_group
+                        writer.write_table(table.slice(0, full_rows), row_group_size=rows_per_group)
+                        pending = table.slice(full_rows).to_batches()
+                        pending_rows -= full_rows
+                writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=rows_per_group)
+
+    summary = {
+        "rows": num_rows,
+        "rows_per_group": rows_per_group,
+        "row_groups": -(-num_rows // rows_per_group),
+    }
+    logger.info("Rewrote %s to %s: %s", source, destination, summary)
+    return summary
+
+
+def list_country_directories(filesystem, path: str) -> dict:
+    """
+    Group the Parquet files of the `model=/indicator=/adm0=/adm1=/type=` tree under `path` by
+    country and type, as {(country directory, "type=..."): {adm1: [files]}}. The country-level
+    files and the aggregates next to the tree are left out.
+    """
+    selector = pafs.FileSelector(path, recursive=True)
+    countries = defaultdict(lambda: defaultdict(list))
+    for info in filesystem.get_file_info(selector):
+        if info.type != pafs.FileType.File or not info.path.endswith(".parquet"):
+            continue
+        match = PARTITION_DIRECTORY.search(posixpath.dirname(info.path))
+        if match:
+            directory = posixpath.dirname(info.path)[: match.start("country")] + match.group("country")
+            countries[directory, match.group("type")][match.group("adm1")].append(info.path)
+    return countries
+
+
+def compact_partitions(
+    source: str,
+    destination: str,
+    sort_by: list = ("adastra_uuid",),
+    max_rows_per_file: int = 10_000_000,
+    row_group_bytes: int = DEFAULT_ROW_GROUP_BYTES,
+    compression: str = "zstd",
+) -> dict:
+    """
+    Merge the per-adm1 files of each country of the `model=/indicator=/adm0=/adm1=/type=` tree.
+    `source` is the data folder or a directory of the tree; files outside of the tree are not copied.
+
+    Each country and type ends up in `model=/indicator=/adm0=/type=/part-{i}.parquet` files of at
+    most `max_rows_per_file` rows, with adm1 as a column, sorted by adm1 then `sort_by`. The readers
+    (see get_local_data.open_data) filter adm1 and type the same way in both layouts. The files are
+    written one adm1 at a time, in row groups that never span two adm1, so a filter on adm1 reads
+    only its row groups.
+    """
+    source_fs, source_path = resolve_path(source)
+    destination_fs, destination_path = resolve_path(destination)
+
+    summary = {"directories": 0, "files_in": 0, "files_out": 0, "rows": 0}
+    for (directory, type_directory), adm1_files in sorted(list_country_directories(source_fs, source_path).items()):
+        output_directory = posixpath.join(destination_path, posixpath.relpath(directory, source_path), type_directory)
+        destination_fs.create_dir(output_directory, recursive=True)
+
+        writer, n_files, rows_in_file = None, 0, 0
+        for adm1, files in sorted(adm1_files.items()):
+            table = pa.concat_tables(
+                [pq.read_table(f, filesystem=source_fs, partitioning=None) for f in sorted(files)],
+                promote_options="default",
+            )
+            table = sort_table(table, list(sort_by))
+            table = table.append_column("adm1", pa.repeat(pa.scalar(adm1, type=pa.string()), table.num_rows))
+            rows_per_group = get_rows_per_group(table.nbytes, table.num_rows, row_group_bytes)
+
+            offset = 0
+            while offset < table.num_rows:
+                if writer is None or rows_in_file >= max_rows_per_file:
+                    if writer is not None:
+                        writer.close()
+                    sort_keys = ["adm1", *[key for key in sort_by if key in table.column_names]]
+                    writer = pq.ParquetWriter(
+                        posixpath.join(output_directory, f"part-{n_files}.parquet"),
+                        table.schema,
+                        filesystem=destination_fs,
+                        **get_write_options(table.schema, sort_keys, compression),
+                    )
+                    n_files += 1
+                    rows_in_file = 0
+                chunk = table.slice(offset, max_rows_per_file - rows_in_file)
+                writer.write_table(chunk.cast(writer.schema), row_group_size=rows_per_group)
+                offset += chunk.num_rows
+                rows_in_file += chunk.num_rows
+
+            summary["files_in"] += len(files)
+            summary["rows"] += table.num_rows
+        if writer is not None:
+            writer.close()
+        summary["directories"] += 1
+        summary["files_out"] += n_files
+
+    logger.info("Compacted %s to %s: %s", source, destination, summary)
+    return summary
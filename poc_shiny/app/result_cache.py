@@ -0,0 +1,165 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import shapely
+
+# Bytes of an STRtree per indexed geometry: the envelope and item of its leaf and its share of the nodes.
+# The geometries themselves are referenced, not copied.
+STRTREE_ITEM_BYTES = 64
+
+
+def estimate_geometry_size(series) -> int:
+    """
+    Approximate the coordinates held by a geometry column or array, which only reports its pointers.
+    """
+    return int(shapely.get_num_coordinates(np.asarray(getattr(series, "array", series))).sum()) * 16
+
+
+def estimate_array_size(array: np.ndarray) -> int:
+    """
+    Approximate the memory held by a numpy array, counting the objects of an object array:
+    the coordinates of its geometries and the bytes of its other values (strings).
+    """
+    if array.dtype != object:
+        return array.nbytes
+    is_geometry = shapely.is_geometry(array)
+    objects = sum(sys.getsizeof(value) for value in array[~is_geometry])
+    return array.nbytes + estimate_geometry_size(array[is_geometry]) + objects
+
+
+def estimate_size(value) -> int:
+    """
+    Approximate the memory held by a cached value, in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        size = int(value.memory_usage(index=True, deep=True).sum())
+        for column in value.columns[value.dtypes.astype(str) == "geometry"]:
+            size += estimate_geometry_size(value[column])
+        return size
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, pa.Table | pa.RecordBatch | pa.Array | pa.ChunkedArray):
+        return value.nbytes
+    if isinstance(value, np.ndarray):
+        return estimate_array_size(value)
+    if isinstance(value, shapely.STRtree):
+        return len(value) * STRTREE_ITEM_BYTES
+    if isinstance(value, tuple | list):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by memory, with a time-to-live and single-flight loading.
+
+    Concurrent calls to `get_or_compute` with the same key share one computation:
+    the first caller runs it, the others wait for its result.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._in_flight = {}
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "shared": 0, "evictions": 0, "expired": 0, "errors": 0}
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, _, expires_at = entry
+            if expires_at < time.monotonic():
+                self._drop(key)
+                self._stats["expired"] += 1
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            # A value larger than the whole cache is returned but never stored
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, _, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                self._drop(key)
+                self._stats["expired"] += 1
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self._stats["misses"] += 1
+            else:
+                self._stats["shared"] += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                self._stats["errors"] += 1
+            future.set_exception(e)
+            raise
+
+        self.put(key, value)
+        with self._lock:
+            self._in_flight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._size = 0
+            elif key in self._entries:
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["size_bytes"] = self._size
+            stats["max_bytes"] = self.max_bytes
+            lookups = stats["hits"] + stats["misses"] + stats["shared"]
+            stats["hit_ratio"] = (stats["hits"] + stats["shared"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,98 @@
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+from poc_shiny.app.result_cache import estimate_geometry_size
+
+# Column types of the indicator frames, applied when the rows are read (see apply_schema).
+# Strings repeated across rows are categorical, codes and per-mille shares are small
+# unsigned integers. Areas stay float64: in hectares, float32 keeps ~7 digits and
+# loses units of the larger countries. Columns missing from a frame are skipped.
+INDICATOR_SCHEMA = {
+    "adastra_uuid": pl.Categorical("lexical"),
+    "label_admin_name": pl.Categorical("lexical"),
+    "adm0": pl.Categorical("lexical"),
+    "adm1": pl.Categorical("lexical"),
+    "adm1_name": pl.Categorical("lexical"),
+    "country": pl.Categorical("lexical"),
+    "indicator_value": pl.UInt8,
+    "area_‰": pl.UInt16,
+    "ratio_per_1000": pl.UInt16,
+    "area_54009_unit": pl.Float64,
+    "area_54009_indicator_unit": pl.Float64,
+    "area_ha": pl.Float64,
+}
+
+# Indicator code given to the values that are not a code (-9999, -, -1, ...). It is outside
+# of the AWARE (0-101) and Aqueduct (0-5, 99) code lists, so it is named "No Data".
+NO_DATA_CODE = 255
+
+PANDAS_DTYPES = {pl.UInt8: "uint8", pl.UInt16: "uint16", pl.Float32: "float32", pl.Float64: "float64"}
+
+
+def indicator_codes(expr: pl.Expr, no_data_code: int = NO_DATA_CODE) -> pl.Expr:
+    """
+    Parse indicator values (integers or strings) to uint8 codes, `no_data_code` for anything else.
+    """
+    code = expr.cast(pl.Int64, strict=False)
+    return pl.when(code.is_between(0, 254)).then(code).otherwise(no_data_code).cast(pl.UInt8)
+
+
+def get_pandas_dtype(dtype) -> str:
+    return "category" if isinstance(dtype, pl.Categorical) else PANDAS_DTYPES[dtype]
+
+
+def apply_schema(frame, schema: dict = INDICATOR_SCHEMA, no_data_code: int = NO_DATA_CODE):
+    """
+    Cast the columns of a Polars (lazy) frame or a pandas frame to `schema`.
+
+    indicator_value is parsed with indicator_codes, the other columns are cast as they are.
+    """
+    columns = [column for column in frame.columns if column in schema]
+
+    if isinstance(frame, pd.DataFrame):
+        frame = frame.copy(deep=False)
+        for column in columns:
+            if column == "indicator_value":
+                code = pd.to_numeric(frame[column], errors="coerce")
+                frame[column] = code.where(code.between(0, 254), no_data_code).astype("uint8")
+            else:
+                frame[column] = frame[column].astype(get_pandas_dtype(schema[column]))
+        return frame
+
+    return frame.with_columns(
+        [
+            indicator_codes(pl.col(column), no_data_code).alias(column)
+            if column == "indicator_value"
+            else pl.col(column).cast(schema[column])
+            for column in columns
+        ]
+    )
+
+
+def get_column_sizes(frame) -> dict:
+    """
+    Return the {column: bytes} held by a pandas, Polars or Arrow frame.
+    """
+    if isinstance(frame, pd.DataFrame):
+        sizes = frame.memory_usage(index=False, deep=True).astype(int).to_dict()
+        for column in frame.columns[frame.dtypes.astype(str) == "geometry"]:
+            sizes[column] += estimate_geometry_size(frame[column])
+        return sizes
+    if isinstance(frame, pl.DataFrame):
+        return {column: int(frame[column].estimated_size()) for column in frame.columns}
+    if isinstance(frame, pa.Table):
+        return {column: frame.column(column).nbytes for column in frame.column_names}
+    raise TypeError(f"Cannot measure a {type(frame).__name__}.")
+
+
+def memory_report(frames: dict) -> dict:
+    """
+    Report the rows and the bytes, per column and in total, of each named frame.
+    """
+    report = {}
+    for name, frame in frames.items():
+        columns = get_column_sizes(frame)
+        report[name] = {"rows": len(frame), "bytes": sum(columns.values()), "columns": columns}
+    report["total_bytes"] = sum(entry["bytes"] for entry in report.values())
+    return report
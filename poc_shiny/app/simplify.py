@@ -0,0 +1,133 @@
+import logging
+import posixpath
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import shapely
+
+from poc_shiny.app.geometry import decode_wkb
+from poc_shiny.app.repartition import get_rows_per_group, get_write_options, resolve_path
+
+logger = logging.getLogger(__name__)
+
+
+# Level of detail -> simplification tolerance, in degrees (about 50 m, 500 m and 2 km at the equator).
+# Level 0 is the full-resolution geometry of {type}.parquet itself.
+LOD_TOLERANCES = {1: 0.0005, 2: 0.005, 3: 0.02}
+
+SIMPLIFIED_SORT_KEYS = ["lod", "country", "adastra_uuid"]
+
+
+def get_simplified_path(data_type: str) -> str:
+    """
+    Return the file holding the simplified geometry levels of `{data_type}.parquet`, stored next to it.
+    """
+    return f"{data_type}_simplified.parquet"
+
+
+def get_wkb_bytes(column) -> int:
+    return int(pc.sum(pc.binary_length(column)).as_py() or 0)
+
+
+def simplify_coverage(geometries: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Simplify adjacent polygons without opening gaps between them.
+
+    With GEOS 3.12+ (shapely 2.1+) the polygons are simplified as one coverage, so the edges
+    shared by two units are simplified once and stay shared. Older versions fall back to a
+    per-polygon topology-preserving simplification, which keeps each polygon valid but may
+    leave slivers along shared edges.
+    """
+    coverage_simplify = getattr(shapely, "coverage_simplify", None)
+    if coverage_simplify is not None:
+        valid = ~shapely.is_missing(geometries)
+        simplified = geometries.copy()
+        if valid.any():
+            simplified[valid] = coverage_simplify(geometries[valid], tolerance)
+        return simplified
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def build_simplified_levels(
+    source: str,
+    destination: str,
+    levels: dict = LOD_TOLERANCES,
+    geometry_column: str = "geom",
+    group_by: str = "country",
+    compression: str = "zstd",
+) -> dict:
+    """
+    Write the simplified geometry levels of the units of `source` into `destination`.
+
+    Each unit gets one row per level, with columns adastra_uuid, `group_by`, lod and `geometry_column`
+    (WKB). Polygons are simplified one `group_by` value at a time, so neighbouring units of a country
+    form one coverage. Rows are sorted by lod / country / adastra_uuid, so a read filtered on lod and
+    country only touches the matching row groups.
+    """
+    source_fs, source_path = resolve_path(source)
+    destination_fs, destination_path = resolve_path(destination)
+
+    table = ds.dataset(source_path, filesystem=source_fs, format="parquet").to_table(
+        columns=["adastra_uuid", group_by, geometry_column]
+    )
+    geometries = decode_wkb(table.column(geometry_column))
+    groups = table.column(group_by).to_numpy(zero_copy_only=False)
+
+    summary = {"units": table.num_rows, "bytes": {0: get_wkb_bytes(table.column(geometry_column))}}
+    parts = []
+    for lod, tolerance in sorted(levels.items()):
+        simplified = np.empty_like(geometries)
+        for group in np.unique(groups):
+            mask = groups == group
+            simplified[mask] = simplify_coverage(geometries[mask], tolerance)
+        wkb = pa.array(shapely.to_wkb(simplified), type=pa.binary())
+        parts.append(
+            pa.table(
+                {
+                    "adastra_uuid": table.column("adastra_uuid"),
+                    group_by: table.column(group_by),
+                    "lod": pa.array(np.full(table.num_rows, lod, dtype=np.uint8)),
+                    geometry_column: wkb,
+                }
+            )
+        )
+        summary["bytes"][lod] = get_wkb_bytes(wkb)
+        logger.info("Simplified level %s (tolerance %s): %s bytes of WKB", lod, tolerance, summary["bytes"][lod])
+
+    output = pa.concat_tables(parts)
+    sort_by = [key for key in SIMPLIFIED_SORT_KEYS if key in output.column_names]
+    output = output.sort_by([(key, "ascending") for key in sort_by])
+    destination_fs.create_dir(posixpath.dirname(destination_path), recursive=True)
+    pq.write_table(
+        output,
+        destination_path,
+        filesystem=destination_fs,
+        row_group_size=get_rows_per_group(output),
+        **get_write_options(output, sort_by, compression),
+    )
+    logger.info("Wrote %s levels of %s units to %s", len(levels), table.num_rows, destination)
+    return summary
+
+
+def read_simplified_geometry(
+    backend, data_type: str, lod: int, adastra_uuid, country: str = None, geometry_column: str = "geom"
+) -> pa.ChunkedArray:
+    """
+    Read the level `lod` WKB geometry of the units `adastra_uuid`, aligned with it.
+
+    With `country`, the read is pruned on (lod, country); otherwise on (lod, adastra_uuid).
+    Units missing from the simplified file get a null geometry.
+    """
+    filter = {"lod": lod}
+    if country is not None:
+        filter["country"] = country
+    else:
+        filter["adastra_uuid"] = pc.unique(adastra_uuid).to_pylist()
+    table = backend.read_table(
+        get_simplified_path(data_type), filter=filter, columns=["adastra_uuid", geometry_column]
+    )
+    index = pc.index_in(adastra_uuid, value_set=table.column("adastra_uuid"))
+    return table.column(geometry_column).take(index)
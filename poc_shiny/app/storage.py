@@ -0,0 +1,223 @@
+import abc
+import io
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+from fsspec.implementations.memory import MemoryFileSystem
+from pyarrow import fs as pafs
+
+from poc_shiny.app.gcs_client import get_gcsfs, get_storage_client
+from poc_shiny.app.gcs_get_json import get_json_from_bucket
+from poc_shiny.app.gcs_get_parquet import get_table_from_bucket, read_parquet_table
+
+load_dotenv()
+
+
+class StorageBackend(abc.ABC):
+    """
+    Read access to the data folder (Hive-partitioned `model=/indicator=/adm0=/adm1=/type=` tree and
+    the country-level files), whatever the storage behind it.
+
+    All paths are relative to the root of the data folder and use "/" as separator.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def list_files(self, prefix: str) -> list:
+        """
+        Return the relative paths of the Parquet files under `prefix`, sorted.
+        """
+
+    @abc.abstractmethod
+    def read_table(self, path: str, filter: dict = None, columns: list = None) -> pa.Table:
+        """
+        Read one Parquet file (or directory of Parquet files) as an Arrow table.
+
+        See build_filter_expression for the filter format.
+        """
+
+    @abc.abstractmethod
+    def read_json(self, path: str):
+        """
+        Read one JSON file.
+        """
+
+    @abc.abstractmethod
+    def get_filesystem(self):
+        """
+        Return the filesystem (pyarrow or fsspec) that `full_path` refers to.
+        """
+
+    @abc.abstractmethod
+    def full_path(self, path: str = "") -> str:
+        """
+        Return the path of `path` on `get_filesystem()`.
+        """
+
+    def open_dataset(self, path: str, partitioning=None) -> ds.Dataset:
+        """
+        Open every Parquet file under `path` as one dataset.
+
+        Partition keys are parsed from the path relative to the root of the data folder,
+        so `model=` and the other keys above `path` are still available as columns.
+        """
+        return ds.dataset(
+            self.full_path(path),
+            filesystem=self.get_filesystem(),
+            format="parquet",
+            partitioning=partitioning,
+            partition_base_dir=self.full_path(),
+        )
+
+
+class GCSBackend(StorageBackend):
+    name = "gcs"
+
+    def __init__(self, bucket_name: str, folder: str = ""):
+        self.bucket_name = bucket_name
+        self.folder = folder.strip("/")
+
+    def _blob_name(self, path: str) -> str:
+        return f"{self.folder}/{path}" if self.folder else path
+
+    def list_files(self, prefix: str) -> list:
+        bucket = get_storage_client().bucket(self.bucket_name)
+        root = f"{self.folder}/" if self.folder else ""
+        blobs = bucket.list_blobs(prefix=self._blob_name(prefix))
+        return sorted(blob.name[len(root):] for blob in blobs if blob.name.endswith(".parquet"))
+
+    def read_table(self, path: str, filter: dict = None, columns: list = None) -> pa.Table:
+        return get_table_from_bucket(
+            bucket_name=self.bucket_name, bucket_suffix=self._blob_name(path), filter=filter, columns=columns
+        )
+
+    def read_json(self, path: str):
+        return get_json_from_bucket(self.bucket_name, self._blob_name(path))
+
+    def get_filesystem(self):
+        return get_gcsfs()
+
+    def full_path(self, path: str = "") -> str:
+        return f"{self.bucket_name}/{self._blob_name(path)}".rstrip("/")
+
+
+class LocalBackend(StorageBackend):
+    name = "local"
+
+    def __init__(self, root_dir: str):
+        self.root_dir = Path(root_dir).resolve()
+        # Local files are memory mapped instead of copied into Arrow buffers
+        self.filesystem = pafs.LocalFileSystem(use_mmap=True)
+
+    def list_files(self, prefix: str) -> list:
+        base = self.root_dir / prefix
+        if not base.exists():
+            return []
+        return sorted(f.relative_to(self.root_dir).as_posix() for f in base.rglob("*.parquet"))
+
+    def read_table(self, path: str, filter: dict = None, columns: list = None) -> pa.Table:
+        return read_parquet_table(str(self.root_dir / path), self.filesystem, filter, columns)
+
+    def read_json(self, path: str):
+        with open(self.root_dir / path, encoding="utf-8-sig") as f:
+            return json.load(f)
+
+    def get_filesystem(self):
+        return self.filesystem
+
+    def full_path(self, path: str = "") -> str:
+        return (self.root_dir / path).as_posix()
+
+
+class MemoryBackend(StorageBackend):
+    """
+    In-memory storage, filled with `write_table` / `write_json`. Used for benchmarks and tests.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self.fs = MemoryFileSystem()
+        # MemoryFileSystem shares one store per process, isolate each backend under its own root
+        self.root = f"/{uuid.uuid4().hex}"
+        self.filesystem = pafs.PyFileSystem(pafs.FSSpecHandler(self.fs))
+
+    def write_table(self, path: str, table: pa.Table, **kwargs):
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer, **kwargs)
+        self.fs.pipe_file(f"{self.root}/{path}", buffer.getvalue())
+
+    def write_json(self, path: str, data):
+        self.fs.pipe_file(f"{self.root}/{path}", json.dumps(data).encode("utf-8"))
+
+    def list_files(self, prefix: str) -> list:
+        base = f"{self.root}/{prefix}".rstrip("/")
+        if not self.fs.exists(base):
+            return []
+        files = self.fs.find(base)
+        return sorted(f[len(self.root) + 1:] for f in files if f.endswith(".parquet"))
+
+    def read_table(self, path: str, filter: dict = None, columns: list = None) -> pa.Table:
+        return read_parquet_table(f"{self.root}/{path}", self.filesystem, filter, columns)
+
+    def read_json(self, path: str):
+        return json.loads(self.fs.cat_file(f"{self.root}/{path}"))
+
+    def get_filesystem(self):
+        return self.filesystem
+
+    def full_path(self, path: str = "") -> str:
+        return f"{self.root}/{path}".rstrip("/")
+
+
+def create_backend(name: str = None) -> StorageBackend:
+    """
+    Build the backend selected by `name`, or by the STORAGE_BACKEND environment variable (default: gcs).
+
+    gcs uses GCS_BUCKET_NAME and GCS_BUCKET_FOLDER, local uses LOCAL_DATA_DIR.
+    """
+    name = name or os.getenv("STORAGE_BACKEND", "gcs")
+    if name == "gcs":
+        return GCSBackend(os.getenv("GCS_BUCKET_NAME"), os.getenv("GCS_BUCKET_FOLDER", ""))
+    if name == "local":
+        root_dir = os.getenv("LOCAL_DATA_DIR")
+        if not root_dir:
+            raise ValueError("LOCAL_DATA_DIR must be set to use the local storage backend.")
+        return LocalBackend(root_dir)
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend '{name}', expected 'gcs', 'local' or 'memory'.")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    """
+    Return the process-wide backend chosen by configuration.
+    """
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def set_backend(backend: StorageBackend):
+    """
+    Replace the process-wide backend (e.g. with a MemoryBackend for an offline benchmark).
+    """
+    global _backend
+
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from poc_shiny.app.get_local_data import get_table_column_order
+
+load_dotenv()
+
+# Rows of the table sent to the browser at a time
+TABLE_PAGE_ROWS = int(os.getenv("TABLE_PAGE_ROWS", 100))
+
+# Columns matched by the search of the table
+SEARCH_COLUMNS = ["Country", "Administrative unit 1 name", "Municipality name"]
+
+
+def get_share_columns(model: str) -> list:
+    """
+    Return the per-mille share columns of the table of a model, one per category.
+    """
+    return get_table_column_order(model)[4:]
+
+
+def format_table(df: pd.DataFrame, model: str) -> pd.DataFrame:
+    """
+    Format the per-mille shares of a table (or of a page of it) as percents with one decimal ("36.8%").
+    """
+    df = df.copy()
+    for column in get_share_columns(model):
+        df[column] = (df[column].astype("float64") / 10).map("{:.1f}%".format)
+    return df
+
+
+def contains(series: pd.Series, text: str) -> pd.Series:
+    """
+    Case-insensitive substring match, done on the categories only for a categorical column.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = series.cat.categories
+        return series.isin(categories[categories.astype(str).str.contains(text, case=False, regex=False)])
+    return series.astype(str).str.contains(text, case=False, regex=False)
+
+
+def filter_table(df: pd.DataFrame, search: str) -> pd.DataFrame:
+    """
+    Keep the rows whose country, administrative unit 1 or municipality name contains `search`.
+    """
+    search = (search or "").strip()
+    if not search:
+        return df
+    mask = pd.Series(False, index=df.index)
+    for column in SEARCH_COLUMNS:
+        mask |= contains(df[column], search)
+    return df[mask]
+
+
+def sort_table(df: pd.DataFrame, column: str = None, descending: bool = False) -> pd.DataFrame:
+    """
+    Sort the table on one column, the rows of equal values keeping the order of the table.
+
+    Names are sorted as text and shares as numbers.
+    """
+    if not column:
+        return df
+    return df.sort_values(
+        column,
+        ascending=not descending,
+        kind="stable",
+        key=lambda s: s.astype(str) if isinstance(s.dtype, pd.CategoricalDtype) else s,
+    )
+
+
+def get_page(df: pd.DataFrame, page: int, page_rows: int = TABLE_PAGE_ROWS) -> tuple:
+    """
+    Return the rows of a 1-based page, and the page actually shown (clamped to the pages of the table).
+    """
+    last_page = max((len(df) - 1) // page_rows + 1, 1)
+    page = min(max(int(page or 1), 1), last_page)
+    return df.iloc[(page - 1) * page_rows : page * page_rows], page
@@ -0,0 +1,188 @@
+import gzip
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Memory mapped part of the archive; larger than the archive so reads never go through read()
+MMAP_SIZE = 1024**3
+
+MBTILES_SCHEMA = """
+CREATE TABLE metadata (name TEXT, value TEXT);
+CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+CREATE UNIQUE INDEX name ON metadata (name);
+"""
+
+
+def flip_y(z: int, y: int) -> int:
+    """
+    Convert between XYZ and TMS rows (MBTiles stores TMS rows).
+    """
+    return (1 << z) - 1 - y
+
+
+def list_directory_tiles(tiles_dir) -> list:
+    """
+    Return the sorted (z, x, y) of the `{z}/{x}/{y}.mvt` files under `tiles_dir`.
+    """
+    tiles_dir = Path(tiles_dir)
+    tiles = []
+    for path in tiles_dir.glob("*/*/*.mvt"):
+        z, x = path.parent.parent.name, path.parent.name
+        if z.isdigit() and x.isdigit() and path.stem.isdigit():
+            tiles.append((int(z), int(x), int(path.stem)))
+    return sorted(tiles)
+
+
+def read_directory_tile(tiles_dir: Path, z: int, x: int, y: int) -> bytes:
+    return (tiles_dir / str(z) / str(x) / f"{y}.mvt").read_bytes()
+
+
+def compress_tile(data: bytes) -> bytes:
+    """
+    Gzip the bytes of a tile, unless they are already gzip-compressed.
+    """
+    if data[:2] == GZIP_MAGIC:
+        return data
+    # No timestamp in the header, so packing the same pyramid gives the same archive
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress_tile(data):
+    """
+    Return the raw bytes of a tile, gzip-compressed or not.
+    """
+    return gzip.decompress(data) if data and data[:2] == GZIP_MAGIC else data
+
+
+def pack_mbtiles(tiles_dir, output) -> dict:
+    """
+    Pack the `{z}/{x}/{y}.mvt` pyramid and `metadata.json` of `tiles_dir` into one MBTiles archive.
+
+    Tiles are stored gzip-compressed, as MBTiles stores vector tiles, and are served with
+    `Content-Encoding: gzip`; the loose files are raw and compressed on the fly instead.
+    """
+    tiles_dir = Path(tiles_dir)
+    output = Path(output)
+    tmp_output = output.with_name(f"{output.name}.tmp")
+    tmp_output.unlink(missing_ok=True)
+
+    with open(tiles_dir / "metadata.json", encoding="utf-8") as f:
+        metadata = json.load(f)
+    tiles = list_directory_tiles(tiles_dir)
+
+    connection = sqlite3.connect(tmp_output)
+    try:
+        connection.executescript(MBTILES_SCHEMA)
+        connection.executemany(
+            "INSERT INTO metadata (name, value) VALUES (?, ?)",
+            [(name, value if isinstance(value, str) else json.dumps(value)) for name, value in metadata.items()],
+        )
+        # Rows are inserted in (z, x, y) order so neighbouring tiles sit next to each other in the file
+        connection.executemany(
+            "INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+            (
+                (z, x, flip_y(z, y), sqlite3.Binary(compress_tile(read_directory_tile(tiles_dir, z, x, y))))
+                for z, x, y in tiles
+            ),
+        )
+        connection.commit()
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    tmp_output.replace(output)
+
+    summary = {"tiles": len(tiles), "bytes": output.stat().st_size}
+    logger.info("Packed %s into %s: %s", tiles_dir, output, summary)
+    return summary
+
+
+class MBTilesTileSource:
+    """
+    Tiles read from a single MBTiles archive.
+
+    The (z, x, y) -> rowid directory is loaded once, so serving a tile is one rowid lookup
+    on a memory mapped file, and a missing tile costs no query at all.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        stat = self.path.stat()
+        self._archive_tag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+        # Read-only and immutable: no locking nor change detection on each query
+        self._connection = sqlite3.connect(
+            f"{self.path.resolve().as_uri()}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+        self._connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self._lock = threading.Lock()
+        self._index = {
+            (z, x, flip_y(z, row)): rowid
+            for rowid, z, x, row in self._connection.execute(
+                "SELECT rowid, zoom_level, tile_column, tile_row FROM tiles"
+            )
+        }
+        self._metadata = {}
+        for name, value in self._connection.execute("SELECT name, value FROM metadata"):
+            try:
+                self._metadata[name] = json.loads(value) if name in ("minzoom", "maxzoom", "version") else value
+            except ValueError:
+                self._metadata[name] = value
+
+    def __len__(self):
+        return len(self._index)
+
+    def get_metadata(self) -> dict:
+        return dict(self._metadata)
+
+    def get_tile(self, z: int, x: int, y: int):
+        """
+        Return the gzip-compressed tile bytes and an ETag, or (None, None) when the tile is missing.
+        """
+        rowid = self._index.get((z, x, y))
+        if rowid is None:
+            return None, None
+        with self._lock:
+            (data,) = self._connection.execute("SELECT tile_data FROM tiles WHERE rowid = ?", (rowid,)).fetchone()
+        return bytes(data), f'"{self._archive_tag}-{rowid:x}"'
+
+    def close(self):
+        self._connection.close()
+
+
+def benchmark_tile_sources(sources: dict, tiles: list, repeat: int = 3) -> dict:
+    """
+    Read every tile of `tiles` from each source of `sources` (name -> tile source) `repeat` times.
+
+    The decompressed payloads are checked to be identical across sources; returns the best time per source.
+    """
+    reference = None
+    results = {}
+    for name, source in sources.items():
+        payloads = [decompress_tile(source.get_tile(*tile)[0]) for tile in tiles]
+        if reference is None:
+            reference = payloads
+        elif payloads != reference:
+            mismatches = sum(a != b for a, b in zip(payloads, reference))
+            raise ValueError(f"Tile source '{name}' differs from the reference on {mismatches} tiles.")
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for tile in tiles:
+                source.get_tile(*tile)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results[name] = {
+            "tiles": len(tiles),
+            "seconds": round(best, 4),
+            "tiles_per_second": round(len(tiles) / best) if best else None,
+        }
+    return results
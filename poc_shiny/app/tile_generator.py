@@ -0,0 +1,249 @@
+import gzip
+import logging
+import math
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import shapely
+from dotenv import load_dotenv
+
+from poc_shiny.app.geometry import decode_wkb
+from poc_shiny.app.get_local_data import get_indicator_dict, get_no_data_code
+from poc_shiny.app.load_all_data import aggregate_units, get_indicator_name
+from poc_shiny.app.mvt import EXTENT, encode_layer
+from poc_shiny.app.result_cache import ResultCache
+from poc_shiny.app.schema import apply_schema
+from poc_shiny.app.storage import StorageBackend, get_backend
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+EARTH_RADIUS = 6378137.0
+WORLD_SIZE = 2 * math.pi * EARTH_RADIUS
+MAX_LATITUDE = 85.0511287798
+
+MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", 14))
+# Geometry kept around each tile, in tile units, so polygon edges do not show at tile borders
+TILE_BUFFER = 64
+# Simplification tolerance, in screen pixels of a 256 px tile
+SIMPLIFY_PIXELS = 0.5
+
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", 256 * 1024**2))
+TILE_CACHE_TTL = float(os.getenv("TILE_CACHE_TTL", 24 * 3600))
+# Projected geometries of a country and unit values of an indicator, shared by their tiles
+TILE_SOURCES_MAX_BYTES = int(os.getenv("TILE_SOURCES_MAX_BYTES", 2 * 1024**3))
+
+
+def to_web_mercator(coords: np.ndarray) -> np.ndarray:
+    """
+    Project (lon, lat) coordinates to EPSG:3857 meters.
+    """
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+    return np.column_stack([EARTH_RADIUS * lon, EARTH_RADIUS * np.log(np.tan(np.pi / 4 + lat / 2))])
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Return the (minx, miny, maxx, maxy) of the XYZ tile in EPSG:3857 meters.
+    """
+    size = WORLD_SIZE / (1 << z)
+    minx = -WORLD_SIZE / 2 + x * size
+    maxy = WORLD_SIZE / 2 - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+class TileDiskCache:
+    """
+    Generated tiles stored as `{type}/{model}/{indicator}/{adm0}/{z}/{x}/{y}.mvt` files (gzip-compressed).
+
+    The directory must be cleared when the source data is updated.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir).resolve()
+
+    def _path(self, key: tuple) -> Path:
+        data_type, model, indicator, adm0, z, x, y = key
+        return self.cache_dir / data_type / model / indicator / adm0 / str(z) / str(x) / f"{y}.mvt"
+
+    def get(self, key: tuple):
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: tuple, data: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written under a temporary name then renamed, so readers never see a partial tile
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+
+class TileGenerator:
+    """
+    Build MVT tiles of one country on demand from `{type}.parquet` geometries joined with one
+    indicator of `df_{type}_indicators.parquet`.
+
+    The geometries of a country are read, projected and indexed once. Each tile then queries
+    the index, clips the polygons to the tile (plus a buffer), simplifies them to the resolution
+    of the zoom level and encodes them with the category and label of their unit. Tiles are
+    kept in a memory LRU and, optionally, on disk.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend = None,
+        cache_dir: str = None,
+        max_bytes: int = TILE_CACHE_MAX_BYTES,
+        ttl: float = TILE_CACHE_TTL,
+        max_zoom: int = MAX_ZOOM,
+    ):
+        self.backend = backend or get_backend()
+        self.max_zoom = max_zoom
+        self.disk_cache = TileDiskCache(cache_dir) if cache_dir else None
+        self.tiles = ResultCache(max_bytes, ttl, sizeof=len)
+        self.sources = ResultCache(TILE_SOURCES_MAX_BYTES, ttl)
+        self._lock = threading.Lock()
+        self._stats = {"generated": 0, "disk_hits": 0}
+
+    def get_geometries(self, data_type: str, country: str) -> tuple:
+        """
+        Return the unit ids, the projected geometries and their STRtree of one country of `data_type`.
+        """
+
+        def compute():
+            table = self.backend.read_table(
+                f"{data_type}.parquet", filter={"country": country}, columns=["adastra_uuid", "geom"]
+            )
+            geometries = shapely.transform(decode_wkb(table.column("geom")), to_web_mercator)
+            uuids = table.column("adastra_uuid").to_numpy(zero_copy_only=False)
+            return uuids, geometries, shapely.STRtree(geometries)
+
+        return self.sources.get_or_compute(("geometries", data_type, country), compute)
+
+    def get_unit_values(self, data_type: str, model: str, indicator: str, adm0: str) -> pd.DataFrame:
+        """
+        Return the category (the value with the largest share) and label of each unit of a country,
+        indexed by adastra_uuid.
+        """
+
+        def compute():
+            current_indicator = get_indicator_name(model, indicator, self.backend)
+            table = self.backend.read_table(
+                f"df_{data_type}_indicators.parquet",
+                filter={"indicator_name": current_indicator, "country": adm0},
+                columns=["adastra_uuid", "indicator_value", "ratio_per_1000"],
+            )
+            # Same labels as load_country_specific_data, the per-mille shares are the area shares of the unit
+            rows = apply_schema(pl.from_arrow(table).lazy(), no_data_code=get_no_data_code(model))
+            _, units = aggregate_units(rows, "ratio_per_1000")
+            # The category is the value with the largest share, the lowest value on a tie, so that
+            # "1 (0.9), 99 (0.1)" is not drawn as No Data
+            dominant = (
+                rows.group_by("adastra_uuid", "indicator_value")
+                .agg(pl.col("ratio_per_1000").cast(pl.Int64).sum())
+                .group_by("adastra_uuid")
+                .agg(
+                    pl.col("indicator_value")
+                    .sort_by(["ratio_per_1000", "indicator_value"], descending=[True, False])
+                    .first()
+                )
+            )
+            units = units.drop("indicator_value").join(dominant, on="adastra_uuid", how="left", coalesce=True)
+            units = units.collect().to_pandas().astype({"adastra_uuid": str}).set_index("adastra_uuid")
+            units["category"] = units["indicator_value"].map(get_indicator_dict(model))
+            return units
+
+        return self.sources.get_or_compute(("values", data_type, model, indicator, adm0), compute)
+
+    def render_tile(self, data_type: str, model: str, indicator: str, adm0: str, z: int, x: int, y: int) -> bytes:
+        """
+        Encode one tile of a country, gzip-compressed; empty bytes when no unit intersects it.
+        """
+        units = self.get_unit_values(data_type, model, indicator, adm0)
+
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        size = maxx - minx
+        buffer = size * TILE_BUFFER / EXTENT
+        box = shapely.box(minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+        uuids, geometries, tree = self.get_geometries(data_type, adm0)
+        candidates = tree.query(box)
+        # Only the units that have a value for this indicator are drawn
+        candidates = candidates[units.index.get_indexer(uuids[candidates]) >= 0]
+        if len(candidates) == 0:
+            return b""
+        uuids, geometries = uuids[candidates], geometries[candidates]
+
+        clipped = shapely.clip_by_rect(geometries, minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+        simplified = shapely.simplify(clipped, size / 256 * SIMPLIFY_PIXELS, preserve_topology=True)
+        # EPSG:3857 meters to tile units, y pointing down
+        scale = EXTENT / size
+        in_tile = shapely.transform(
+            simplified, lambda coords: np.column_stack([(coords[:, 0] - minx) * scale, (maxy - coords[:, 1]) * scale])
+        )
+
+        selected = units.loc[uuids]
+        properties = {
+            "adastra_uuid": uuids.tolist(),
+            "category": selected["category"].tolist(),
+            "indicator_value": selected["indicator_value"].astype(int).tolist(),
+            "label": selected["label"].tolist(),
+        }
+        data = encode_layer(data_type, in_tile, properties)
+        return gzip.compress(data, compresslevel=6) if data else b""
+
+    def get_tile(self, data_type: str, model: str, indicator: str, adm0: str, z: int, x: int, y: int) -> bytes:
+        """
+        Return the gzip-compressed tile from the memory cache, the disk cache or a fresh render.
+        """
+        if not 0 <= z <= self.max_zoom or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            raise ValueError(f"Tile {z}/{x}/{y} is outside of the zoom levels 0-{self.max_zoom}.")
+        key = (data_type, model, indicator, adm0, z, x, y)
+
+        def compute():
+            if self.disk_cache is not None:
+                data = self.disk_cache.get(key)
+                if data is not None:
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    return data
+            data = self.render_tile(*key)
+            with self._lock:
+                self._stats["generated"] += 1
+            if self.disk_cache is not None:
+                self.disk_cache.put(key, data)
+            return data
+
+        return self.tiles.get_or_compute(key, compute)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["memory"] = self.tiles.stats()
+        return stats
+
+
+_tile_generator = None
+_tile_generator_lock = threading.Lock()
+
+
+def get_tile_generator() -> TileGenerator:
+    """
+    Return the process-wide tile generator; tiles are also kept on disk when TILE_CACHE_DIR is set.
+    """
+    global _tile_generator
+
+    with _tile_generator_lock:
+        if _tile_generator is None:
+            _tile_generator = TileGenerator(cache_dir=os.getenv("TILE_CACHE_DIR") or None)
+        return _tile_generator
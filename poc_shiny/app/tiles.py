@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, Router
+
+from poc_shiny.app.tile_archive import GZIP_MAGIC, MBTilesTileSource
+from poc_shiny.app.tile_generator import get_tile_generator
+
+load_dotenv()
+
+
+# Folder of the z/x/y.mvt pyramid and its metadata.json (the tiles/ folder at the root of the repository by default)
+TILES_DIR = Path(os.getenv("TILES_DIR", Path(__file__).resolve().parents[2] / "tiles"))
+# Single-file MBTiles archive of the same pyramid (see `cli pack-tiles`), used instead of TILES_DIR when set
+TILES_ARCHIVE = os.getenv("TILES_ARCHIVE")
+TILE_CACHE_CONTROL = os.getenv("TILE_CACHE_CONTROL", "public, max-age=86400")
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+class DirectoryTileSource:
+    """
+    Tiles stored as loose `{z}/{x}/{y}.mvt` files next to a `metadata.json`.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = Path(root_dir)
+
+    def get_metadata(self) -> dict:
+        with open(self.root_dir / "metadata.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def get_tile(self, z: int, x: int, y: int):
+        """
+        Return the tile bytes (possibly gzip-compressed) and an ETag, or (None, None) when the tile is missing.
+        """
+        path = self.root_dir / str(z) / str(x) / f"{y}.mvt"
+        try:
+            stat = path.stat()
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None, None
+        return data, f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+_tile_source = None
+
+
+def get_tile_source():
+    global _tile_source
+    if _tile_source is None:
+        _tile_source = MBTilesTileSource(TILES_ARCHIVE) if TILES_ARCHIVE else DirectoryTileSource(TILES_DIR)
+    return _tile_source
+
+
+def get_tilejson(metadata: dict, tile_url: str) -> dict:
+    """
+    Convert an MBTiles-style metadata.json into a TileJSON document.
+    """
+    vector_layers = json.loads(metadata.get("json", "{}")).get("vector_layers", [])
+    return {
+        "tilejson": "3.0.0",
+        "name": metadata.get("name"),
+        "format": metadata.get("format", "pbf"),
+        "tiles": [tile_url],
+        "minzoom": int(metadata.get("minzoom", 0)),
+        "maxzoom": int(metadata.get("maxzoom", 14)),
+        "bounds": [float(v) for v in metadata["bounds"].split(",")] if "bounds" in metadata else None,
+        "center": [float(v) for v in metadata["center"].split(",")] if "center" in metadata else None,
+        "vector_layers": vector_layers,
+    }
+
+
+def get_initial_view_state() -> dict:
+    metadata = get_tile_source().get_metadata()
+    longitude, latitude, zoom = (float(v) for v in metadata.get("center", "0,0,0").split(","))
+    return {"longitude": longitude, "latitude": latitude, "zoom": max(zoom, 1)}
+
+
+def get_pyramid_max_zoom() -> int:
+    return int(get_tile_source().get_metadata().get("maxzoom", 14))
+
+
+def tile_endpoint(request: Request) -> Response:
+    z, x, y = (int(request.path_params[key]) for key in ("z", "x", "y"))
+    data, etag = get_tile_source().get_tile(z, x, y)
+    if data is None:
+        # Sparse pyramid: no tile means no feature
+        return Response(status_code=204, headers={"Cache-Control": TILE_CACHE_CONTROL})
+
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if data[:2] == GZIP_MAGIC:
+        # Pre-compressed tile, sent as is
+        headers["Content-Encoding"] = "gzip"
+    return Response(data, media_type=MVT_MEDIA_TYPE, headers=headers)
+
+
+def tilejson_endpoint(request: Request) -> Response:
+    tile_url = str(request.url.replace(query="")).rsplit("/", 1)[0] + "/{z}/{x}/{y}.mvt"
+    return JSONResponse(get_tilejson(get_tile_source().get_metadata(), tile_url))
+
+
+def values_endpoint(request: Request) -> Response:
+    """
+    Category and label of each adastra_uuid of one selection, joined to the pyramid tiles by the browser.
+    """
+    params = request.path_params
+    try:
+        units = get_tile_generator().get_unit_values(
+            params["type"], params["model"], params["indicator"], params["adm0"]
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    values = {uuid: [category, label] for uuid, category, label in zip(units.index, units["category"], units["label"])}
+    body = json.dumps(values).encode("utf-8")
+
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def generated_tile_endpoint(request: Request) -> Response:
+    """
+    Tile of one indicator and country, generated from the country-level files (see TileGenerator).
+    """
+    params = request.path_params
+    z, x, y = (int(params[key]) for key in ("z", "x", "y"))
+    try:
+        data = get_tile_generator().get_tile(
+            params["type"], params["model"], params["indicator"], params["adm0"], z, x, y
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    if not data:
+        return Response(status_code=204, headers={"Cache-Control": TILE_CACHE_CONTROL})
+
+    etag = f'"{hashlib.sha1(data).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Encoding"] = "gzip"
+    return Response(data, media_type=MVT_MEDIA_TYPE, headers=headers)
+
+
+# Raw tiles are compressed on the fly, pre-compressed ones pass through untouched
+tiles_app = GZipMiddleware(
+    Router(
+        routes=[
+            Route("/tiles.json", tilejson_endpoint, name="tilejson"),
+            Route("/{z:int}/{x:int}/{y:int}.mvt", tile_endpoint, name="tile"),
+            Route("/{type}/{model}/{indicator}/{adm0}/values.json", values_endpoint, name="values"),
+            Route(
+                "/{type}/{model}/{indicator}/{adm0}/{z:int}/{x:int}/{y:int}.mvt",
+                generated_tile_endpoint,
+                name="generated_tile",
+            ),
+        ]
+    ),
+    minimum_size=1024,
+)
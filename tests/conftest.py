@@ -0,0 +1,147 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import shapely
+
+from poc_shiny.app.storage import LocalBackend, MemoryBackend
+
+ADM1S = ["BR01", "BR02", "BR03"]
+
+
+def make_partition_table(adm1: str, n_units: int = 20, codes=(0, 1, 2, 3, 4, 5, 99), seed: int = 0) -> pa.Table:
+    """
+    Rows of one adm1 partition: 1 to 3 indicator values per unit, with per-mille shares summing to 1000.
+    """
+    rng = np.random.default_rng(seed)
+    rows = {
+        "adastra_uuid": [],
+        "label_admin_name": [],
+        "area_54009_unit": [],
+        "area_54009_indicator_unit": [],
+        "area_‰": [],
+        "indicator_value": [],
+        "geometry": [],
+    }
+    for unit in range(n_units):
+        k = int(rng.integers(1, 4))
+        values = rng.choice(codes, size=k, replace=False)
+        shares = rng.multinomial(1000, [1 / k] * k)
+        area = float(rng.uniform(100, 10000))
+        x, y = rng.uniform(-50, 50), rng.uniform(-20, 20)
+        geometry = shapely.to_wkb(shapely.box(x, y, x + 0.5, y + 0.5))
+        for value, share in zip(values, shares):
+            rows["adastra_uuid"].append(f"{adm1}-{unit:04d}")
+            rows["label_admin_name"].append(f"Unit {adm1} {unit}")
+            rows["area_54009_unit"].append(area)
+            rows["area_54009_indicator_unit"].append(area * share / 1000)
+            rows["area_‰"].append(int(share))
+            rows["indicator_value"].append(int(value))
+            rows["geometry"].append(geometry)
+    return pa.table(rows)
+
+
+def get_partition_path(
+    adm1: str, model: str = "aqueduct_4", indicator: str = "baseline_water_stress", adm0: str = "BRA"
+) -> str:
+    return f"model={model}/indicator={indicator}/adm0={adm0}/adm1={adm1}/type=admin/part-0.parquet"
+
+
+@pytest.fixture
+def memory_backend():
+    backend = MemoryBackend()
+    for i, adm1 in enumerate(ADM1S):
+        backend.write_table(get_partition_path(adm1), make_partition_table(adm1, seed=i))
+    return backend
+
+
+@pytest.fixture
+def local_backend(tmp_path):
+    for i, adm1 in enumerate(ADM1S):
+        path = tmp_path / get_partition_path(adm1)
+        path.parent.mkdir(parents=True)
+        pq.write_table(make_partition_table(adm1, seed=i), path)
+    return LocalBackend(str(tmp_path))
+
+
+def _read_varint(data: bytes, i: int) -> tuple:
+    value = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, i
+
+
+def _read_fields(data: bytes) -> list:
+    fields, i = [], 0
+    while i < len(data):
+        key, i = _read_varint(data, i)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, i = _read_varint(data, i)
+        elif wire_type == 1:
+            value, i = data[i : i + 8], i + 8
+        else:
+            size, i = _read_varint(data, i)
+            value, i = data[i : i + size], i + size
+        fields.append((field, value))
+    return fields
+
+
+def _read_packed(data: bytes) -> list:
+    values, i = [], 0
+    while i < len(data):
+        value, i = _read_varint(data, i)
+        values.append(value)
+    return values
+
+
+def decode_tile(data: bytes) -> dict:
+    """
+    Decode an MVT tile into {layer: (extent, [(properties, rings)])}, each ring a closed (n, 2) array
+    in tile coordinates. String and integer values only.
+    """
+    layers = {}
+    for _, layer in _read_fields(data):
+        fields = _read_fields(layer)
+        keys = [value.decode("utf-8") for field, value in fields if field == 3]
+        values = []
+        for field, value in fields:
+            if field == 4:
+                ((value_type, value),) = _read_fields(value)
+                values.append(value.decode("utf-8") if value_type == 1 else value)
+        features = []
+        for field, value in fields:
+            if field != 2:
+                continue
+            feature = dict(_read_fields(value))
+            tags = _read_packed(feature[2])
+            properties = {keys[tags[j]]: values[tags[j + 1]] for j in range(0, len(tags), 2)}
+            commands = _read_packed(feature[4])
+            rings, ring, cursor, i = [], [], np.zeros(2, dtype=np.int64), 0
+            while i < len(commands):
+                command, count = commands[i] & 0x7, commands[i] >> 3
+                i += 1
+                if command == 7:
+                    rings.append(np.array(ring + [ring[0]]))
+                    continue
+                for _ in range(count):
+                    dx, dy = ((v >> 1) ^ -(v & 1) for v in commands[i : i + 2])
+                    i += 2
+                    cursor = cursor + (dx, dy)
+                    if command == 1:
+                        ring = []
+                    ring.append(cursor.copy())
+            features.append((properties, rings))
+        layers[dict(fields)[1].decode("utf-8")] = (dict(fields)[5], features)
+    return layers
+
+
+def ring_area(ring: np.ndarray) -> float:
+    """
+    Surveyor's area of a closed ring, positive for the exterior rings of MVT (clockwise with y down).
+    """
+    return float(np.sum(ring[:-1, 0] * ring[1:, 1] - ring[1:, 0] * ring[:-1, 1])) / 2
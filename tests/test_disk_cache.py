@@ -0,0 +1,91 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fsspec.implementations.local import LocalFileSystem
+from pyarrow import fs as pafs
+
+from poc_shiny.app.disk_cache import DiskCache
+from poc_shiny.app.gcs_get_parquet import read_parquet_table
+from poc_shiny.app.repartition import rewrite_dataset
+
+
+def write_country_file(path, countries=("Brazil", "Peru")):
+    country = [c for c in countries for _ in range(3)]
+    pq.write_table(pa.table({"country": country, "adastra_uuid": [f"u{i}" for i in range(len(country))]}), path)
+
+
+def test_fetch_directory_keeps_the_partition_keys(tmp_path):
+    write_country_file(tmp_path / "admin_source.parquet")
+    remote = tmp_path / "remote" / "admin.parquet"
+    rewrite_dataset(str(tmp_path / "admin_source.parquet"), str(remote), sort_by=["country"], partition_by=["country"])
+
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=10 * 1024**2)
+    local_path = cache.fetch_directory(LocalFileSystem(), str(remote))
+    table = read_parquet_table(local_path, pafs.LocalFileSystem(), filter={"country": "Peru"})
+
+    assert table.column("country").to_pylist() == ["Peru"] * 3
+    assert cache.stats()["misses"] == 2
+
+    # Unchanged files are not downloaded again
+    assert cache.fetch_directory(LocalFileSystem(), str(remote)) == local_path
+    assert cache.stats()["misses"] == 2
+
+
+class CountingFileSystem(LocalFileSystem):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.info_calls = []
+
+    def info(self, path, **kwargs):
+        self.info_calls.append(path)
+        return super().info(path, **kwargs)
+
+
+def test_fetch_tells_files_from_directories(tmp_path):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    write_country_file(remote / "admin.parquet")
+    partitioned = str(remote / "partitioned.parquet")
+    rewrite_dataset(str(remote / "admin.parquet"), partitioned, sort_by=["country"], partition_by=["country"])
+    fs = CountingFileSystem(skip_instance_cache=True)
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=10 * 1024**2, revalidate_after=60)
+
+    file_path = cache.fetch(fs, str(remote / "admin.parquet"))
+    tree = cache.fetch(fs, partitioned)
+    assert read_parquet_table(file_path, pafs.LocalFileSystem()).num_rows == 6
+    assert read_parquet_table(tree, pafs.LocalFileSystem(), filter={"country": "Peru"}).num_rows == 3
+
+    # Within revalidate_after, a file costs no request and a directory no more than fetch_directory
+    fs.info_calls.clear()
+    assert cache.fetch(fs, str(remote / "admin.parquet")) == file_path
+    assert fs.info_calls == []
+    assert cache.fetch_directory(fs, partitioned) == tree
+    directory_calls = len(fs.info_calls)
+    fs.info_calls.clear()
+    assert cache.fetch(fs, partitioned) == tree
+    assert len(fs.info_calls) == directory_calls
+
+
+def test_fetch_directory_follows_new_versions(tmp_path):
+    remote = tmp_path / "remote"
+    (remote / "country=Brazil").mkdir(parents=True)
+    write_country_file(remote / "country=Brazil" / "part-0.parquet", countries=("Brazil",))
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=10 * 1024**2)
+    first = cache.fetch_directory(LocalFileSystem(), str(remote))
+
+    (remote / "country=Peru").mkdir()
+    write_country_file(remote / "country=Peru" / "part-0.parquet", countries=("Peru",))
+    second = cache.fetch_directory(LocalFileSystem(), str(remote))
+
+    assert second != first
+    assert read_parquet_table(second, pafs.LocalFileSystem()).num_rows == 6
+
+
+def test_fetch_directory_larger_than_the_cache(tmp_path):
+    remote = tmp_path / "remote"
+    for country in ["Brazil", "Peru"]:
+        (remote / f"country={country}").mkdir(parents=True)
+        write_country_file(remote / f"country={country}" / "part-0.parquet", countries=(country,))
+    size = (remote / "country=Brazil" / "part-0.parquet").stat().st_size
+
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=size + 1)
+    assert cache.fetch_directory(LocalFileSystem(), str(remote)) is None
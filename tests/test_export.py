@@ -0,0 +1,59 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+import pytest
+
+from poc_shiny.app.export import EXPORT_COLUMNS, iter_export, iter_row_batches, iter_table_csv
+
+SELECTION = {"model": "aqueduct_4", "indicator": "baseline_water_stress", "adm0": "BRA"}
+
+
+def read_export(data: bytes, export_format: str, schema: pa.Schema) -> pa.Table:
+    if export_format == "csv":
+        convert_options = pcsv.ConvertOptions(column_types=schema)
+        return pcsv.read_csv(io.BytesIO(data), convert_options=convert_options)
+    if export_format == "parquet":
+        return pq.read_table(io.BytesIO(data))
+    return pa.ipc.open_stream(data).read_all()
+
+
+@pytest.mark.parametrize("export_format", ["csv", "parquet", "arrow"])
+@pytest.mark.parametrize("type_area, n_batches", [("admin", 3), ("capital", 1)])
+def test_export_round_trip(memory_backend, export_format, type_area, n_batches):
+    batches = list(iter_row_batches(**SELECTION, type_area=type_area, backend=memory_backend, batch_rows=25))
+    expected = pa.Table.from_batches(batches)
+    assert len(batches) == n_batches
+    assert expected.column_names == EXPORT_COLUMNS
+
+    chunks = list(iter_export(iter(batches), export_format))
+    table = read_export(b"".join(chunks), export_format, expected.schema)
+
+    # One chunk per batch, and the end of the file
+    assert len(chunks) == n_batches + 1
+    assert table.equals(expected)
+    if type_area == "admin":
+        assert table.num_rows > 0
+        assert set(table.column("adm0").to_pylist()) == {"BRA"}
+    else:
+        # An empty selection still has its header and schema
+        assert table.num_rows == 0
+    if export_format == "parquet":
+        assert pq.ParquetFile(io.BytesIO(b"".join(chunks))).metadata.num_row_groups == n_batches
+
+
+def test_export_unknown_format():
+    with pytest.raises(ValueError, match="Unknown export format"):
+        list(iter_export(iter([]), "xlsx"))
+
+
+@pytest.mark.parametrize("n_rows", [0, 1, 10, 25])
+def test_table_csv_joins_to_to_csv(n_rows):
+    df = pd.DataFrame({"label": [f"unit {i}" for i in range(n_rows)], "share": [i / 7 for i in range(n_rows)]})
+
+    chunks = list(iter_table_csv(df, batch_rows=4))
+
+    assert len(chunks) == max(-(-n_rows // 4), 1)
+    assert "".join(chunks) == df.to_csv()
@@ -0,0 +1,100 @@
+import threading
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from poc_shiny.app import gcs_client
+
+
+def utcnow() -> datetime:
+    # google-auth stores the expiry as a naive UTC datetime
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    """
+    Fake the token endpoint, the client and the filesystem, and record the token refreshes.
+    """
+    refreshes = []
+    lifetime = {"value": timedelta(hours=1)}
+
+    def refresh(credentials, request):
+        # The pooled objects stay available while the token is requested
+        assert gcs_client._lock.acquire(blocking=False)
+        gcs_client._lock.release()
+        refreshes.append(threading.get_ident())
+        credentials.token = f"token-{len(refreshes)}"
+        credentials.expiry = utcnow() + lifetime["value"]
+
+    monkeypatch.setattr(gcs_client.Credentials, "refresh", refresh)
+    monkeypatch.setattr(gcs_client.storage, "Client", lambda **kwargs: object())
+    monkeypatch.setattr(gcs_client.gcsfs, "GCSFileSystem", lambda **kwargs: object())
+    gcs_client.reset()
+    yield refreshes, lifetime
+    gcs_client.reset()
+
+
+def test_token_is_refreshed_once_until_close_to_expiry(refreshes):
+    refreshes, lifetime = refreshes
+
+    credentials = gcs_client.get_credentials()
+    assert gcs_client.get_credentials() is credentials
+    assert (len(refreshes), credentials.token) == (1, "token-1")
+
+    # Within the margin of the expiry, the token is renewed
+    lifetime["value"] = gcs_client.TOKEN_REFRESH_MARGIN / 2
+    credentials.expiry = utcnow()
+    assert gcs_client.get_credentials().token == "token-2"
+    assert gcs_client.get_credentials().token == "token-3"
+    lifetime["value"] = timedelta(hours=1)
+    credentials.expiry = utcnow()
+    assert gcs_client.get_credentials().token == "token-4"
+    assert gcs_client.get_credentials().token == "token-4"
+    assert gcs_client.get_stats()["token_refresh"] == 4
+
+
+def test_concurrent_callers_share_one_refresh(refreshes, monkeypatch):
+    refreshes, _ = refreshes
+    refresh = gcs_client.Credentials.refresh
+    started, release = threading.Event(), threading.Event()
+
+    def slow_refresh(credentials, request):
+        started.set()
+        release.wait(timeout=5)
+        refresh(credentials, request)
+
+    monkeypatch.setattr(gcs_client.Credentials, "refresh", slow_refresh)
+    threads = [threading.Thread(target=gcs_client.get_credentials) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    started.wait(timeout=5)
+    # The stats do not wait for the refresh
+    assert gcs_client.get_stats()["token_refresh"] == 0
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(refreshes) == 1
+    assert gcs_client.get_stats()["token_refresh"] == 1
+
+
+def test_client_and_filesystem_are_reused(refreshes):
+    client = gcs_client.get_storage_client()
+    fs = gcs_client.get_gcsfs()
+    assert gcs_client.get_storage_client() is client
+    assert gcs_client.get_gcsfs() is fs
+
+    stats = gcs_client.get_stats()
+    assert {key: stats[key] for key in ["client_created", "client_reused", "fs_created", "fs_reused"]} == {
+        "client_created": 1,
+        "client_reused": 1,
+        "fs_created": 1,
+        "fs_reused": 1,
+    }
+    assert stats["token_refresh"] == 1
+    assert stats["token_expiry"] is not None
+
+    gcs_client.reset()
+    assert gcs_client.get_storage_client() is not client
+    assert gcs_client.get_stats()["client_created"] == 1
@@ -0,0 +1,54 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from poc_shiny.app.cancellation import CancellationToken, LoadCancelled
+from poc_shiny.app.get_local_data import get_data, get_data_plot_map, get_fpaths
+from poc_shiny.app.storage import MemoryBackend
+from tests.conftest import ADM1S, get_partition_path, make_partition_table
+
+
+@pytest.mark.parametrize("backend_fixture", ["memory_backend", "local_backend"])
+@pytest.mark.parametrize("max_in_flight", [1, 4])
+def test_get_data_reads_partition_prefixes(request, backend_fixture, max_in_flight):
+    backend = request.getfixturevalue(backend_fixture)
+    prefixes = get_fpaths(model="aqueduct_4", indicator="baseline_water_stress", adm0="BRA", backend=backend)
+    assert len(prefixes) == len(ADM1S)
+
+    df = get_data(prefixes, max_in_flight=max_in_flight, backend=backend)
+
+    assert list(df.columns).count("adm1") == 1
+    assert sorted(df["adm1"].astype(str).unique()) == ADM1S
+    # Only the columns of the files and adm1, none of the key=value folders above them
+    assert not {"model", "indicator", "adm0", "type"} & set(df.columns)
+    assert df.groupby("adastra_uuid", observed=True)["area_‰"].sum().eq(1000).all()
+
+
+def test_get_data_keeps_the_areas():
+    backend = MemoryBackend()
+    table = make_partition_table("BR01")
+    # Areas of the larger units, in square meters, which float32 rounds to 8 or 16
+    area = pa.array([123_456_789_012.25 + unit for unit in range(table.num_rows)])
+    table = table.set_column(table.schema.get_field_index("area_54009_unit"), "area_54009_unit", area)
+    backend.write_table(get_partition_path("BR01"), table)
+
+    prefixes = get_fpaths(model="aqueduct_4", indicator="baseline_water_stress", adm0="BRA", backend=backend)
+    df = get_data(prefixes, backend=backend)
+
+    assert df["area_54009_unit"].tolist() == area.to_pylist()
+
+
+def test_get_data_plot_map_cancellation(memory_backend):
+    selection = {"model": "aqueduct_4", "indicator": "baseline_water_stress", "adm0": "BRA", "backend": memory_backend}
+    df_plot, table_map, df_table = get_data_plot_map(**selection)
+
+    # The lazy scan is read before the outputs are collected, with the same results
+    token = CancellationToken()
+    df_plot_token, table_map_token, df_table_token = get_data_plot_map(**selection, cancel_token=token)
+    pd.testing.assert_frame_equal(df_plot_token, df_plot)
+    pd.testing.assert_frame_equal(df_table_token, df_table)
+    assert table_map_token.equals(table_map)
+
+    token.cancel()
+    with pytest.raises(LoadCancelled):
+        get_data_plot_map(**selection, cancel_token=token)
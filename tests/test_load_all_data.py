@@ -0,0 +1,138 @@
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pytest
+
+from poc_shiny.app.load_all_data import aggregate_units, join_areas
+
+
+def aggregate_previous(df_indicators: pd.DataFrame, admin_areas: pd.DataFrame):
+    """
+    The plot totals and unit labels of load_country_specific_data before aggregate_units, verbatim
+    but for the line wrapping.
+    """
+    df_indicators = df_indicators.copy()
+    df_indicators["indicator_value"] = (
+        df_indicators["indicator_value"].replace(["-9999", "-", "-1"], 99).astype("uint8")
+    )
+    df_indicators_with_area = pd.merge(df_indicators, admin_areas, on="adastra_uuid", how="left")
+    df_indicators_with_area["adjusted_area"] = (
+        df_indicators_with_area["area_ha"] * df_indicators_with_area["ratio_per_1000"] / 1000
+    )
+    grouped_df = df_indicators_with_area.groupby("indicator_value", as_index=False)["adjusted_area"].sum()
+    df_plot = grouped_df.rename(columns={"indicator_value": "value", "adjusted_area": "total_area_ha"})
+
+    grouped_df = df_indicators_with_area.groupby(["indicator_value","adastra_uuid"], as_index=False)
+    grouped_df = grouped_df["adjusted_area"].sum()
+    sum_per_uuid = df_indicators_with_area.groupby("adastra_uuid", as_index=False)["adjusted_area"].sum()
+    grouped_df = grouped_df.merge(sum_per_uuid, on="adastra_uuid", how="left")
+    grouped_df["ratio"] = grouped_df["adjusted_area_x"] / grouped_df["adjusted_area_y"]
+    grouped_df["ratio"] = grouped_df["ratio"].round(2)
+    grouped_df["label"] = grouped_df["indicator_value"].astype(str) + " (" + grouped_df["ratio"].astype(str) + ")"
+    grouped_df = grouped_df.groupby("adastra_uuid").agg({
+        "label": lambda x: ", ".join(x),
+        "indicator_value": "max"
+    }).reset_index()
+    grouped_df = grouped_df[["adastra_uuid", "label", "indicator_value"]]
+    return df_plot, grouped_df.set_index("adastra_uuid")
+
+
+def get_tied_units(df_indicators: pd.DataFrame) -> set:
+    """
+    The units with a share exactly halfway between two rounded values, which pandas rounded from
+    the float ratio and aggregate_units rounds half to even.
+    """
+    values = df_indicators["indicator_value"].replace(["-9999", "-", "-1"], "99")
+    per_value = df_indicators.groupby(["adastra_uuid", values])["ratio_per_1000"].sum()
+    per_unit = per_value.groupby(level="adastra_uuid").transform("sum")
+    return {
+        uuid
+        for (uuid, _), per_mille, total in zip(per_value.index, per_value, per_unit)
+        if Fraction(int(per_mille) * 100, int(total)).denominator == 2
+    }
+
+
+def aggregate(df_indicators: pd.DataFrame, admin_areas: pd.DataFrame):
+    with pl.StringCache():
+        lf = join_areas(pa.Table.from_pandas(df_indicators), pa.Table.from_pandas(admin_areas))
+        df_plot, units = pl.collect_all(aggregate_units(lf, "adjusted_area"))
+    units = units.to_pandas().astype({"adastra_uuid": str}).set_index("adastra_uuid")
+    return df_plot.to_pandas(), units
+
+
+def make_rows(rows: list, areas: dict):
+    """
+    Indicator rows from (adastra_uuid, indicator_value, ratio_per_1000) tuples, and the units of `areas`.
+    """
+    df_indicators = pd.DataFrame(rows, columns=["adastra_uuid", "indicator_value", "ratio_per_1000"])
+    admin_areas = pd.DataFrame({"adastra_uuid": list(areas), "area_ha": list(areas.values())})
+    return df_indicators, admin_areas
+
+
+def make_random_rows(seed: int, n_units: int = 500):
+    """
+    1 to 4 rows per unit with codes, missing values and repeated codes, and some shares of 335 per
+    mille, halfway between two rounded shares.
+    """
+    rng = np.random.default_rng(seed)
+    codes = ["0", "1", "2", "3", "4", "5", "99", "-9999", "-1", "-"]
+    rows, areas = [], {}
+    for unit in range(n_units):
+        uuid = f"BRA-{unit:05d}"
+        k = int(rng.integers(1, 5))
+        shares = [345, 320, 335][:k] if k <= 3 and rng.random() < 0.3 else rng.multinomial(1000, [1 / k] * k)
+        for share in shares:
+            rows.append((uuid, str(rng.choice(codes)), int(share)))
+        areas[uuid] = float(rng.uniform(10, 1e6))
+    df_indicators, admin_areas = make_rows(rows, areas)
+    return df_indicators.sample(frac=1, random_state=seed).reset_index(drop=True), admin_areas
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_aggregate_units_matches_previous_code(seed):
+    df_indicators, admin_areas = make_random_rows(seed)
+
+    df_plot, units = aggregate(df_indicators, admin_areas)
+    plot_reference, units_reference = aggregate_previous(df_indicators, admin_areas)
+
+    assert df_plot["value"].tolist() == plot_reference["value"].tolist()
+    np.testing.assert_allclose(df_plot["total_area_ha"], plot_reference["total_area_ha"])
+    units = units.loc[units_reference.index]
+    assert units["indicator_value"].tolist() == units_reference["indicator_value"].tolist()
+    # Rounding ties are checked in test_aggregate_units_unit
+    untied = ~units.index.isin(get_tied_units(df_indicators))
+    assert untied.sum() > 0
+    assert units.loc[untied, "label"].tolist() == units_reference.loc[untied, "label"].tolist()
+
+
+@pytest.mark.parametrize(
+    "rows, label, value",
+    [
+        ([("1", 900), ("99", 100)], "1 (0.9), 99 (0.1)", 99),
+        ([("3", 500), ("2", 500)], "2 (0.5), 3 (0.5)", 3),
+        # Repeated rows of a code are summed
+        ([("2", 300), ("3", 400), ("2", 300)], "2 (0.6), 3 (0.4)", 3),
+        ([("4", 1000)], "4 (1.0)", 4),
+        ([("0", 70), ("1", 930)], "0 (0.07), 1 (0.93)", 1),
+        # No data only
+        ([("-9999", 1000)], "99 (1.0)", 99),
+        ([("-", 600), ("-1", 400)], "99 (1.0)", 99),
+        # Ties round half to even
+        ([("2", 345), ("5", 320), ("-1", 335)], "2 (0.34), 5 (0.32), 99 (0.34)", 99),
+        ([("1", 125), ("2", 875)], "1 (0.12), 2 (0.88)", 2),
+        ([("1", 5), ("2", 995)], "1 (0.0), 2 (1.0)", 2),
+        ([("1", 15), ("2", 985)], "1 (0.02), 2 (0.98)", 2),
+        # A unit of no weight
+        ([("1", 0)], "1 (nan)", 1),
+    ],
+)
+def test_aggregate_units_unit(rows, label, value):
+    df_indicators, admin_areas = make_rows([("BRA-00001", *row) for row in rows], {"BRA-00001": 1027.8})
+
+    _, units = aggregate(df_indicators, admin_areas)
+
+    assert units.loc["BRA-00001", "label"] == label
+    assert units.loc["BRA-00001", "indicator_value"] == value
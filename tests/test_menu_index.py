@@ -0,0 +1,60 @@
+import json
+
+from poc_shiny.app.menu_index import MenuIndex, fpath_menu, load_menu_index
+
+
+def get_previous_selections(menu: list) -> set:
+    """
+    The (type, model, indicator) selections offered by the nested scans of menu.json that
+    app.py used before the index: the last node of a duplicated id wins.
+    """
+
+    def last_children(nodes: list, node_id: str) -> list:
+        children = None
+        for node in nodes:
+            if node.get("id") == node_id:
+                children = node.get("children")
+        return children or []
+
+    selections = set()
+    for type_node in menu:
+        for model in {node.get("id") for node in type_node.get("children")}:
+            for indicator in last_children(type_node.get("children"), model):
+                selections.add((type_node.get("id"), model, indicator.get("id")))
+    return selections
+
+
+def test_menu_index_offers_the_previous_selections():
+    with open(fpath_menu, encoding="utf-8-sig") as f:
+        menu = json.load(f)
+    index = load_menu_index()
+
+    selections = {
+        (type_area, model, indicator)
+        for type_area in index.get_children()
+        for model in index.get_children(type_area)
+        for indicator in index.get_children(type_area, model)
+    }
+
+    assert selections == get_previous_selections(menu)
+    assert index.get_label("admin", "aqueduct_3") == "Aqueduct 3"
+    assert "baseline_water_stress" not in index.get_children("admin", "aqueduct_3")
+
+
+def test_menu_index_keeps_the_last_duplicate():
+    menu = [
+        {
+            "id": "admin",
+            "name": "Admin",
+            "children": [
+                {"id": "m", "name": "Copy", "children": [{"id": "a", "name": "A", "children": []}]},
+                {"id": "n", "name": "N", "children": []},
+                {"id": "m", "name": "M", "children": [{"id": "b", "name": "B", "children": []}]},
+            ],
+        }
+    ]
+    index = MenuIndex(menu)
+
+    assert index.get_children("admin") == {"m": "M", "n": "N"}
+    assert index.get_children("admin", "m") == {"b": "B"}
+    assert index.get_children("admin", "m", "a") == {}
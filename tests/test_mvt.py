@@ -0,0 +1,39 @@
+import numpy as np
+import shapely
+
+from poc_shiny.app.mvt import EXTENT, encode_layer
+from tests.conftest import decode_tile, ring_area
+
+
+def test_encode_layer_round_trip():
+    with_hole = shapely.Polygon(
+        [(100, 100), (1000, 100), (1000, 1000), (100, 1000)], holes=[[(300, 300), (300, 600), (600, 600), (600, 300)]]
+    )
+    # Counter-clockwise in tile coordinates, the encoder winds it clockwise
+    triangle = shapely.Polygon([(2000, 2000), (2000, 2600), (2600, 2000)])
+    multi = shapely.MultiPolygon([shapely.box(3000, 3000, 3100.4, 3100.4), shapely.box(3500, 3500, 3600, 3600)])
+    geometries = [with_hole, None, triangle, multi, shapely.box(10, 10, 10.2, 10.2)]
+    properties = {"adastra_uuid": ["a", "b", "c", "d", "e"], "indicator_value": [1, 2, 3, 99, 4]}
+
+    extent, features = decode_tile(encode_layer("admin", geometries, properties))["admin"]
+
+    assert extent == EXTENT
+    # The empty and collapsed geometries are skipped
+    assert [properties["adastra_uuid"] for properties, _ in features] == ["a", "c", "d"]
+    assert [properties["indicator_value"] for properties, _ in features] == [1, 3, 99]
+    for (_, rings), expected in zip(features, [with_hole, triangle, multi]):
+        exteriors = [ring for ring in rings if ring_area(ring) > 0]
+        polygons = [shapely.Polygon(exterior) for exterior in exteriors]
+        decoded = shapely.MultiPolygon(polygons) if len(polygons) > 1 else polygons[0]
+        holes = [shapely.Polygon(ring) for ring in rings if ring_area(ring) < 0]
+        if holes:
+            decoded = decoded.difference(shapely.union_all(holes))
+        # Coordinates are rounded to the integer grid of the tile
+        assert decoded.symmetric_difference(shapely.set_precision(expected, 1)).area == 0
+    # One exterior ring and one hole, wound in opposite directions
+    areas = [ring_area(ring) for ring in features[0][1]]
+    assert np.allclose(areas, [810000, -90000])
+
+
+def test_encode_layer_empty():
+    assert encode_layer("admin", [None, shapely.Polygon()], {"adastra_uuid": ["a", "b"]}) == b""
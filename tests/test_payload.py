@@ -0,0 +1,69 @@
+import pandas as pd
+import pyarrow as pa
+
+from poc_shiny.app.get_local_data import get_data_plot_map
+from poc_shiny.app.payload import build_payload, get_map_table, get_plot_frame
+
+
+def test_get_plot_frame_normalizes_per_adm1():
+    df_plot = pd.DataFrame(
+        {
+            "adm1_name": pd.Categorical(["BR01", "BR01", "BR01", "BR02"], categories=["BR01", "BR02", "BR03"]),
+            "indicator_value_name": ["Low (<10%)", "High (40-80%)", "No Data", "Low (<10%)"],
+            "area_54009_indicator_unit": [250.0, 700.0, 50.0, 12.5],
+        }
+    )
+
+    df = get_plot_frame(df_plot)
+
+    assert df["normalized_area"].tolist() == [25.0, 70.0, 5.0, 100.0]
+    assert df["normalized_area_text"].tolist() == ["25.0%", "70.0%", "5.0%", "100.0%"]
+    # The loaded frame is shared and left as it is
+    assert "normalized_area" not in df_plot.columns
+
+
+def test_get_plot_frame_rounds_to_whole_percents():
+    df_plot = pd.DataFrame({"adm1_name": ["BR01"] * 3, "area_54009_indicator_unit": [1.0, 1.0, 1.0]})
+
+    df = get_plot_frame(df_plot)
+
+    assert df["normalized_area"].tolist() == [33.0, 33.0, 33.0]
+    assert df["normalized_area_text"].tolist() == ["33.0%"] * 3
+
+
+def test_get_map_table():
+    table = pa.table(
+        {
+            "adastra_uuid": pa.array(["u1", "u2"]).dictionary_encode(),
+            "indicator_value_name": pa.array(["Low (<10%)", "No Data"]).dictionary_encode(),
+            "label": ["1 (1.0)", "99 (1.0)"],
+            "geometry": pa.array([b"\x01", b"\x02"]),
+        }
+    )
+    table = table.cast(table.schema.set(3, table.schema.field("geometry").with_metadata({"crs": "EPSG:4326"})))
+
+    map_table = get_map_table(table)
+
+    assert map_table.column_names == ["Category", "List of category", "geometry"]
+    assert map_table.schema.field("Category").type == pa.string()
+    assert map_table.column("Category").to_pylist() == ["Low (<10%)", "No Data"]
+    assert map_table.schema.field("geometry").metadata == {b"crs": b"EPSG:4326"}
+
+
+def test_build_payload(memory_backend):
+    selection = {"model": "aqueduct_4", "indicator": "baseline_water_stress", "adm0": "BRA"}
+    df_plot, table_map, df_table = get_data_plot_map(**selection, backend=memory_backend)
+
+    payload = build_payload(**selection, type_area="admin", df_plot=df_plot, df_table=df_table, table_map=table_map)
+
+    # Each category rounds by at most half a percent
+    per_adm1 = payload.plot.groupby("adm1_name", observed=True)["normalized_area"]
+    assert ((per_adm1.sum() - 100).abs() <= per_adm1.size() / 2).all()
+    assert payload.table is df_table
+    assert payload.map.num_rows == table_map.num_rows == len(payload.fill_colors)
+    assert "adastra_uuid" not in payload.map.column_names
+    assert payload.load_id and payload.lod == 0
+
+    # Without a map, nothing of it is kept
+    payload = build_payload(**selection, type_area="admin", df_plot=df_plot, df_table=df_table)
+    assert (payload.map, payload.fill_colors, payload.load_id) == (None, None, "")
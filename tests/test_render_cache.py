@@ -0,0 +1,37 @@
+from poc_shiny.app import render_cache
+from poc_shiny.app.get_local_data import get_data_plot_map
+from poc_shiny.app.payload import build_payload
+from poc_shiny.app.render_cache import get_polygon_layer
+
+SERIALIZED_TRAITS = ["table", "get_fill_color"]
+
+
+def load_payload(backend):
+    selection = {"model": "aqueduct_4", "indicator": "baseline_water_stress", "adm0": "BRA", "type_area": "admin"}
+    df_plot, table_map, df_table = get_data_plot_map(**selection, backend=backend)
+    return build_payload(**selection, df_plot=df_plot, df_table=df_table, table_map=table_map)
+
+
+def test_cached_polygon_layer_sends_the_same_buffers(memory_backend):
+    payload = load_payload(memory_backend)
+
+    layer = get_polygon_layer(payload)
+    cached_layer = get_polygon_layer(payload)
+
+    assert cached_layer is not layer
+    assert cached_layer.get_state(SERIALIZED_TRAITS) == layer.get_state(SERIALIZED_TRAITS)
+
+
+def test_polygon_layer_of_a_new_read_is_rebuilt(memory_backend, monkeypatch):
+    built = []
+    put = render_cache.render_cache.put
+    monkeypatch.setattr(render_cache.render_cache, "put", lambda key, value: (built.append(key), put(key, value)))
+    payload = load_payload(memory_backend)
+
+    get_polygon_layer(payload)
+    get_polygon_layer(payload)
+    # Same selection, read again: the layer of the previous read is not reused
+    get_polygon_layer(load_payload(memory_backend))
+
+    assert len(built) == 2
+    assert built[0][:-1] == built[1][:-1] and built[0][-1] != built[1][-1]
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from poc_shiny.app.get_local_data import get_data_plot_map, scan_data
+from poc_shiny.app.repartition import compact_partitions, rewrite_dataset, sort_table
+from poc_shiny.app.storage import LocalBackend
+from tests.conftest import ADM1S, get_partition_path, make_partition_table
+
+COMPACTED_PATH = "model=aqueduct_4/indicator=baseline_water_stress/adm0=BRA/type=admin/part-0.parquet"
+
+
+def test_sort_table_without_sort_keys():
+    table = pa.table({"value": [3, 1, 2]})
+    assert sort_table(table, ["adastra_uuid"]).equals(table)
+
+
+def write_partition_tree(source):
+    for i, adm1 in enumerate(ADM1S):
+        directory = (source / get_partition_path(adm1)).parent
+        directory.mkdir(parents=True)
+        table = make_partition_table(adm1, seed=i)
+        pq.write_table(table.slice(0, 10), directory / "part-0.parquet")
+        pq.write_table(table.slice(10), directory / "part-1.parquet")
+
+
+def test_compact_merges_the_adm1_files_of_a_country(tmp_path):
+    source = tmp_path / "data"
+    write_partition_tree(source)
+    # Country-level files and aggregates next to the tree, without any sort key
+    pq.write_table(pa.table({"value": [1]}), source / "admin.parquet")
+    aggregates = source / "aggregates/admin/aqueduct_4/baseline_water_stress/BRA"
+    aggregates.mkdir(parents=True)
+    pq.write_table(pa.table({"value": [1]}), aggregates / "plot.parquet")
+    pq.write_table(pa.table({"value": [2]}), aggregates / "table.parquet")
+
+    summary = compact_partitions(str(source), str(tmp_path / "out"))
+
+    assert summary["directories"] == 1
+    assert summary["files_in"] == 2 * len(ADM1S)
+    assert summary["files_out"] == 1
+    outputs = [p.relative_to(tmp_path / "out").as_posix() for p in (tmp_path / "out").rglob("*.parquet")]
+    assert outputs == [COMPACTED_PATH]
+    compacted = pq.ParquetFile(tmp_path / "out" / COMPACTED_PATH)
+    # One adm1 per row group, sorted by adm1 then adastra_uuid
+    assert compacted.metadata.num_row_groups == len(ADM1S)
+    table = compacted.read()
+    expected = pa.concat_tables([make_partition_table(adm1, seed=i) for i, adm1 in enumerate(ADM1S)])
+    assert table.num_rows == expected.num_rows
+    assert table.column("adm1").to_pylist() == sorted(table.column("adm1").to_pylist())
+    assert table.column("adastra_uuid").to_pylist() == sorted(expected.column("adastra_uuid").to_pylist())
+
+
+def test_compact_splits_large_countries(tmp_path):
+    write_partition_tree(tmp_path / "data")
+    rows = sum(make_partition_table(adm1, seed=i).num_rows for i, adm1 in enumerate(ADM1S))
+
+    summary = compact_partitions(str(tmp_path / "data"), str(tmp_path / "out"), max_rows_per_file=50)
+
+    assert summary["files_out"] == -(-rows // 50)
+    files = sorted((tmp_path / "out").rglob("*.parquet"))
+    assert [pq.read_metadata(f).num_rows for f in files] == [50] * (len(files) - 1) + [rows - 50 * (len(files) - 1)]
+
+
+def test_compacted_tree_reads_as_the_partition_tree(tmp_path):
+    write_partition_tree(tmp_path / "data")
+    compact_partitions(str(tmp_path / "data"), str(tmp_path / "out"))
+    selection = {"model": "aqueduct_4", "indicator": "baseline_water_stress", "adm0": "BRA"}
+
+    for adm1 in ["*", "BR02"]:
+        tables = [
+            scan_data(**selection, adm1=adm1, type_area="admin", backend=LocalBackend(str(tmp_path / root)))
+            for root in ["data", "out"]
+        ]
+        tables = [sort_table(table.select(sorted(table.column_names)), ["adastra_uuid"]) for table in tables]
+        assert tables[0].num_rows > 0
+        assert tables[0].equals(tables[1])
+
+    outputs = [get_data_plot_map(**selection, backend=LocalBackend(str(tmp_path / root))) for root in ["data", "out"]]
+    pd.testing.assert_frame_equal(outputs[0][2], outputs[1][2])
+
+
+def make_country_rows(n_rows: int = 5000, seed: int = 0) -> pa.Table:
+    rng = np.random.default_rng(seed)
+    return pa.table(
+        {
+            "country": rng.choice(["BRA", "NGA", "PER", None], size=n_rows).tolist(),
+            "indicator_name": rng.choice(["bws_cat", "bwd_cat"], size=n_rows),
+            "adastra_uuid": [f"U{v:06d}" for v in rng.integers(0, 10**6, size=n_rows)],
+            "ratio_per_1000": rng.integers(0, 1000, size=n_rows),
+        }
+    )
+
+
+def test_rewrite_dataset_sorts_a_file(tmp_path):
+    table = make_country_rows()
+    pq.write_table(table, tmp_path / "rows.parquet", row_group_size=700)
+    sort_by = ["country", "indicator_name", "adastra_uuid"]
+
+    summary = rewrite_dataset(
+        str(tmp_path / "rows.parquet"), str(tmp_path / "out/rows.parquet"), sort_by, row_group_bytes=20_000
+    )
+
+    rewritten = pq.ParquetFile(tmp_path / "out/rows.parquet")
+    assert rewritten.read().equals(sort_table(table, sort_by))
+    assert rewritten.metadata.num_row_groups == summary["row_groups"] > 1
+    # Full row groups but the last one
+    sizes = [rewritten.metadata.row_group(i).num_rows for i in range(rewritten.metadata.num_row_groups)]
+    assert set(sizes[:-1]) == {summary["rows_per_group"]}
+
+
+def test_rewrite_dataset_partitions(tmp_path):
+    table = make_country_rows()
+    pq.write_table(table, tmp_path / "rows.parquet")
+
+    rewrite_dataset(
+        str(tmp_path / "rows.parquet"), str(tmp_path / "out"), ["country", "adastra_uuid"], partition_by=["country"]
+    )
+
+    for country in ["BRA", "NGA", "PER"]:
+        rewritten = pq.ParquetFile(tmp_path / f"out/country={country}/part-0.parquet").read()
+        expected = sort_table(table.filter(ds.field("country") == country), ["adastra_uuid"]).drop_columns("country")
+        assert rewritten.equals(expected)
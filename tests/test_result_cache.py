@@ -0,0 +1,36 @@
+import numpy as np
+import shapely
+
+from poc_shiny.app.result_cache import STRTREE_ITEM_BYTES, ResultCache, estimate_size
+
+
+def make_geometries(n: int, points: int = 1000):
+    """
+    `n` polygons of `points` coordinates, their unit ids and their STRtree.
+    """
+    angles = np.linspace(0, 2 * np.pi, points)
+    ring = np.column_stack([np.cos(angles), np.sin(angles)])
+    ring[-1] = ring[0]
+    geometries = shapely.polygons([ring + i for i in range(n)])
+    uuids = np.array([f"BRA-{i:05d}" for i in range(n)], dtype=object)
+    return uuids, geometries, shapely.STRtree(geometries)
+
+
+def test_estimate_size_counts_geometries_and_ids():
+    uuids, geometries, tree = make_geometries(10)
+
+    assert estimate_size(geometries) == geometries.nbytes + 10 * 1000 * 16
+    assert estimate_size(uuids) > uuids.nbytes + 10 * len("BRA-00000")
+    assert estimate_size(tree) == 10 * STRTREE_ITEM_BYTES
+    assert estimate_size((uuids, geometries, tree)) > 10 * 1000 * 16
+
+
+def test_result_cache_evicts_geometries():
+    # Room for about two entries of 10 polygons of 1000 coordinates
+    cache = ResultCache(max_bytes=2 * 10 * 1000 * 16 + 10_000, ttl=60)
+    for key in range(3):
+        cache.put(key, make_geometries(10))
+
+    assert cache.get(0) is None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["size_bytes"] <= cache.max_bytes
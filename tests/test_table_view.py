@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from poc_shiny.app.get_local_data import get_data_plot_map, get_table_column_order
+from poc_shiny.app.table_view import format_table, get_page, get_share_columns
+
+
+def make_table(n_rows: int, model: str = "aqueduct_4") -> pd.DataFrame:
+    columns = get_table_column_order(model)
+    df = pd.DataFrame({"Country": ["BRA"] * n_rows, "Municipality name": [f"unit {i}" for i in range(n_rows)]})
+    df["Administrative unit 1 name"] = "Acre"
+    df["Area"] = np.arange(n_rows, dtype="float64") * 1000
+    for column in columns[4:]:
+        df[column] = np.zeros(n_rows, dtype="float32")
+    return df[columns]
+
+
+@pytest.mark.parametrize(
+    "page, shown, rows",
+    [
+        (1, 1, range(0, 100)),
+        (2, 2, range(100, 200)),
+        (3, 3, range(200, 250)),
+        # Pages out of the table are clamped to the first or the last one
+        (0, 1, range(0, 100)),
+        (None, 1, range(0, 100)),
+        (-2, 1, range(0, 100)),
+        (7, 3, range(200, 250)),
+        # The page input may come as text
+        ("2", 2, range(100, 200)),
+    ],
+)
+def test_get_page(page, shown, rows):
+    df = make_table(250)
+
+    page_df, page_shown = get_page(df, page, page_rows=100)
+
+    assert page_shown == shown
+    assert page_df["Municipality name"].tolist() == [f"unit {i}" for i in rows]
+
+
+@pytest.mark.parametrize("n_rows, pages", [(0, 1), (1, 1), (100, 1), (101, 2)])
+def test_get_page_last_page(n_rows, pages):
+    df = make_table(n_rows)
+
+    page_df, page = get_page(df, 10**6, page_rows=100)
+
+    assert page == pages
+    assert len(page_df) == n_rows - (pages - 1) * 100
+
+
+@pytest.mark.parametrize("model", ["aqueduct_4", "aware"])
+def test_format_table(model):
+    df = make_table(4, model)
+    shares = get_share_columns(model)
+    df[shares[0]] = np.array([368, 1000, 0, 1000 / 3], dtype="float32")
+    df[shares[-1]] = np.array([632, 0, 1000, 2000 / 3], dtype="float32")
+
+    formatted = format_table(df, model)
+
+    assert formatted[shares[0]].tolist() == ["36.8%", "100.0%", "0.0%", "33.3%"]
+    assert formatted[shares[-1]].tolist() == ["63.2%", "0.0%", "100.0%", "66.7%"]
+    assert set(formatted[shares[1]]) == {"0.0%"}
+    # The other columns and the frame given are left as they are
+    pd.testing.assert_frame_equal(formatted.drop(columns=shares), df.drop(columns=shares))
+    assert df[shares[0]].dtype == "float32"
+
+
+def test_format_table_of_a_loaded_page(memory_backend):
+    _, _, df_table = get_data_plot_map(
+        model="aqueduct_4", indicator="baseline_water_stress", adm0="BRA", backend=memory_backend
+    )
+    page_df, _ = get_page(df_table, 2, page_rows=25)
+
+    formatted = format_table(page_df, "aqueduct_4")
+
+    shares = get_share_columns("aqueduct_4")
+    assert formatted.index.equals(page_df.index)
+    assert formatted[shares].stack().str.fullmatch(r"\d{1,3}\.\d%").all()
+    np.testing.assert_allclose(
+        formatted[shares].apply(lambda s: s.str.rstrip("%").astype(float)), page_df[shares] / 10, atol=0.05
+    )
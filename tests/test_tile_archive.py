@@ -0,0 +1,24 @@
+import gzip
+import json
+
+from poc_shiny.app.tile_archive import GZIP_MAGIC, MBTilesTileSource, pack_mbtiles
+
+
+def test_pack_mbtiles_gzips_tiles(tmp_path):
+    tiles_dir = tmp_path / "tiles"
+    tiles = {(0, 0, 0): b"\x1a\x02raw", (1, 1, 0): gzip.compress(b"\x1a\x02packed")}
+    for (z, x, y), data in tiles.items():
+        (tiles_dir / str(z) / str(x)).mkdir(parents=True)
+        (tiles_dir / str(z) / str(x) / f"{y}.mvt").write_bytes(data)
+    (tiles_dir / "metadata.json").write_text(json.dumps({"name": "test", "minzoom": 0, "maxzoom": 1}))
+
+    summary = pack_mbtiles(tiles_dir, tmp_path / "tiles.mbtiles")
+    source = MBTilesTileSource(tmp_path / "tiles.mbtiles")
+
+    assert summary["tiles"] == 2
+    raw, _ = source.get_tile(0, 0, 0)
+    assert raw[:2] == GZIP_MAGIC and gzip.decompress(raw) == b"\x1a\x02raw"
+    # Pre-compressed tiles are stored as is
+    assert source.get_tile(1, 1, 0)[0] == tiles[(1, 1, 0)]
+    assert source.get_tile(1, 0, 0) == (None, None)
+    source.close()
@@ -0,0 +1,95 @@
+import gzip
+
+import numpy as np
+import pyarrow as pa
+import pytest
+import shapely
+
+from poc_shiny.app.mvt import EXTENT
+from poc_shiny.app.storage import MemoryBackend
+from poc_shiny.app.tile_generator import TILE_BUFFER, TileGenerator
+from tests.conftest import decode_tile
+
+
+@pytest.fixture
+def generator():
+    backend = MemoryBackend()
+    units = {
+        # Across the tiles of zoom 1
+        "BRA-0001": ("BRA", shapely.box(-20, -10, 20, 10)),
+        "BRA-0002": ("BRA", shapely.box(-60, -30, -50, -20)),
+        # Over BRA-0001, in another country
+        "NGA-0001": ("NGA", shapely.box(-5, -5, 5, 5)),
+    }
+    backend.write_table(
+        "admin.parquet",
+        pa.table(
+            {
+                "adastra_uuid": list(units),
+                "country": [country for country, _ in units.values()],
+                "geom": [shapely.to_wkb(geometry) for _, geometry in units.values()],
+            }
+        ),
+    )
+    rows = [
+        ("BRA-0001", "BRA", "bws_cat", "1", 600),
+        ("BRA-0001", "BRA", "bws_cat", "-9999", 400),
+        ("BRA-0002", "BRA", "bws_cat", "3", 500),
+        ("BRA-0002", "BRA", "bws_cat", "2", 500),
+        ("NGA-0001", "NGA", "bws_cat", "4", 1000),
+        ("BRA-0001", "BRA", "aware_cat", "-9999", 700),
+        ("BRA-0001", "BRA", "aware_cat", "99", 300),
+    ]
+    columns = ["adastra_uuid", "country", "indicator_name", "indicator_value", "ratio_per_1000"]
+    backend.write_table("df_admin_indicators.parquet", pa.table(dict(zip(columns, map(list, zip(*rows))))))
+    backend.write_json(
+        "indicators.json",
+        {
+            "aqueduct_4": {"baseline_water_stress": {"indicator": "bws_cat"}},
+            "aware": {"aware": {"indicator": "aware_cat"}},
+        },
+    )
+    return TileGenerator(backend, max_zoom=4)
+
+
+def test_unit_values_of_one_country(generator):
+    units = generator.get_unit_values("admin", "aqueduct_4", "baseline_water_stress", "BRA")
+
+    assert sorted(units.index) == ["BRA-0001", "BRA-0002"]
+    # The largest share, not the highest code, and the lowest code on a tie
+    assert units.loc["BRA-0001", "indicator_value"] == 1
+    assert units.loc["BRA-0001", "label"] == "1 (0.6), 99 (0.4)"
+    assert units.loc["BRA-0002", "indicator_value"] == 2
+
+
+def test_unit_values_aware_no_data(generator):
+    # 99 is the "90" class of AWARE, its missing values are 101
+    units = generator.get_unit_values("admin", "aware", "aware", "BRA")
+
+    assert units.loc["BRA-0001", "indicator_value"] == 101
+    assert units.loc["BRA-0001", "category"] == "No Data"
+    assert units.loc["BRA-0001", "label"] == "99 (0.3), 101 (0.7)"
+
+
+def test_tiles_are_clipped_to_the_country(generator):
+    tiles, categories = {}, {}
+    for x, y in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+        data = generator.get_tile("admin", "aqueduct_4", "baseline_water_stress", "BRA", 1, x, y)
+        extent, layer = decode_tile(gzip.decompress(data))["admin"]
+        assert extent == EXTENT
+        for properties, rings in layer:
+            tiles.setdefault(properties["adastra_uuid"], []).append((x, y))
+            categories[properties["adastra_uuid"]] = properties["category"]
+            coords = np.concatenate(rings)
+            assert coords.min() >= -TILE_BUFFER and coords.max() <= EXTENT + TILE_BUFFER
+
+    # BRA-0001 is cut into the 4 tiles, NGA-0001 is not drawn on the BRA map
+    assert tiles == {"BRA-0001": [(0, 0), (1, 0), (0, 1), (1, 1)], "BRA-0002": [(0, 1)]}
+    assert categories["BRA-0001"] == "Low (<10%)"
+
+
+def test_empty_and_invalid_tiles(generator):
+    # Far from every unit
+    assert generator.get_tile("admin", "aqueduct_4", "baseline_water_stress", "BRA", 4, 0, 0) == b""
+    with pytest.raises(ValueError):
+        generator.get_tile("admin", "aqueduct_4", "baseline_water_stress", "BRA", 5, 0, 0)